@@ -1,12 +1,25 @@
 import logging
+import time
+from contextlib import nullcontext
 from dataclasses import dataclass
+from typing import Callable
 
 import pandas as pd
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, Header, HTTPException, Response, status, Depends
+from fastapi.responses import PlainTextResponse
 
 from app.dependencies import verify_token
-from app.models.schemas import ClientMBARequest
+from app.models.schemas import ClientMBABatchRequest, ClientMBARequest
+from app.services.batch import run_mba_batch
+from app.services.jobs import job_store
 from app.services.market_basket import run_mba_pipeline
+from app.services.metrics import track_pipeline
+from app.services.mining_pool import MiningPoolBusy, mining_pool
+from app.services.profiling import PROFILE_HEADER, SamplingProfiler, profile_requested, profile_sampled, profile_store
+from app.services.result_cache import result_cache
+from app.services.rule_index import rule_index_store
+from app.services.single_flight import mba_flights, mba_request_key
+from app.services.snapshot import snapshot_store
 from app.logger import get_client_logger, set_client_context, clear_client_context
 
 logger = logging.getLogger(__name__)
@@ -18,6 +31,18 @@ class ClientConfig:
     db_url: str
     min_support: float
     query: str
+    # Segundos que el snapshot en memoria se considera vigente; 0 desactiva el snapshot
+    snapshot_ttl: float = 3600.0
+    # Columna monótona (ej. order_id) para refrescar el snapshot solo con las líneas nuevas
+    watermark_column: str | None = None
+    # Motor de minado por defecto: auto, apriori, fpgrowth o fpmax (ver mining.MINING_ENGINES)
+    mining_engine: str = "auto"
+    # Soporte de los itemsets del índice de reglas, minados sobre todas las órdenes tras
+    # cada refresh; el índice cubre las búsquedas con min_support * órdenes filtradas
+    # por encima de ese conteo. None lo desactiva y todas las búsquedas se minan
+    rule_index_min_support: float | None = None
+    # Minar solo itemsets con productos de cada término buscado (ver compute_rules)
+    constrained_mining: bool = False
 
 
 class BaseClient:
@@ -43,6 +68,114 @@ class BaseClient:
         """Sobreescribir para aplicar limpieza/transformacion antes del MBA."""
         return df
 
+    def _transform_fn(self) -> Callable[[pd.DataFrame], pd.DataFrame] | None:
+        """transform_data solo si el cliente lo sobreescribe: si no, el pipeline no materializa nombres."""
+        if type(self).transform_data is BaseClient.transform_data:
+            return None
+        return self.transform_data
+
+    def _resolve_data(self, config: ClientConfig, client_logger):
+        """Snapshot vigente e índice de reglas de su versión (None, None si el snapshot está desactivado)."""
+        if config.snapshot_ttl <= 0:
+            return None, None
+        snapshot = snapshot_store.get(config, client_logger)
+        rule_index = rule_index_store.get(config.name, snapshot.version)
+        if rule_index is None:
+            rule_index_store.ensure(config, snapshot)
+        return snapshot, rule_index
+
+    def _analyze(
+        self,
+        request: ClientMBARequest,
+        product_names: list[str],
+        client_logger,
+        progress: Callable[[str], None] | None = None,
+        cached: bool = True,
+    ) -> list[dict] | None:
+        """
+        Reglas para una búsqueda: caché de resultados, luego coalescing y pipeline.
+        Sin `cached` el pipeline corre siempre (ej. al perfilar).
+        """
+        config = self.get_config()
+        snapshot, rule_index = self._resolve_data(config, client_logger)
+
+        engine = request.engine or config.mining_engine
+        constrained = request.constrained if request.constrained is not None else config.constrained_mining
+        data_version = snapshot.version if snapshot is not None else None
+        # Solicitudes idénticas concurrentes (ej. refresh de un dashboard) comparten un solo cómputo.
+        # La clave distingue si había índice de reglas: lo minado bajo demanda mientras el
+        # índice se construye no se sirve después en lugar de la respuesta del índice
+        request_key = mba_request_key(
+            config.name, product_names, config.min_support, request.top_n, data_version, engine, constrained,
+            request.metric, _index_source(rule_index),
+        )
+
+        def compute():
+            with track_pipeline(config.name) as stats:
+                rules = run_mba_pipeline(
+                    product_names=product_names,
+                    query=config.query,
+                    db_url=config.db_url,
+                    min_support=config.min_support,
+                    transform_fn=self._transform_fn(),
+                    top_n=request.top_n,
+                    client_logger=client_logger,
+                    partial_match=True,  # Búsqueda parcial case-insensitive por defecto
+                    snapshot=snapshot,
+                    engine=engine,
+                    rule_index=rule_index,
+                    constrained=constrained,
+                    progress=progress,
+                    metric=request.metric,
+                    stats=stats,
+                    client_name=config.name,
+                )
+                if rules is None:
+                    stats.outcome = "vacio"
+                return rules
+
+        if not cached:
+            return compute()
+        return result_cache.get_or_compute(
+            request_key, config.name, data_version, lambda: mba_flights.do(request_key, compute)
+        )
+
+    def _analyze_profiled(
+        self, request: ClientMBARequest, product_names: list[str], client_logger, inline: bool = False
+    ) -> tuple[list[dict] | None, dict[str, str]]:
+        """
+        _analyze bajo el SamplingProfiler; guarda el perfil y devuelve los
+        headers que lo referencian.
+
+        Con `inline` (pedido con el header) corre sin caché y con el minado en
+        este hilo para que el profiler vea todas las etapas; ocupa un lugar del
+        pool de minado mientras dura (MiningPoolBusy si está lleno, sin perfil).
+        Sin él (solicitudes de la muestra) sigue el camino normal: caché,
+        coalescing y pool de minado con su control de admisión; el minado se ve
+        como espera.
+        """
+        with mining_pool.inline() if inline else nullcontext():
+            profiler = SamplingProfiler()
+            error = None
+            try:
+                with profiler:
+                    rules = self._analyze(request, product_names, client_logger, cached=not inline)
+            except Exception as exc:
+                error = repr(exc)
+                raise
+            finally:
+                profile = profile_store.save(self.CUSTOMER_NAME, request.model_dump(), profiler, error, inline)
+                summary = profile["summary"]
+                client_logger.info(
+                    "Perfil %s: %.2fs, %d muestras, más muestras propias en %s",
+                    profile["profile_id"], summary["duration_seconds"], summary["samples"],
+                    summary["self"][0]["function"] if summary["self"] else "-",
+                )
+        return rules, {
+            f"{PROFILE_HEADER}-Id": profile["profile_id"],
+            f"{PROFILE_HEADER}-Url": f"/mba/{self.CUSTOMER_NAME}/profiles/{profile['profile_id']}",
+        }
+
     def _register_routes(self):
         client = self
 
@@ -56,7 +189,17 @@ class BaseClient:
             }
 
         @self.router.post("/")
-        def analyze(request: ClientMBARequest, _: None = Depends(verify_token)):
+        def analyze(
+            request: ClientMBARequest,
+            response: Response,
+            x_mba_profile: str | None = Header(None),
+            _: None = Depends(verify_token),
+        ):
+            """
+            Con el header X-MBA-Profile: 1 se perfila la solicitud con el minado en
+            el hilo de la solicitud; con PROFILE_SAMPLE_RATE se perfila una muestra
+            por el camino normal (ver /profiles).
+            """
             # Establecer el contexto del cliente para todos los logs
             set_client_context(client.CUSTOMER_NAME)
             
@@ -66,23 +209,214 @@ class BaseClient:
                 client_logger = get_client_logger(client.CUSTOMER_NAME)
                 client_logger.info("Basket a buscar: %s", product_names)
 
-                config = client.get_config()
-                rules = run_mba_pipeline(
-                    product_names=product_names,
-                    query=config.query,
-                    db_url=config.db_url,
-                    min_support=config.min_support,
-                    transform_fn=client.transform_data,
-                    client_logger=client_logger,
-                    partial_match=True,  # Búsqueda parcial case-insensitive por defecto
-                )
+                profile_headers = {}
+                try:
+                    explicit = profile_requested(x_mba_profile)
+                    if explicit or profile_sampled():
+                        rules, profile_headers = client._analyze_profiled(
+                            request, product_names, client_logger, inline=explicit
+                        )
+                    else:
+                        rules = client._analyze(request, product_names, client_logger)
+                except MiningPoolBusy as exc:
+                    raise _busy_error(exc, client_logger)
 
                 if rules is None:
                     raise HTTPException(
                         status_code=status.HTTP_404_NOT_FOUND,
-                        detail=f"No se encontraron productos que coincidan con: {', '.join(product_names)}. La búsqueda es parcial y case-insensitive.",
+                        detail=f"No se encontraron productos que coincidan con: {', '.join(product_names)}. La búsqueda es parcial, case-insensitive y sin acentos.",
+                        headers=profile_headers or None,
                     )
+                response.headers.update(profile_headers)
                 return rules
             finally:
                 # Limpiar el contexto del cliente
                 clear_client_context()
+
+        @self.router.post("/batch")
+        def analyze_batch(request: ClientMBABatchRequest, _: None = Depends(verify_token)):
+            """Muchas búsquedas en una sola llamada: una carga, un índice y una codificación compartidos."""
+            set_client_context(client.CUSTOMER_NAME)
+
+            try:
+                queries = [[p.strip() for p in product.split(",")] for product in request.queries]
+
+                client_logger = get_client_logger(client.CUSTOMER_NAME)
+                client_logger.info("Batch de %d búsquedas", len(queries))
+
+                config = client.get_config()
+                snapshot, rule_index = client._resolve_data(config, client_logger)
+                engine = request.engine or config.mining_engine
+                constrained = request.constrained if request.constrained is not None else config.constrained_mining
+                data_version = snapshot.version if snapshot is not None else None
+
+                # Búsquedas repetidas o ya cacheadas no se vuelven a minar
+                keys = [
+                    mba_request_key(
+                        config.name, product_names, config.min_support, request.top_n, data_version,
+                        engine, constrained, request.metric, _index_source(rule_index),
+                    )
+                    for product_names in queries
+                ]
+                results: dict[tuple, list | None] = {}
+                missing: dict[tuple, list[str]] = {}
+                for key, product_names in zip(keys, queries):
+                    if key in results or key in missing:
+                        continue
+                    hit, cached = result_cache.lookup(key, data_version)
+                    if hit:
+                        results[key] = cached
+                    else:
+                        missing[key] = product_names
+
+                if missing:
+                    try:
+                        with track_pipeline(config.name) as stats:
+                            computed = run_mba_batch(
+                                queries=list(missing.values()),
+                                query=config.query,
+                                db_url=config.db_url,
+                                min_support=config.min_support,
+                                transform_fn=client._transform_fn(),
+                                top_n=request.top_n,
+                                client_logger=client_logger,
+                                snapshot=snapshot,
+                                engine=engine,
+                                rule_index=rule_index,
+                                constrained=constrained,
+                                metric=request.metric,
+                                stats=stats,
+                                client_name=config.name,
+                            )
+                            if not any(computed):
+                                stats.outcome = "vacio"
+                    except MiningPoolBusy as exc:
+                        raise _busy_error(exc, client_logger)
+                    for key, rules in zip(missing, computed):
+                        results[key] = rules
+                        result_cache.store(key, config.name, data_version, rules)
+
+                return [
+                    {"product": product, "rules": results[key]}
+                    for product, key in zip(request.queries, keys)
+                ]
+            finally:
+                clear_client_context()
+
+        @self.router.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+        def submit_job(request: ClientMBARequest, _: None = Depends(verify_token)):
+            """Encola el análisis y responde de inmediato con el id del job."""
+            product_names = [p.strip() for p in request.product.split(",")]
+
+            def run(progress):
+                set_client_context(client.CUSTOMER_NAME)
+                client_logger = get_client_logger(client.CUSTOMER_NAME)
+                client_logger.info("Job: basket a buscar: %s", product_names)
+                try:
+                    while True:
+                        try:
+                            return client._analyze(request, product_names, client_logger, progress)
+                        except MiningPoolBusy as exc:
+                            # Un job no se rechaza: espera a que se libere el pool
+                            progress("en_cola")
+                            time.sleep(exc.retry_after)
+                finally:
+                    clear_client_context()
+
+            job = job_store.submit(client.CUSTOMER_NAME, request.model_dump(), run)
+            base_url = f"/mba/{client.CUSTOMER_NAME}/jobs/{job['job_id']}"
+            return {
+                "job_id": job["job_id"],
+                "status": job["status"],
+                "status_url": base_url,
+                "result_url": f"{base_url}/result",
+            }
+
+        def get_job(job_id: str) -> dict:
+            job = job_store.get(job_id)
+            if job is None or job["customer"] != client.CUSTOMER_NAME:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Job no encontrado o expirado: {job_id}",
+                )
+            return job
+
+        @self.router.get("/jobs/{job_id}")
+        def job_status(job_id: str, _: None = Depends(verify_token)):
+            """Estado del job: queued, running (con etapa y progreso), done o failed."""
+            job = get_job(job_id)
+            job.pop("result", None)
+            return job
+
+        @self.router.get("/jobs/{job_id}/result")
+        def job_result(job_id: str, _: None = Depends(verify_token)):
+            job = get_job(job_id)
+            if job["status"] == "failed":
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"El job falló: {job['error']}",
+                )
+            if job["status"] != "done":
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=f"El job aún no termina (estado {job['status']}, etapa {job['stage']})",
+                )
+            if job["result"] is None:
+                product_names = [p.strip() for p in job["request"]["product"].split(",")]
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"No se encontraron productos que coincidan con: {', '.join(product_names)}. La búsqueda es parcial, case-insensitive y sin acentos.",
+                )
+            return job["result"]
+
+        @self.router.get("/profiles")
+        def list_profiles(_: None = Depends(verify_token)):
+            """Perfiles vigentes del cliente (duración y muestras), del más reciente al más antiguo."""
+            return profile_store.recent(client.CUSTOMER_NAME)
+
+        @self.router.get("/profiles/{profile_id}")
+        def get_profile(profile_id: str, format: str = "json", _: None = Depends(verify_token)):
+            """Resumen y pilas de un perfil; `format=collapsed` devuelve las pilas para flamegraph/speedscope."""
+            profile = profile_store.get(profile_id)
+            if profile is None or profile["customer"] != client.CUSTOMER_NAME:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Perfil no encontrado o expirado: {profile_id}",
+                )
+            if format == "collapsed":
+                return PlainTextResponse("\n".join(profile["collapsed"]) + "\n")
+            return profile
+
+        @self.router.post("/refresh")
+        def refresh(full: bool = False, _: None = Depends(verify_token)):
+            """Actualiza el snapshot del cliente (ej. al terminar los flows ETL de Prefect)."""
+            set_client_context(client.CUSTOMER_NAME)
+
+            try:
+                client_logger = get_client_logger(client.CUSTOMER_NAME)
+                config = client.get_config()
+                snapshot = snapshot_store.refresh(config, client_logger, full=full)
+                return {
+                    "customer": client.CUSTOMER_NAME,
+                    "version": snapshot.version,
+                    "watermark": snapshot.watermark,
+                    "rows": len(snapshot),
+                    "orders": len(snapshot.orders),
+                    "products": len(snapshot.products),
+                }
+            finally:
+                clear_client_context()
+
+
+def _index_source(rule_index) -> float | None:
+    """Parte de la clave de caché según el índice de reglas disponible (su min_support, o None)."""
+    return rule_index.min_support if rule_index is not None else None
+
+
+def _busy_error(exc: MiningPoolBusy, client_logger) -> HTTPException:
+    client_logger.warning("Pool de minado saturado, solicitud rechazada")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f"Servicio saturado, reintentar en {exc.retry_after}s",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
@@ -1,6 +1,5 @@
-from prefect.variables import Variable
-
 from app.clients.base import BaseClient, ClientConfig
+from app.services.credentials import get_credentials
 
 
 class CarlsJrClient(BaseClient):
@@ -14,7 +13,7 @@ class CarlsJrClient(BaseClient):
     """
 
     def get_config(self) -> ClientConfig:
-        credentials = Variable.get("carlsjr_warehouse")
+        credentials = get_credentials("carlsjr_warehouse")
         return ClientConfig(
             name=self.CUSTOMER_NAME,
             db_url=(
@@ -24,6 +23,7 @@ class CarlsJrClient(BaseClient):
             ),
             min_support=0.01,
             query=self.QUERY,
+            watermark_column="order_id",
         )
 
 client = CarlsJrClient()
\ No newline at end of file
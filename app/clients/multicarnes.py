@@ -1,6 +1,5 @@
-from prefect.variables import Variable
-
 from app.clients.base import BaseClient, ClientConfig
+from app.services.credentials import get_credentials
 
 
 class MulticarnesClient(BaseClient):
@@ -13,7 +12,7 @@ class MulticarnesClient(BaseClient):
     """
 
     def get_config(self) -> ClientConfig:
-        credentials = Variable.get("multicarnes_warehouse")
+        credentials = get_credentials("multicarnes_warehouse")
         return ClientConfig(
             name=self.CUSTOMER_NAME,
             db_url=(
@@ -23,6 +22,7 @@ class MulticarnesClient(BaseClient):
             ),
             min_support=0.08,
             query=self.QUERY,
+            watermark_column="order_id",
         )
 
 
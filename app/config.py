@@ -10,6 +10,55 @@ class Settings(BaseSettings):
     prefect_api_url: str = ""
     prefect_api_auth_user: str = ""
 
+    # Pool de conexiones por cliente (ver app/services/database.py)
+    db_pool_size: int = 5
+    db_max_overflow: int = 5
+    db_pool_pre_ping: bool = True
+    db_pool_recycle: int = 1800
+
+    # Filas por chunk al cargar snapshots con cursor del lado del servidor
+    ingest_chunk_size: int = 50_000
+
+    # Directorio de snapshots persistidos para arranques en frío; vacío lo desactiva
+    snapshot_dir: str = ".snapshots"
+
+    # Procesos de minado por worker (0 = en el hilo de la solicitud) y trabajos en
+    # espera admitidos antes de responder 503 (ver app/services/mining_pool.py)
+    mining_processes: int = 2
+    mining_queue_depth: int = 4
+
+    # Caché de resultados (ver app/services/result_cache.py): "memory" (por worker),
+    # "sqlite" (archivo compartido), "redis" o vacío para desactivarlo
+    result_cache_backend: str = "memory"
+    # URL de Redis o ruta del archivo SQLite (por defecto {snapshot_dir}/results.sqlite3)
+    result_cache_url: str = ""
+    result_cache_max_entries: int = 1024
+    result_cache_max_bytes: int = 64_000_000
+    # Expiración de las entradas en Redis (segundos)
+    result_cache_ttl: float = 86400.0
+
+    # Jobs asíncronos (ver app/services/jobs.py): directorio compartido por los
+    # workers, jobs en ejecución simultánea por worker y segundos que se conserva
+    # el resultado de un job terminado
+    jobs_dir: str = ".jobs"
+    job_workers: int = 2
+    job_ttl: float = 3600.0
+
+    # Directorio donde cada worker guarda sus métricas para que /metrics sume las
+    # de todos (ver app/services/metrics.py); vacío deja solo las del worker
+    metrics_dir: str = ".metrics"
+
+    # Perfilado de solicitudes (ver app/services/profiling.py): fracción de los
+    # análisis perfilados sin pedirlo con el header X-MBA-Profile, intervalo de
+    # muestreo (segundos), directorio compartido y retención de los perfiles
+    profile_sample_rate: float = 0.0
+    profile_interval: float = 0.005
+    profiles_dir: str = ".profiles"
+    profile_ttl: float = 86400.0
+
+    # Segundos antes de refrescar en segundo plano las credenciales de Prefect
+    credentials_ttl: float = 300.0
+
 
 @lru_cache
 def get_settings() -> Settings:
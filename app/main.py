@@ -0,0 +1,79 @@
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI
+from fastapi.responses import PlainTextResponse
+
+from app.routers import mba
+from app.clients import ALL_CLIENTS
+from app.logger import ClientFormatter
+from app.dependencies import verify_token
+from app.services.database import dispose_engines
+from app.services.jobs import job_store
+from app.services.memory import memory_report
+from app.services.metrics import CONTENT_TYPE, registry
+from app.services.mining_pool import mining_pool
+from app.services.result_cache import result_cache
+from app.services.single_flight import mba_flights
+from app.services.snapshot import snapshot_store
+
+# Configurar el formatter personalizado
+handler = logging.StreamHandler()
+handler.setFormatter(ClientFormatter())
+
+logging.basicConfig(
+    level=logging.INFO,
+    handlers=[handler],
+)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Arranque en frío: snapshots persistidos por otro worker o por el proceso anterior
+    for client in ALL_CLIENTS:
+        snapshot_store.load_from_disk(client.CUSTOMER_NAME)
+    yield
+    # Cerrar los pools de conexiones y de minado al apagar el worker
+    dispose_engines()
+    mining_pool.shutdown()
+    job_store.shutdown()
+
+
+def create_app() -> FastAPI:
+    application = FastAPI(title="MBA API", version="2.0.0", lifespan=lifespan)
+
+    # Backward-compatible /mba endpoint
+    application.include_router(mba.router)
+
+    # Per-client endpoints: /mba/carlsjr, /mba/karzo, etc.
+    for client in ALL_CLIENTS:
+        application.include_router(client.router)
+
+    @application.get("/health")
+    def health():
+        return {"status": "ok"}
+
+    @application.get("/health/memory", dependencies=[Depends(verify_token)])
+    def health_memory():
+        """RSS vs memoria compartida del worker que atiende la solicitud."""
+        return memory_report()
+
+    @application.get("/health/mining", dependencies=[Depends(verify_token)])
+    def health_mining():
+        """Cola del pool de minado del worker y solicitudes idénticas coalescidas."""
+        return {**mining_pool.stats(), **mba_flights.stats()}
+
+    @application.get("/health/cache", dependencies=[Depends(verify_token)])
+    def health_cache():
+        """Aciertos/fallos y tamaño de la caché de resultados."""
+        return result_cache.stats()
+
+    @application.get("/metrics", dependencies=[Depends(verify_token)], response_class=PlainTextResponse)
+    def metrics():
+        """Latencia por cliente y etapa, líneas, órdenes, itemsets, reglas y memoria (formato Prometheus)."""
+        return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+    return application
+
+
+app = create_app()
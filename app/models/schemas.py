@@ -1,4 +1,9 @@
-from pydantic import BaseModel
+from typing import Literal, Optional
+
+from pydantic import BaseModel, Field
+
+MiningEngine = Literal["auto", "apriori", "fpgrowth", "fpmax"]
+RankingMetric = Literal["confidence", "lift", "conviction", "zhangs_metric"]
 
 
 class ClientMBARequest(BaseModel):
@@ -8,11 +13,39 @@ class ClientMBARequest(BaseModel):
     Búsqueda parcial case-insensitive por defecto.
     Soporta múltiples productos separados por coma.
     
+    `engine` sobreescribe el motor de minado configurado para el cliente y
+    `constrained` activa/desactiva el minado restringido a los productos buscados.
+    `top_n` es la cantidad de reglas a devolver y `metric` la métrica por la
+    que se ordenan (confianza por defecto).
+    
     Examples:
         {"product": "diablo"}
         {"product": "papas, burger, malteada"}
+        {"product": "burger", "engine": "fpgrowth"}
+        {"product": "papas, burger", "constrained": true}
+        {"product": "diablo", "top_n": 10, "metric": "lift"}
     """
     product: str
+    engine: Optional[MiningEngine] = None
+    constrained: Optional[bool] = None
+    top_n: int = Field(5, ge=1, le=100)
+    metric: RankingMetric = "confidence"
+
+
+class ClientMBABatchRequest(BaseModel):
+    """Request para /mba/{customer}/batch: muchas búsquedas en una sola llamada.
+
+    Cada elemento de `queries` tiene el mismo formato que `product` en
+    ClientMBARequest. Todas comparten una sola carga de datos y codificación.
+
+    Examples:
+        {"queries": ["diablo", "papas, burger", "malteada"]}
+    """
+    queries: list[str] = Field(min_length=1, max_length=1000)
+    engine: Optional[MiningEngine] = None
+    constrained: Optional[bool] = None
+    top_n: int = Field(5, ge=1, le=100)
+    metric: RankingMetric = "confidence"
 
 
 class AssociationRule(BaseModel):
@@ -29,11 +29,15 @@ def mba_info(_: None = Depends(verify_token)):
             "examples": [
                 {"product": "diablo"},
                 {"product": "papas, burger"},
+                {"product": "papas", "top_n": 10, "metric": "lift"},
             ]
         },
         "features": [
-            "Búsqueda parcial case-insensitive",
+            "Búsqueda parcial case-insensitive y sin acentos",
             "Soporte para múltiples productos (separados por coma)",
             "Limpieza automática de datos nulos",
+            "Top N configurable (top_n) ordenado por confidence, lift, conviction o zhangs_metric (metric)",
+            "Batch de búsquedas en POST /mba/{customer}/batch ({\"queries\": [...]})",
+            "Jobs asíncronos en POST /mba/{customer}/jobs (estado y resultado en /jobs/{job_id})",
         ]
     }
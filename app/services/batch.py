@@ -0,0 +1,156 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.config import get_settings
+from app.services.database import get_engine
+from app.services.metrics import PipelineStats
+from app.services.market_basket import (
+    DEFAULT_TOP_N,
+    build_filtered_query,
+    categorize_products,
+    clean_transactions,
+    filter_transactions,
+    format_top_rules,
+    measured_rules,
+    process_data,
+    rules_from_index,
+    snapshot_orders,
+    with_product_names,
+)
+from app.services.mining_pool import mining_pool
+from app.services.product_index import ProductIndex
+
+logger = logging.getLogger(__name__)
+
+
+def run_mba_batch(
+    queries: list[list[str]],
+    query: str,
+    db_url: str,
+    min_support: float,
+    transform_fn: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    top_n: int = DEFAULT_TOP_N,
+    client_logger=None,
+    snapshot=None,
+    engine: str = "auto",
+    rule_index=None,
+    constrained: bool = False,
+    metric: str = "confidence",
+    stats: PipelineStats | None = None,
+    client_name: str | None = None,
+) -> list[list[dict] | None]:
+    """
+    run_mba_pipeline para muchas búsquedas a la vez, compartiendo el trabajo común.
+
+    1. Órdenes de cada búsqueda: con snapshot, de su order_index (snapshot_orders);
+       sin snapshot, una sola consulta con las órdenes de todas las búsquedas
+       (build_filtered_query con match_any), un ProductIndex y filter_transactions
+    2. Un solo DataFrame con las líneas de la unión de esas órdenes
+    3. transform_fn y process_data una sola vez sobre la unión
+    4. Cada búsqueda mina su submatriz (filas de sus órdenes, columnas con algún
+       producto) en el pool de minado, con hasta `mining_processes` en paralelo;
+       con rule_index (snapshot, sin transform_fn ni fpmax), las que cubre el
+       índice arman sus reglas desde él sin minar (rules_from_index)
+
+    La submatriz es idéntica a la que codificaría run_mba_pipeline para esa
+    búsqueda (mismas filas y columnas, en el mismo orden), así que las reglas
+    coinciden con las de solicitudes individuales.
+
+    En `stats` las etapas son las del batch completo (minado es el tiempo de
+    pared de todas las búsquedas en paralelo); los conteos suman las búsquedas.
+    `client_name` registra el engine de BD por cliente (ver database.get_engine).
+
+    Returns:
+        Reglas por búsqueda, en el orden de `queries` (None si no hay productos/reglas)
+    """
+    log = client_logger or logger
+    stats = stats or PipelineStats()
+    results: list[list[dict] | None] = [None] * len(queries)
+    pending = list(range(len(queries)))
+    use_index = rule_index is not None and snapshot is not None and transform_fn is None and engine != "fpmax"
+
+    matched: dict[int, tuple[np.ndarray, list[list[str]]]] = {}
+    if snapshot is not None:
+        stats.source = "snapshot"
+        matched_codes = []
+        with stats.stage("filtro"):
+            for position in pending:
+                order_codes, product_groups = snapshot_orders(snapshot, queries[position], client_logger)
+                if order_codes is not None:
+                    matched[position] = (snapshot.orders[order_codes], product_groups)
+                    matched_codes.append(order_codes)
+            if not matched:
+                return results
+            union_df = snapshot.orders_frame(np.unique(np.concatenate(matched_codes)))
+        stats.rows += len(union_df)
+    else:
+        terms = sorted({term for position in pending for term in queries[position]})
+        filtered_query, params = build_filtered_query(query, terms, match_any=True)
+        with stats.stage("consulta"):
+            df = pd.read_sql_query(filtered_query, get_engine(db_url, client_name), params=params)
+        stats.rows += len(df)
+        log.info("Recibidas %d líneas de órdenes relevantes desde la BD para %d búsquedas", len(df), len(pending))
+        with stats.stage("filtro"):
+            df = categorize_products(clean_transactions(df, client_logger))
+            product_index = ProductIndex(df["product_name"].cat.categories)
+            for position in pending:
+                filtered_df, product_groups = filter_transactions(
+                    df, queries[position], client_logger, True, product_index
+                )
+                if filtered_df is not None:
+                    matched[position] = (pd.unique(filtered_df["order_id"]), product_groups)
+            if not matched:
+                return results
+            union_orders = np.unique(np.concatenate([orders for orders, _ in matched.values()]))
+            union_df = df[df["order_id"].isin(union_orders)]
+
+    if transform_fn is not None:
+        with stats.stage("transformacion"):
+            union_df = transform_fn(with_product_names(union_df))
+    with stats.stage("baskets"):
+        baskets = process_data(union_df, client_logger)
+    encoded, columns = baskets.encoded, baskets.columns
+    basket_rows = pd.Index(baskets.order_ids)
+    log.info("Batch: %d búsquedas a minar sobre %d órdenes y %d productos", len(matched), *encoded.shape)
+
+    def mine(position: int) -> tuple[pd.DataFrame | None, list[dict] | None, PipelineStats]:
+        """Reglas minadas de la búsqueda, o su top N ya formateado si lo cubre el índice."""
+        orders, product_groups = matched[position]
+        rows = np.sort(basket_rows.get_indexer(orders))
+        rows = rows[rows >= 0]
+        submatrix = encoded[rows]
+        used = np.flatnonzero(submatrix.getnnz(axis=0))
+        if use_index:
+            top_rules = rules_from_index(
+                rule_index, submatrix[:, used], columns[used].tolist(), product_groups, min_support, top_n,
+                client_logger, metric, constrained,
+            )
+            if top_rules is not None:
+                return None, top_rules, PipelineStats(orders=len(rows))
+        rules, mining_stats = mining_pool.run(
+            measured_rules, submatrix[:, used], columns[used].tolist(), min_support, client_logger,
+            product_groups, engine=engine, constrained=constrained, top_n=top_n, metric=metric,
+        )
+        mining_stats.orders = len(rows)
+        return rules, None, mining_stats
+
+    with ThreadPoolExecutor(max_workers=max(get_settings().mining_processes, 1)) as executor:
+        with stats.stage("minado"):
+            mined = list(executor.map(mine, matched))
+    if all(top_rules is not None for _, top_rules, _ in mined):
+        stats.source = "indice"
+    with stats.stage("formato"):
+        for position, (rules, top_rules, mining_stats) in zip(matched, mined):
+            stats.merge(mining_stats, stages=False)
+            if top_rules is not None:
+                results[position] = top_rules
+                continue
+            if len(rules) == 0:
+                log.warning("No se generaron reglas para %s con min_support=%.4f", queries[position], min_support)
+                continue
+            results[position] = format_top_rules(rules, top_n, metric)
+    return results
@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from prefect.variables import Variable
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _CachedCredentials:
+    value: Any
+    loaded_at: float
+
+
+class CredentialCache:
+    """
+    Caché de credenciales (Prefect Variables) con TTL y refresco en segundo plano.
+
+    Solo la primera lectura de cada variable espera a Prefect. Al vencer el TTL se
+    devuelve el valor anterior y un hilo lo refresca; si el refresco falla se sigue
+    usando el último valor conocido.
+    """
+
+    def __init__(self, loader: Callable[[str], Any] = Variable.get, ttl: float | None = None):
+        self._loader = loader
+        self._ttl = ttl
+        self._entries: dict[str, _CachedCredentials] = {}
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self) -> float:
+        return self._ttl if self._ttl is not None else get_settings().credentials_ttl
+
+    def get(self, name: str) -> Any:
+        entry = self._entries.get(name)
+        if entry is None:
+            with self._lock:
+                entry = self._entries.get(name)
+                if entry is None:
+                    entry = self._load(name)
+            return entry.value
+
+        if time.monotonic() - entry.loaded_at >= self.ttl:
+            self._refresh_in_background(name)
+        return entry.value
+
+    def _load(self, name: str) -> _CachedCredentials:
+        entry = _CachedCredentials(value=self._loader(name), loaded_at=time.monotonic())
+        self._entries[name] = entry
+        return entry
+
+    def _refresh_in_background(self, name: str) -> None:
+        with self._lock:
+            if name in self._refreshing:
+                return
+            self._refreshing.add(name)
+
+        def refresh():
+            try:
+                self._load(name)
+            except Exception:
+                logger.warning("No se pudo refrescar la variable %s, se mantiene la anterior", name, exc_info=True)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(name)
+
+        threading.Thread(target=refresh, name=f"credentials-{name}", daemon=True).start()
+
+
+credential_cache = CredentialCache()
+
+
+def get_credentials(name: str) -> Any:
+    """Credenciales de la Prefect Variable `name`, cacheadas por proceso."""
+    return credential_cache.get(name)
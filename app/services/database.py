@@ -0,0 +1,49 @@
+import logging
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+_engines: dict[str, tuple[str, Engine]] = {}
+_lock = threading.Lock()
+
+
+def get_engine(db_url: str, name: str | None = None) -> Engine:
+    """
+    Engine de SQLAlchemy reutilizable por proceso, con pool configurable.
+
+    Se registra por `name` (el cliente) o, si no se indica, por la URL. Si las
+    credenciales de un cliente cambian, el engine anterior se descarta con dispose().
+    """
+    key = name or db_url
+    with _lock:
+        registered = _engines.get(key)
+        if registered is not None:
+            registered_url, engine = registered
+            if registered_url == db_url:
+                return engine
+            logger.info("Credenciales de BD cambiaron para %s, recreando engine", key)
+            engine.dispose()
+
+        settings = get_settings()
+        engine = create_engine(
+            db_url,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_pre_ping=settings.db_pool_pre_ping,
+            pool_recycle=settings.db_pool_recycle,
+        )
+        _engines[key] = (db_url, engine)
+        return engine
+
+
+def dispose_engines() -> None:
+    """Cierra todas las conexiones del registro (ej. al apagar el worker)."""
+    with _lock:
+        for _, engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from app.config import get_settings
+from app.services.json_files import JsonFileStore
+from app.services.market_basket import PIPELINE_STAGES
+
+logger = logging.getLogger(__name__)
+
+
+class JobStore(JsonFileStore):
+    """
+    Jobs de análisis asíncronos, persistidos como JSON en `jobs_dir`.
+
+    El worker que recibe el job lo ejecuta en un hilo propio (hasta
+    `job_workers` a la vez) y va escribiendo su estado en disco, así que
+    cualquier worker del contenedor puede responder el estado y el resultado.
+    Los jobs se borran `job_ttl` segundos después de terminar. Si el worker que
+    ejecutaba un job muere, el job queda en "running" hasta expirar.
+    """
+
+    def __init__(self):
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, customer: str, request: dict, run: Callable[[Callable[[str], None]], Any]) -> dict:
+        """
+        Registra un job y lo encola. `run(progress)` ejecuta el análisis llamando
+        a `progress(etapa)` al empezar cada etapa y devuelve el resultado
+        serializable a JSON.
+        """
+        self.cleanup()
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "customer": customer,
+            "request": request,
+            "status": "queued",
+            "stage": None,
+            "progress": 0.0,
+            "created_at": now,
+            "updated_at": now,
+            "finished_at": None,
+            "error": None,
+            "result": None,
+        }
+        self._write(job["job_id"], job)
+        # El hilo del job modifica `job` mientras se serializa la respuesta
+        submitted = dict(job)
+        self._get_executor().submit(self._run, job, run)
+        return submitted
+
+    def get(self, job_id: str) -> dict | None:
+        """Estado del job (con resultado si terminó), o None si no existe o expiró."""
+        return self._read(job_id)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: dict, run: Callable[[Callable[[str], None]], Any]) -> None:
+        def progress(stage: str) -> None:
+            job["stage"] = stage
+            if stage in PIPELINE_STAGES:
+                job["progress"] = round(PIPELINE_STAGES.index(stage) / len(PIPELINE_STAGES), 2)
+            job["updated_at"] = time.time()
+            self._write(job["job_id"], job)
+
+        job["status"] = "running"
+        progress(None)
+        try:
+            job["result"] = run(progress)
+            job["status"] = "done"
+            job["progress"] = 1.0
+        except Exception as exc:
+            logger.exception("Error ejecutando job %s", job["job_id"])
+            job["status"] = "failed"
+            job["error"] = str(exc)
+        job["finished_at"] = job["updated_at"] = time.time()
+        self._write(job["job_id"], job)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=get_settings().job_workers, thread_name_prefix="mba-job"
+                )
+            return self._executor
+
+    def _directory(self) -> str:
+        return get_settings().jobs_dir
+
+    def _ttl(self) -> float:
+        return get_settings().job_ttl
+
+    def _timestamp(self, job: dict) -> float:
+        return job.get("finished_at") or job.get("updated_at") or 0
+
+
+job_store = JobStore()
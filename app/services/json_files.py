@@ -0,0 +1,86 @@
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Iterator
+
+# Ids de registro: uuid4().hex
+_RECORD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class JsonFileStore:
+    """
+    Registros JSON por id en un directorio compartido por los workers (jobs,
+    perfiles): cualquier worker lee lo que escribió otro.
+
+    Cada escritura va a un archivo temporal por proceso e hilo y se publica con
+    os.replace, así que un lector nunca ve un archivo a medias. Un registro
+    expira `_ttl()` segundos después de `_timestamp(registro)`, que las
+    subclases hacen coincidir con su última escritura: cleanup borra por mtime
+    sin abrir los archivos.
+    """
+
+    def cleanup(self) -> None:
+        """Borra los registros expirados."""
+        directory = Path(self._directory())
+        if not directory.is_dir():
+            return
+        cutoff = time.time() - self._ttl()
+        for path in directory.glob("*.json"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink(missing_ok=True)
+            except OSError:
+                continue
+
+    def _directory(self) -> str:
+        raise NotImplementedError
+
+    def _ttl(self) -> float:
+        raise NotImplementedError
+
+    def _timestamp(self, record: dict) -> float:
+        raise NotImplementedError
+
+    def _is_expired(self, record: dict) -> bool:
+        return time.time() - self._timestamp(record) >= self._ttl()
+
+    def _path(self, record_id: str) -> Path:
+        return Path(self._directory()) / f"{record_id}.json"
+
+    def _read(self, record_id: str) -> dict | None:
+        """Registro vigente, o None si el id no es válido, no existe o expiró."""
+        if not _RECORD_ID.match(record_id):
+            return None
+        try:
+            with open(self._path(record_id), encoding="utf-8") as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if self._is_expired(record):
+            return None
+        return record
+
+    def _records(self) -> Iterator[dict]:
+        """Registros vigentes del directorio (los ilegibles se saltan)."""
+        directory = Path(self._directory())
+        if not directory.is_dir():
+            return
+        for path in directory.glob("*.json"):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not self._is_expired(record):
+                yield record
+
+    def _write(self, record_id: str, record: dict) -> None:
+        path = self._path(record_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        staged = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(staged, "w", encoding="utf-8") as f:
+            json.dump(record, f, default=str)
+        os.replace(staged, path)
@@ -1,22 +1,108 @@
 import logging
+import time
+from dataclasses import dataclass
 from typing import Callable, Optional
 
+import numpy as np
 import pandas as pd
-from mlxtend.frequent_patterns import apriori, association_rules
-from mlxtend.preprocessing import TransactionEncoder
-from sqlalchemy import create_engine
+from scipy import sparse
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
+
+from app.services.database import get_engine
+from app.services.metrics import PipelineStats, peak_memory, reset_peak_memory
+from app.services.mining import MinedRules, mine_constrained_rules, mine_rules, top_positions
+from app.services.mining_pool import mining_pool
+from app.services.product_index import ProductIndex
 
 logger = logging.getLogger(__name__)
 
+# Reglas devueltas por solicitud
+DEFAULT_TOP_N = 5
+
+# Etapas de run_mba_pipeline reportadas al callback `progress` (jobs asíncronos)
+PIPELINE_STAGES = ("carga", "transformacion", "baskets", "minado", "formato")
+
+# Celdas (órdenes x productos) a partir de las cuales conviene codificar en sparse
+SPARSE_MIN_CELLS = 5_000_000
+# Densidad máxima para usar CSR: por encima, la matriz booleana densa ocupa menos
+SPARSE_MAX_DENSITY = 0.05
+
+
+def valid_product_rows(df: pd.DataFrame) -> pd.Series:
+    """Máscara de registros con product_name utilizable (no None/null/vacío)."""
+    return df["product_name"].notna() & (df["product_name"] != "None") & (df["product_name"] != "")
+
+
+def clean_transactions(df: pd.DataFrame, client_logger=None) -> pd.DataFrame:
+    """Elimina registros con product_name None/vacío."""
+    log = client_logger or logger
+    initial_count = len(df)
+    df = df[valid_product_rows(df)]
+    cleaned_count = initial_count - len(df)
+    if cleaned_count > 0:
+        log.info("Eliminados %d registros con product_name None/vacío", cleaned_count)
+    return df
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+
+
+def build_filtered_query(
+    query: str, product_names: list[str], partial_match: bool = True, match_any: bool = False
+) -> tuple[TextClause, dict]:
+    """
+    Envuelve la query base del cliente para que la BD devuelva solo las líneas de
+    las órdenes relevantes, sin duplicados.
+
+    - Búsqueda parcial: la orden debe contener un producto que coincida (LIKE) con
+      CADA término, un semi-join por término (con `match_any`, con ALGUNO: lo usa
+      el batch para traer en una sola consulta las órdenes de todas sus búsquedas).
+    - Búsqueda exacta: la orden debe contener alguno de los productos (IN).
+
+    La coincidencia sin acentos depende de la collation de la BD (las *_ci de MySQL
+    la cubren); el filtro fino posterior se hace igual en filter_transactions.
+    """
+    params: dict[str, str] = {}
+    if partial_match:
+        conditions = []
+        for i, name in enumerate(product_names):
+            params[f"term_{i}"] = f"%{_escape_like(name.lower())}%"
+            conditions.append(
+                f"base.order_id IN (SELECT matched.order_id FROM ({query}) AS matched "
+                f"WHERE LOWER(matched.product_name) LIKE :term_{i} ESCAPE '!')"
+            )
+        where = (" OR " if match_any else " AND ").join(conditions)
+    else:
+        placeholders = []
+        for i, name in enumerate(product_names):
+            params[f"term_{i}"] = name
+            placeholders.append(f":term_{i}")
+        where = (
+            f"base.order_id IN (SELECT matched.order_id FROM ({query}) AS matched "
+            f"WHERE matched.product_name IN ({', '.join(placeholders)}))"
+        )
+    filtered = f"SELECT DISTINCT base.order_id, base.product_name FROM ({query}) AS base WHERE {where}"
+    return text(filtered), params
+
 
 def load_data(
-    product_names: list[str], query: str, db_url: str, client_logger=None, partial_match: bool = True
+    product_names: list[str],
+    query: str,
+    db_url: str,
+    client_logger=None,
+    partial_match: bool = True,
+    stats: PipelineStats | None = None,
+    client_name: str | None = None,
 ) -> tuple[pd.DataFrame, list[list[str]]] | tuple[None, None]:
     """
     Carga y filtra datos de transacciones.
     
     IMPORTANTE: Para búsquedas múltiples, filtra órdenes que contengan TODOS los productos buscados.
     Ejemplo: Si buscas "diablo, papas", retorna órdenes que tienen productos con "diablo" Y "papas".
+    El filtro de órdenes se empuja a la BD (ver build_filtered_query): solo viajan
+    las líneas de las órdenes relevantes, no la tabla completa.
     
     Args:
         product_names: Lista de nombres de productos a buscar
@@ -25,38 +111,95 @@ def load_data(
         client_logger: Logger opcional
         partial_match: Si True, busca coincidencias parciales case-insensitive (ej: "diablo" encuentra "Combo Diablo")
                       Si False, busca coincidencias exactas
+        stats: PipelineStats opcional donde se miden las etapas consulta y filtro
+        client_name: Cliente dueño del engine de BD (ver database.get_engine); sin él, el engine se registra por URL
     
     Returns:
         Tuple (DataFrame filtrado, grupos de productos encontrados) o (None, None) si no se encuentran
     """
     log = client_logger or logger
-    engine = create_engine(db_url)
-    df = pd.read_sql_query(query, engine)
-    
-    # Limpiar valores None/null en product_name
-    initial_count = len(df)
-    df = df[df["product_name"].notna() & (df["product_name"] != "None") & (df["product_name"] != "")]
-    cleaned_count = initial_count - len(df)
-    if cleaned_count > 0:
-        log.info("Eliminados %d registros con product_name None/vacío", cleaned_count)
+    stats = stats or PipelineStats()
+    filtered_query, params = build_filtered_query(query, product_names, partial_match)
+    with stats.stage("consulta"):
+        df = pd.read_sql_query(filtered_query, get_engine(db_url, client_name), params=params)
+    stats.rows += len(df)
+    log.info("Recibidas %d líneas de órdenes relevantes desde la BD", len(df))
+    with stats.stage("filtro"):
+        df = clean_transactions(df, client_logger)
+        if df.empty:
+            log.warning("No se encontraron órdenes con los productos solicitados: %s", product_names)
+            return None, None
+        df = categorize_products(df)
+        return filter_transactions(df, product_names, client_logger, partial_match)
+
+
+def categorize_products(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    product_name como categórico: diccionario de nombres (categories) y códigos
+    enteros por fila. Los snapshots ya lo entregan así; las cargas desde la BD se
+    codifican al recibirlas. El resto del pipeline trabaja sobre los códigos.
+    """
+    if isinstance(df["product_name"].dtype, pd.CategoricalDtype):
+        return df
+    return df.assign(product_name=pd.Categorical(df["product_name"]))
+
+
+def with_product_names(df: pd.DataFrame) -> pd.DataFrame:
+    """product_name como strings, para transform_data de clientes que lo sobreescriben."""
+    if not isinstance(df["product_name"].dtype, pd.CategoricalDtype):
+        return df
+    return df.assign(product_name=df["product_name"].astype(object))
+
+
+def _rows_with(codes: np.ndarray, product_codes: np.ndarray, n_products: int) -> np.ndarray:
+    """Máscara de las filas cuyo código de producto está en `product_codes` (código -1 = nulo)."""
+    lookup = np.zeros(n_products + 1, dtype=bool)
+    lookup[product_codes] = True
+    return lookup[codes]
+
+
+def filter_transactions(
+    df: pd.DataFrame,
+    product_names: list[str],
+    client_logger=None,
+    partial_match: bool = True,
+    product_index: ProductIndex | None = None,
+) -> tuple[pd.DataFrame, list[list[str]]] | tuple[None, None]:
+    """
+    Filtra las órdenes que contienen los productos buscados.
+
+    Recibe transacciones ya limpias (ver clean_transactions), ya sea recién
+    leídas de la BD o servidas desde un snapshot en memoria. La coincidencia
+    parcial se resuelve con un ProductIndex sobre los nombres distintos (el del
+    snapshot si se pasa, o uno construido al vuelo), sin recorrer las filas.
+    `product_index` debe estar construido sobre las categorías de product_name:
+    las filas se seleccionan comparando códigos enteros, no strings.
+    """
+    log = client_logger or logger
+    df = categorize_products(df)
+    categories = df["product_name"].cat.categories
+    codes = df["product_name"].cat.codes.to_numpy()
+    order_ids = df["order_id"].to_numpy()
 
     # Búsqueda de productos (parcial o exacta)
     if partial_match:
-        # Búsqueda parcial case-insensitive
-        df["product_name_lower"] = df["product_name"].str.lower()
+        # Búsqueda parcial case-insensitive y sin acentos
+        if product_index is None:
+            product_index = ProductIndex(categories)
         product_groups = []  # Lista de grupos de productos encontrados
+        group_codes = []
         
         # Para cada término buscado, encontrar productos que coincidan
         for name in product_names:
-            name_lower = name.lower()
-            matches = df[df["product_name_lower"].str.contains(name_lower, na=False)]["product_name"].unique()
+            matches = product_index.search(name)
             
             if len(matches) == 0:
                 log.warning("No se encontraron productos con '%s'", name)
                 return None, None
             
-            product_groups.append(list(matches))
-            log.info("'%s' coincide con %d productos: %s", name, len(matches), list(matches)[:5])
+            group_codes.append(matches)
+            product_groups.append(categories[matches].tolist())
+            log.info("'%s' coincide con %d productos: %s", name, len(matches), product_groups[-1][:5])
         
         # Para búsquedas múltiples: filtrar órdenes que contengan AL MENOS un producto de CADA grupo
         if len(product_names) > 1:
@@ -64,19 +207,19 @@ def load_data(
             
             # Obtener órdenes que contienen al menos un producto de cada grupo
             valid_orders = None
-            for group_idx, product_group in enumerate(product_groups):
-                orders_with_group = set(df[df["product_name"].isin(product_group)]["order_id"].unique())
+            for group_idx, matches in enumerate(group_codes):
+                orders_with_group = pd.unique(order_ids[_rows_with(codes, matches, len(categories))])
                 
                 if valid_orders is None:
                     valid_orders = orders_with_group
                 else:
                     # Intersección: órdenes que tienen productos de TODOS los grupos
-                    valid_orders = valid_orders.intersection(orders_with_group)
+                    valid_orders = np.intersect1d(valid_orders, orders_with_group, assume_unique=True)
                 
                 log.info("  Grupo %d (%s): %d órdenes. Tras intersección: %d órdenes", 
                         group_idx + 1, product_names[group_idx], len(orders_with_group), len(valid_orders))
             
-            if not valid_orders:
+            if len(valid_orders) == 0:
                 log.warning("No se encontraron órdenes que contengan TODOS los productos: %s", product_names)
                 return None, None
             
@@ -84,158 +227,445 @@ def load_data(
             log.info("Encontradas %d órdenes con TODOS los productos solicitados", len(valid_orders))
         else:
             # Búsqueda de un solo producto
-            all_matching = product_groups[0]
-            orders_with_products = df[df["product_name"].isin(all_matching)]["order_id"]
+            orders_with_products = pd.unique(order_ids[_rows_with(codes, group_codes[0], len(categories))])
             filtered_df = df[df["order_id"].isin(orders_with_products)]
-            log.info("Encontradas %d órdenes con el producto solicitado", len(orders_with_products.unique()))
-        
-        filtered_df = filtered_df.drop(columns=["product_name_lower"])
+            log.info("Encontradas %d órdenes con el producto solicitado", len(orders_with_products))
         
     else:
         # Búsqueda exacta (comportamiento original)
-        if not any(name in df["product_name"].values for name in product_names):
+        present = np.bincount(codes[codes >= 0], minlength=len(categories)) > 0
+        requested = categories.get_indexer(product_names)
+        found = [name for name, code in zip(product_names, requested) if code >= 0 and present[code]]
+        if not found:
             log.warning("Productos no encontrados en la base de datos (búsqueda exacta): %s", product_names)
             return None, None
         
-        product_groups = [[name] for name in product_names if name in df["product_name"].values]
-        orders_with_products = df[df["product_name"].isin(product_names)]["order_id"]
+        product_groups = [[name] for name in found]
+        orders_with_products = pd.unique(
+            order_ids[_rows_with(codes, requested[requested >= 0], len(categories))]
+        )
         filtered_df = df[df["order_id"].isin(orders_with_products)]
-        log.info("Encontradas %d órdenes con los productos solicitados", len(orders_with_products.unique()))
+        log.info("Encontradas %d órdenes con los productos solicitados", len(orders_with_products))
     
-    del df
     return filtered_df, product_groups
 
 
-def process_data(df: pd.DataFrame, client_logger=None) -> pd.DataFrame:
+def filter_snapshot(
+    snapshot, product_names: list[str], client_logger=None
+) -> tuple[pd.DataFrame, list[list[str]]] | tuple[None, None]:
+    """
+    filter_transactions (búsqueda parcial) sobre un TransactionSnapshot usando su
+    order_index: la unión por grupo y la intersección entre grupos se hacen sobre
+    las listas de órdenes de cada producto y solo se arma el DataFrame de las
+    órdenes elegidas, sin materializar la tabla completa.
+    """
+    order_codes, product_groups = snapshot_orders(snapshot, product_names, client_logger)
+    if order_codes is None:
+        return None, None
+    return snapshot.orders_frame(order_codes), product_groups
+
+
+def snapshot_orders(
+    snapshot, product_names: list[str], client_logger=None
+) -> tuple[np.ndarray, list[list[str]]] | tuple[None, None]:
+    """Códigos de orden del snapshot con algún producto de cada término, y los grupos de productos."""
+    log = client_logger or logger
+    group_codes = []
+    for name in product_names:
+        matches = snapshot.product_index.search(name)
+        if len(matches) == 0:
+            log.warning("No se encontraron productos con '%s'", name)
+            return None, None
+        group_codes.append(matches)
+        log.info("'%s' coincide con %d productos: %s", name, len(matches), snapshot.products[matches[:5]].tolist())
+
+    order_codes = snapshot.order_index.orders_with_all(group_codes)
+    if len(order_codes) == 0:
+        log.warning("No se encontraron órdenes que contengan TODOS los productos: %s", product_names)
+        return None, None
+    if len(product_names) > 1:
+        log.info("Encontradas %d órdenes con TODOS los productos solicitados", len(order_codes))
+    else:
+        log.info("Encontradas %d órdenes con el producto solicitado", len(order_codes))
+    return order_codes, [snapshot.products[codes].tolist() for codes in group_codes]
+
+
+@dataclass
+class Baskets:
+    """
+    Baskets como matriz de incidencia CSR booleana órdenes x productos.
+
+    `order_ids` es la orden de cada fila (en orden de aparición) y `columns` el
+    nombre de producto de cada columna, en orden alfabético (el que usaba
+    TransactionEncoder: de él depende el desempate al ordenar reglas).
+    """
+
+    order_ids: np.ndarray
+    encoded: sparse.csr_matrix
+    columns: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.order_ids)
+
+
+def process_data(df: pd.DataFrame, client_logger=None) -> Baskets:
+    """
+    Agrupa las líneas de orden en baskets, sobre los códigos de producto.
+
+    Todo se resuelve con operaciones de arrays: cada par (orden, producto) se
+    reduce a una clave entera fila * productos + columna; ordenadas y sin
+    duplicados, las claves ya están agrupadas por fila y columna, que es justo
+    el layout de indices de la CSR. No se crean objetos Python por orden.
+    """
     log = client_logger or logger
     log.info("Procesando datos")
-    basket = df.groupby("order_id")["product_name"].apply(list).reset_index(name="items")
-    basket = basket.dropna(subset=["items"])
-    return basket
+    df = categorize_products(df)
+    categories = df["product_name"].cat.categories
+    codes = df["product_name"].cat.codes.to_numpy()
+    valid = codes >= 0
+    codes = codes[valid].astype(np.int32)
+    row_codes, order_ids = pd.factorize(df["order_id"].to_numpy()[valid])
+
+    # Columnas: productos presentes, ordenados por nombre
+    used = np.flatnonzero(np.bincount(codes, minlength=len(categories)))
+    names = np.array([str(name) for name in categories[used]], dtype=object)
+    order = np.argsort(names, kind="stable")
+    position = np.zeros(len(categories), dtype=np.int64)
+    position[used[order]] = np.arange(len(used))
+
+    n_cols = max(len(used), 1)
+    keys = row_codes.astype(np.int64) * n_cols + position[codes]
+    keys.sort()
+    keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))] if len(keys) else keys
+    rows, indices = np.divmod(keys, n_cols)
+    indptr = np.zeros(len(order_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(order_ids)), out=indptr[1:])
+    encoded = sparse.csr_matrix(
+        (np.ones(len(keys), dtype=bool), indices.astype(np.int32), indptr), shape=(len(order_ids), len(used))
+    )
+    encoded.has_canonical_format = True
+    return Baskets(order_ids=np.asarray(order_ids), encoded=encoded, columns=names[order])
+
+
+def use_sparse_encoding(encoded: sparse.csr_matrix, encoding: str = "auto") -> bool:
+    """
+    Decide la codificación del basket: "dense", "sparse" o "auto".
+
+    En "auto" se usa CSR cuando la matriz densa tendría al menos SPARSE_MIN_CELLS
+    celdas y su densidad no supera SPARSE_MAX_DENSITY.
+    """
+    if encoding not in ("auto", "dense", "sparse"):
+        raise ValueError(f"encoding desconocido: {encoding}")
+    if encoding != "auto":
+        return encoding == "sparse"
+    n_rows, n_cols = encoded.shape
+    cells = n_rows * n_cols
+    return cells >= SPARSE_MIN_CELLS and encoded.nnz / cells <= SPARSE_MAX_DENSITY
 
 
 def compute_rules(
-    basket_df: pd.DataFrame, 
+    baskets: Baskets,
     min_support: float, 
     client_logger=None,
-    search_product_groups: list[list[str]] | None = None
+    search_product_groups: list[list[str]] | None = None,
+    encoding: str = "auto",
+    engine: str = "auto",
+    constrained: bool = False,
+    top_n: int | None = None,
+    metric: str = "confidence",
 ) -> pd.DataFrame:
-    log = client_logger or logger
-    te = TransactionEncoder()
-    log.info("Transformando datos")
-    basket_encoded = te.fit_transform(
-        basket_df["items"].apply(lambda x: [str(item) for item in x])
+    """
+    Mina itemsets frecuentes sobre los baskets y genera reglas de un consecuente.
+
+    Con `constrained` y grupos de búsqueda, solo se minan itemsets que contienen
+    al menos un producto de cada grupo y reglas con algún producto buscado en el
+    LHS (ver mining.mine_constrained_rules), en vez de minar todo el basket y
+    filtrar al final.
+
+    Con `top_n` solo se devuelven las `top_n` mejores reglas por `metric` (sin
+    conviction infinita), elegidas por selección parcial; sin `top_n`, todas las
+    reglas ordenadas por confianza.
+    """
+    # Los baskets ya vienen en CSR; la matriz densa solo se crea si conviene
+    return rules_from_encoded(
+        baskets.encoded, baskets.columns.tolist(), min_support, client_logger, search_product_groups, encoding, engine, constrained,
+        top_n, metric,
     )
 
-    log.info("Creando DataFrame binario")
-    basket_encoded_df = pd.DataFrame(basket_encoded, columns=te.columns_)
-    log.info("Dimension de basket: %s", basket_encoded_df.shape)
 
-    log.info("Aplicando reglas de asociacion (%s)", basket_encoded_df.shape)
-    frequent_itemsets = apriori(
-        basket_encoded_df, min_support=min_support, use_colnames=True
+def rules_from_encoded(
+    basket_encoded: sparse.csr_matrix,
+    columns: list[str],
+    min_support: float,
+    client_logger=None,
+    search_product_groups: list[list[str]] | None = None,
+    encoding: str = "auto",
+    engine: str = "auto",
+    constrained: bool = False,
+    top_n: int | None = None,
+    metric: str = "confidence",
+) -> pd.DataFrame:
+    """compute_rules sobre una matriz de baskets (o una submatriz, ver batch)."""
+    rules = mine_encoded(
+        basket_encoded, columns, min_support, client_logger, search_product_groups, encoding, engine, constrained
     )
+    return select_rules(rules, columns, search_product_groups, top_n, metric, client_logger)
 
-    log.info("Generando reglas (%s)", frequent_itemsets.shape)
-    rules = association_rules(frequent_itemsets, metric="lift", min_threshold=1)
 
-    log.info("Ordenando reglas")
-    rules = rules.sort_values(["confidence"], ascending=[False])
-    rules = rules.rename(
-        columns={
-            "antecedents": "lhs",
-            "consequents": "rhs",
-            "antecedent support": "antecedent_support",
-            "consequent support": "consequent_support",
-        }
+def measured_rules(
+    basket_encoded: sparse.csr_matrix,
+    columns: list[str],
+    min_support: float,
+    client_logger=None,
+    search_product_groups: list[list[str]] | None = None,
+    encoding: str = "auto",
+    engine: str = "auto",
+    constrained: bool = False,
+    top_n: int | None = None,
+    metric: str = "confidence",
+) -> tuple[pd.DataFrame, PipelineStats]:
+    """
+    rules_from_encoded midiendo en el proceso que mina (el pool de minado): los
+    segundos de minado y selección de reglas, itemsets, reglas y el pico de RSS.
+    """
+    stats = PipelineStats()
+    reset_peak_memory()
+    with stats.stage("minado"):
+        mined = mine_encoded(
+            basket_encoded, columns, min_support, client_logger, search_product_groups, encoding, engine, constrained
+        )
+    with stats.stage("reglas"):
+        rules = select_rules(mined, columns, search_product_groups, top_n, metric, client_logger)
+    stats.itemsets = mined.itemsets
+    stats.rules = len(mined)
+    stats.peak_memory = peak_memory()
+    return rules, stats
+
+
+def mine_encoded(
+    basket_encoded: sparse.csr_matrix,
+    columns: list[str],
+    min_support: float,
+    client_logger=None,
+    search_product_groups: list[list[str]] | None = None,
+    encoding: str = "auto",
+    engine: str = "auto",
+    constrained: bool = False,
+) -> MinedRules:
+    """Itemsets frecuentes y reglas de un consecuente (sin ordenar) de una matriz de baskets."""
+    log = client_logger or logger
+    n_rows, n_cols = basket_encoded.shape
+    density = basket_encoded.nnz / (n_rows * n_cols) if n_rows * n_cols else 0.0
+    is_sparse = use_sparse_encoding(basket_encoded, encoding)
+    if is_sparse:
+        encoded_bytes = (
+            basket_encoded.data.nbytes + basket_encoded.indices.nbytes + basket_encoded.indptr.nbytes
+        )
+    else:
+        encoded_bytes = n_rows * n_cols
+    log.info(
+        "Dimension de basket: %s, densidad %.4f, %s, %.1f MB",
+        basket_encoded.shape, density, "sparse" if is_sparse else "densa", encoded_bytes / 1e6,
     )
 
-    rules["rhs_len"] = rules["rhs"].apply(lambda x: len(x))
-    rules_rhs = rules[rules["rhs_len"] == 1]
+    if constrained and search_product_groups:
+        return mine_constrained_rules(
+            basket_encoded, columns, min_support, search_product_groups,
+            engine, is_sparse, client_logger,
+        )
+    if is_sparse:
+        log.info("Creando DataFrame binario (sparse)")
+        basket_encoded_df = pd.DataFrame.sparse.from_spmatrix(basket_encoded, columns=columns)
+    else:
+        log.info("Creando DataFrame binario")
+        basket_encoded_df = pd.DataFrame(basket_encoded.toarray(), columns=columns)
+    return mine_rules(basket_encoded_df, basket_encoded, min_support, engine, is_sparse, client_logger)
+
 
-    # Si buscamos múltiples productos, filtrar reglas donde el LHS contenga productos de los grupos buscados
+def select_rules(
+    rules: MinedRules,
+    columns: list[str],
+    search_product_groups: list[list[str]] | None = None,
+    top_n: int | None = None,
+    metric: str = "confidence",
+    client_logger=None,
+) -> pd.DataFrame:
+    """Filtro de LHS para búsquedas múltiples y top N (o todas las reglas ordenadas), con nombres."""
+    log = client_logger or logger
+    # Si buscamos múltiples productos, solo reglas con algún producto de los términos buscados en el LHS
     if search_product_groups and len(search_product_groups) > 1:
         log.info("Filtrando reglas que incluyan productos de los términos buscados en el LHS...")
-        
-        def contains_search_products(lhs_set, product_groups):
-            """Verifica si el LHS contiene al menos un producto de cada grupo buscado."""
-            # Aplanar todos los productos de todos los grupos
-            all_search_products = set()
-            for group in product_groups:
-                all_search_products.update(group)
-            
-            # Verificar si algún producto del LHS está en los productos buscados
-            return bool(lhs_set.intersection(all_search_products))
-        
-        rules_rhs["contains_search"] = rules_rhs["lhs"].apply(
-            lambda lhs: contains_search_products(lhs, search_product_groups)
-        )
-        
-        filtered_rules = rules_rhs[rules_rhs["contains_search"]]
-        rules_rhs = filtered_rules.drop(columns=["contains_search"])
-        
-        log.info("Reglas filtradas: %d (que incluyen productos buscados en LHS)", len(rules_rhs))
-    
-    del basket_encoded, basket_encoded_df, frequent_itemsets
-    return rules_rhs
+        column_index = {name: i for i, name in enumerate(columns)}
+        search_codes = {column_index[p] for group in search_product_groups for p in group if p in column_index}
+        rules = rules.take(np.flatnonzero(rules.lhs_touches(search_codes)))
+        log.info("Reglas filtradas: %d (que incluyen productos buscados en LHS)", len(rules))
+
+    if top_n is not None:
+        log.info("Seleccionando top %d reglas por %s", top_n, metric)
+        return rules.top(top_n, metric).to_frame()
+    log.info("Ordenando reglas")
+    return rules.take(rules.sort_order()).to_frame()
 
 
-def format_top_rules(rules: pd.DataFrame, top_n: int = 5) -> list[dict]:
+def format_top_rules(rules: pd.DataFrame, top_n: int = DEFAULT_TOP_N, metric: str = "confidence") -> list[dict]:
+    """
+    Top N reglas serializadas, sin conviction infinita. `rules` viene ordenado por
+    confianza (compute_rules); para otra métrica se eligen las candidatas con
+    selección parcial y se reordenan de forma estable, así que los empates
+    conservan el orden por confianza.
+    """
     filtered_rules = rules[
         (rules["conviction"].notnull()) & (rules["conviction"] != float("inf"))
     ]
+    if metric != "confidence" and len(filtered_rules) > 0:
+        values = filtered_rules[metric].to_numpy()
+        candidates = top_positions(values, top_n)
+        order = candidates[np.argsort(-values[candidates], kind="stable")]
+        filtered_rules = filtered_rules.iloc[order]
     result = filtered_rules.head(top_n).to_dict(orient="records")
     for row in result:
-        row["lhs"] = list(row["lhs"])
-        row["rhs"] = list(row["rhs"])
-        row.pop("rhs_len", None)
+        row["lhs"] = sorted(row["lhs"])
+        row["rhs"] = sorted(row["rhs"])
 
     del rules, filtered_rules
     return result
 
 
+def rules_from_index(
+    rule_index,
+    basket_encoded: sparse.csr_matrix,
+    columns: list[str],
+    search_product_groups: list[list[str]],
+    min_support: float,
+    top_n: int = DEFAULT_TOP_N,
+    client_logger=None,
+    metric: str = "confidence",
+    constrained: bool = False,
+) -> list[dict] | None:
+    """
+    Top N reglas de los baskets filtrados armadas con el índice de itemsets del
+    snapshot (RuleIndex.conditional_rules): las mismas que daría el minado bajo
+    demanda. None si el índice no cubre la búsqueda o da menos de `top_n`
+    reglas, para que se mine.
+    """
+    log = client_logger or logger
+    mined = rule_index.conditional_rules(basket_encoded, columns, search_product_groups, min_support, constrained)
+    if mined is not None:
+        rules = select_rules(mined, columns, search_product_groups, top_n, metric, client_logger)
+        top_rules = format_top_rules(rules, top_n, metric)
+        if len(top_rules) >= top_n:
+            log.info("Respondiendo desde índice de reglas (versión %s)", rule_index.version)
+            return top_rules
+    log.info("El índice de reglas no cubre la búsqueda, minando bajo demanda")
+    return None
+
+
 def run_mba_pipeline(
     product_names: list[str],
     query: str,
     db_url: str,
     min_support: float,
     transform_fn: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
-    top_n: int = 5,
+    top_n: int = DEFAULT_TOP_N,
     client_logger=None,
     partial_match: bool = True,
+    snapshot=None,
+    engine: str = "auto",
+    rule_index=None,
+    constrained: bool = False,
+    progress: Optional[Callable[[str], None]] = None,
+    metric: str = "confidence",
+    stats: PipelineStats | None = None,
+    client_name: str | None = None,
 ) -> list[dict] | None:
     """
     Pipeline completo de MBA:
-    1. load_data: SQL fetch + filtro por producto (búsqueda parcial o exacta)
+    1. load_data: SQL fetch + filtro por producto (búsqueda parcial sin acentos, o exacta)
+       - Con snapshot: filtra sobre las transacciones ya residentes en memoria, sin SQL,
+         con las listas de órdenes por producto del snapshot (filter_snapshot)
        - Para múltiples productos: filtra órdenes que contengan TODOS
-    2. transform_fn: limpieza custom del cliente (opcional)
-    3. process_data: agrupar en baskets
-    4. compute_rules: TransactionEncoder + Apriori + association_rules
+       - product_name viaja como categórico (diccionario + códigos enteros) hasta el final
+    2. transform_fn: limpieza custom del cliente (opcional, recibe product_name como strings)
+    3. process_data: agrupar en baskets (matriz CSR sobre los códigos de producto)
+       - rule_index (opcional, con snapshot, sin transform_fn ni fpmax): si el índice de
+         itemsets del snapshot cubre la búsqueda, arma las reglas de estos baskets
+         sin minar (rules_from_index)
+    4. compute_rules: minado (apriori/fpgrowth/fpmax) + reglas de un consecuente
+       - Corre en el pool de procesos de minado (puede lanzar MiningPoolBusy),
+         que devuelve también sus mediciones (measured_rules)
        - Para múltiples productos: prioriza reglas donde aparecen juntos en LHS
+       - constrained: solo mina itemsets con productos de todos los términos buscados
+       - Selección parcial del top N por `metric`, sin ordenar todas las reglas
     5. format_top_rules: filtrar + serializar top N
     
     Args:
         product_names: Lista de productos a buscar. Si hay múltiples, busca órdenes con TODOS.
         partial_match: Si True, busca coincidencias parciales case-insensitive
+        snapshot: TransactionSnapshot opcional; si se pasa, query/db_url no se usan
+        engine: Motor de minado (ver mining.MINING_ENGINES); "auto" elige según el basket
+        rule_index: RuleIndex de la misma versión que `snapshot`
+        constrained: Minado restringido a los productos buscados (ver compute_rules)
+        progress: Callback opcional que recibe cada etapa (PIPELINE_STAGES) al empezarla
+        metric: Métrica de ranking del top N (ver mining.RANKING_METRICS)
+        stats: PipelineStats opcional con segundos por etapa y conteos (ver metrics.track_pipeline)
+        client_name: Cliente dueño del engine de BD (ver load_data)
     
     Returns:
         Lista de reglas de asociación o None si no se encuentran productos/reglas
     """
-    result = load_data(product_names, query, db_url, client_logger, partial_match)
+    log = client_logger or logger
+    report = progress or (lambda stage: None)
+    stats = stats or PipelineStats()
+    report("carga")
+    if snapshot is not None:
+        stats.source = "snapshot"
+        with stats.stage("filtro"):
+            if partial_match:
+                result = filter_snapshot(snapshot, product_names, client_logger)
+            else:
+                result = filter_transactions(snapshot.to_frame(), product_names, client_logger, partial_match)
+    else:
+        result = load_data(product_names, query, db_url, client_logger, partial_match, stats, client_name)
     if result[0] is None:
         return None
     
     df, product_groups = result
+    if snapshot is not None:
+        stats.rows += len(df)
 
     if transform_fn is not None:
-        df = transform_fn(df)
+        report("transformacion")
+        with stats.stage("transformacion"):
+            df = transform_fn(with_product_names(df))
 
-    basket = process_data(df, client_logger)
-    rules = compute_rules(basket, min_support, client_logger, product_groups)
+    report("baskets")
+    with stats.stage("baskets"):
+        basket = process_data(df, client_logger)
+    stats.orders += len(basket)
+    if rule_index is not None and snapshot is not None and partial_match and transform_fn is None and engine != "fpmax":
+        with stats.stage("indice"):
+            top_rules = rules_from_index(
+                rule_index, basket.encoded, basket.columns.tolist(), product_groups, min_support, top_n,
+                client_logger, metric, constrained,
+            )
+        if top_rules is not None:
+            stats.source = "indice"
+            return top_rules
+
+    report("minado")
+    started = time.perf_counter()
+    rules, mining_stats = mining_pool.run(
+        measured_rules, basket.encoded, basket.columns.tolist(), min_support, client_logger, product_groups,
+        engine=engine, constrained=constrained, top_n=top_n, metric=metric,
+    )
+    stats.merge(mining_stats)
+    # Espera en la cola del pool y traslado de la matriz y las reglas entre procesos
+    stats.add_stage("cola", max(time.perf_counter() - started - sum(mining_stats.stages.values()), 0.0))
     
     if len(rules) == 0:
-        log = client_logger or logger
         log.warning("No se generaron reglas de asociación con min_support=%.4f", min_support)
         return None
     
-    return format_top_rules(rules, top_n)
+    report("formato")
+    with stats.stage("formato"):
+        return format_top_rules(rules, top_n, metric)
@@ -0,0 +1,59 @@
+import os
+from pathlib import Path
+
+from app.services.snapshot import snapshot_store
+
+_SMAPS_ROLLUP = Path("/proc/self/smaps_rollup")
+_SMAPS_FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared_clean",
+    "Shared_Dirty": "shared_dirty",
+    "Private_Clean": "private_clean",
+    "Private_Dirty": "private_dirty",
+}
+
+
+def process_memory() -> dict[str, int]:
+    """
+    Memoria del worker actual en bytes según /proc/self/smaps_rollup (Linux).
+
+    `rss` cuenta las páginas compartidas en cada worker; `pss` las reparte entre
+    los procesos que las mapean, así que la suma de `pss` de todos los workers es
+    la memoria real del contenedor. Diccionario vacío fuera de Linux.
+    """
+    try:
+        lines = _SMAPS_ROLLUP.read_text().splitlines()
+    except OSError:
+        return {}
+
+    memory = {}
+    for line in lines:
+        field, _, value = line.partition(":")
+        if field in _SMAPS_FIELDS:
+            memory[_SMAPS_FIELDS[field]] = int(value.split()[0]) * 1024
+    if memory:
+        memory["shared"] = memory.get("shared_clean", 0) + memory.get("shared_dirty", 0)
+        memory["private"] = memory.get("private_clean", 0) + memory.get("private_dirty", 0)
+    return memory
+
+
+def memory_report() -> dict:
+    """RSS vs memoria compartida del worker y bytes de snapshot mapeados desde disco por cliente."""
+    snapshots = {}
+    for name, snapshot in snapshot_store.snapshots().items():
+        snapshots[name] = {
+            "version": snapshot.version,
+            "rows": len(snapshot),
+            "bytes": snapshot.nbytes,
+            "shared_bytes": snapshot.shared_nbytes,
+            # Sin snapshot en disco el order_index se construye en cada worker en su primera búsqueda (privado)
+            "order_index_bytes": (
+                snapshot.order_index.nbytes
+                if snapshot.stored_order_index is not None or "order_index" in vars(snapshot) else None
+            ),
+            "order_index_shared_bytes": (
+                snapshot.stored_order_index.shared_nbytes if snapshot.stored_order_index is not None else 0
+            ),
+        }
+    return {"pid": os.getpid(), "process": process_memory(), "snapshots": snapshots}
@@ -0,0 +1,292 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+_STATUS = Path("/proc/self/status")
+_CLEAR_REFS = Path("/proc/self/clear_refs")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# 64 MB a 16 GB
+MEMORY_BUCKETS = tuple(float(2 ** power) for power in range(26, 35))
+
+
+def reset_peak_memory() -> bool:
+    """
+    Reinicia el pico de RSS del proceso (VmHWM) para medir el de una operación
+    con peak_memory. False si el kernel no lo permite (fuera de Linux).
+    """
+    try:
+        _CLEAR_REFS.write_text("5")
+    except OSError:
+        return False
+    return True
+
+
+def peak_memory() -> int | None:
+    """Pico de RSS del proceso en bytes desde el arranque o el último reset_peak_memory."""
+    try:
+        lines = _STATUS.read_text().splitlines()
+    except OSError:
+        return None
+    for line in lines:
+        if line.startswith("VmHWM:"):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+@dataclass
+class PipelineStats:
+    """
+    Mediciones de una ejecución del pipeline, llenadas etapa por etapa.
+
+    `stages` acumula segundos por etapa: consulta (SQL), filtro (búsqueda de
+    productos y órdenes), indice, transformacion, baskets, cola (espera y
+    traslado al pool de minado), minado, reglas y formato. Lo que se mide en el
+    proceso de minado vuelve en otra PipelineStats y se suma con merge.
+    """
+
+    stages: dict[str, float] = field(default_factory=dict)
+    # De dónde salieron las líneas: "db", "snapshot" o "indice" (respondido por el índice de reglas)
+    source: str = "db"
+    rows: int = 0
+    orders: int = 0
+    itemsets: int = 0
+    rules: int = 0
+    # Pico de RSS del proceso que minó, en bytes
+    peak_memory: int | None = None
+    outcome: str = "ok"
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - started)
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def merge(self, other: "PipelineStats", stages: bool = True) -> None:
+        """Suma etapas y conteos de `other` (ej. el minado en el pool); el pico de memoria es el máximo."""
+        if stages:
+            for name, seconds in other.stages.items():
+                self.add_stage(name, seconds)
+        self.rows += other.rows
+        self.orders += other.orders
+        self.itemsets += other.itemsets
+        self.rules += other.rules
+        if other.peak_memory is not None:
+            self.peak_memory = max(self.peak_memory or 0, other.peak_memory)
+
+
+@dataclass(frozen=True)
+class Metric:
+    name: str
+    kind: str
+    help: str
+    labels: tuple[str, ...]
+    buckets: tuple[float, ...] = ()
+
+
+class MetricsRegistry:
+    """
+    Registro mínimo de counters e histogramas con labels, expuesto en el formato
+    de texto de Prometheus.
+
+    Cada worker de gunicorn acumula en memoria y, con `metrics_dir`, guarda su
+    estado en `{metrics_dir}/{pid}.json` en cada flush; render suma los archivos
+    de todos los workers, así que el scrape ve los totales del contenedor sin
+    importar qué worker lo atiende. Los archivos de workers que ya terminaron se
+    siguen sumando para que los counters no retrocedan; gunicorn vacía el
+    directorio al arrancar (on_starting en gunicorn.conf.py).
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        # Counter: [valor]; histograma: [acumulado por bucket..., count (+Inf), sum]
+        self._values: dict[str, dict[tuple[str, ...], list[float]]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...]) -> Metric:
+        return self._register(Metric(name, "counter", help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...], buckets: tuple[float, ...]) -> Metric:
+        return self._register(Metric(name, "histogram", help, labels, tuple(buckets)))
+
+    def inc(self, metric: Metric, labels: tuple[str, ...], value: float = 1.0) -> None:
+        with self._lock:
+            values = self._values[metric.name].setdefault(labels, [0.0])
+            values[0] += value
+
+    def observe(self, metric: Metric, labels: tuple[str, ...], value: float) -> None:
+        with self._lock:
+            values = self._values[metric.name].setdefault(labels, [0.0] * (len(metric.buckets) + 2))
+            for position, bound in enumerate(metric.buckets):
+                if value <= bound:
+                    values[position] += 1
+            values[-2] += 1
+            values[-1] += value
+
+    def flush(self) -> None:
+        """Guarda el estado del worker para que /metrics lo sume desde cualquier worker."""
+        directory = get_settings().metrics_dir
+        if not directory:
+            return
+        path = Path(directory) / f"{os.getpid()}.json"
+        # Un flush a la vez por worker: el último os.replace siempre deja el estado más nuevo
+        with self._flush_lock:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                staged = path.with_suffix(f".{threading.get_ident()}.tmp")
+                staged.write_text(json.dumps(self._state()))
+                os.replace(staged, path)
+            except OSError as exc:
+                logger.warning("No se pudieron guardar las métricas en %s: %s", path, exc)
+
+    def render(self) -> str:
+        """Texto para /metrics con la suma de todos los workers."""
+        totals = {
+            name: {tuple(labels): values for labels, values in samples}
+            for name, samples in self._state().items()
+        }
+        for state in self._other_workers():
+            for name, samples in state.items():
+                merged = totals.get(name)
+                if merged is None:
+                    continue
+                for labels, values in samples:
+                    current = merged.setdefault(tuple(labels), [0.0] * len(values))
+                    # Un archivo con otros buckets (versión anterior) no se puede sumar
+                    if len(current) == len(values):
+                        merged[tuple(labels)] = [a + b for a, b in zip(current, values)]
+
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, values in sorted(totals[name].items()):
+                pairs = list(zip(metric.labels, labels))
+                if metric.kind == "counter":
+                    lines.append(f"{name}{_labels(pairs)} {_number(values[0])}")
+                    continue
+                bounds = [_number(bound) for bound in metric.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, values[:-1]):
+                    lines.append(f"{name}_bucket{_labels(pairs + [('le', bound)])} {_number(count)}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(values[-1])}")
+                lines.append(f"{name}_count{_labels(pairs)} {_number(values[-2])}")
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        self._values[metric.name] = {}
+        return metric
+
+    def _state(self) -> dict[str, list]:
+        with self._lock:
+            return {
+                name: [[list(labels), list(values)] for labels, values in samples.items()]
+                for name, samples in self._values.items()
+            }
+
+    def _other_workers(self) -> Iterator[dict]:
+        directory = get_settings().metrics_dir
+        if not directory or not Path(directory).is_dir():
+            return
+        for path in Path(directory).glob("*.json"):
+            if path.stem == str(os.getpid()):
+                continue
+            try:
+                yield json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+
+
+def clear_worker_files() -> None:
+    """Borra los estados guardados por workers de una ejecución anterior del servidor."""
+    directory = get_settings().metrics_dir
+    if not directory or not Path(directory).is_dir():
+        return
+    for path in Path(directory).glob("*.json"):
+        path.unlink(missing_ok=True)
+
+
+def _labels(pairs: list[tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+registry = MetricsRegistry()
+
+REQUESTS = registry.counter(
+    "mba_requests_total", "Ejecuciones del pipeline por resultado (ok, vacio, error)", ("client", "outcome")
+)
+REQUEST_SECONDS = registry.histogram(
+    "mba_request_seconds", "Duración del pipeline por origen de los datos", ("client", "source"), DURATION_BUCKETS
+)
+STAGE_SECONDS = registry.histogram(
+    "mba_stage_seconds", "Duración de cada etapa del pipeline", ("client", "stage"), DURATION_BUCKETS
+)
+ROWS_FETCHED = registry.counter(
+    "mba_rows_fetched_total", "Líneas de orden leídas de la BD o del snapshot", ("client", "source")
+)
+ORDERS_MATCHED = registry.counter("mba_orders_matched_total", "Órdenes que entraron al basket", ("client",))
+ITEMSETS = registry.counter("mba_itemsets_total", "Itemsets frecuentes minados", ("client",))
+RULES = registry.counter("mba_rules_generated_total", "Reglas de un consecuente generadas", ("client",))
+PEAK_MEMORY = registry.histogram(
+    "mba_mining_peak_memory_bytes", "Pico de RSS del proceso que minó cada solicitud", ("client",), MEMORY_BUCKETS
+)
+
+
+def record_pipeline(client_name: str, stats: PipelineStats, seconds: float) -> None:
+    """Registra una ejecución del pipeline (ver track_pipeline)."""
+    registry.inc(REQUESTS, (client_name, stats.outcome))
+    registry.observe(REQUEST_SECONDS, (client_name, stats.source), seconds)
+    for stage, stage_seconds in stats.stages.items():
+        registry.observe(STAGE_SECONDS, (client_name, stage), stage_seconds)
+    registry.inc(ROWS_FETCHED, (client_name, stats.source), stats.rows)
+    registry.inc(ORDERS_MATCHED, (client_name,), stats.orders)
+    registry.inc(ITEMSETS, (client_name,), stats.itemsets)
+    registry.inc(RULES, (client_name,), stats.rules)
+    if stats.peak_memory is not None:
+        registry.observe(PEAK_MEMORY, (client_name,), stats.peak_memory)
+    registry.flush()
+
+
+@contextmanager
+def track_pipeline(client_name: str) -> Iterator[PipelineStats]:
+    """
+    PipelineStats para pasarle al pipeline; al salir registra duración, etapas y
+    conteos (outcome "error" si hubo excepción).
+    """
+    stats = PipelineStats()
+    started = time.perf_counter()
+    try:
+        yield stats
+    except Exception:
+        stats.outcome = "error"
+        raise
+    finally:
+        record_pipeline(client_name, stats, time.perf_counter() - started)
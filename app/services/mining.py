@@ -0,0 +1,449 @@
+import logging
+from dataclasses import dataclass
+from functools import reduce
+from itertools import chain
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from mlxtend.frequent_patterns import apriori, fpgrowth, fpmax
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+# Motores de minado disponibles. apriori y fpgrowth son exactos (mismos itemsets
+# y reglas); fpmax solo mina itemsets maximales y genera las reglas de un
+# consecuente que se derivan de ellos.
+MINING_ENGINES = ("auto", "apriori", "fpgrowth", "fpmax")
+
+# Con pocos productos frecuentes la generación de candidatos de apriori es barata y
+# su versión vectorizada le gana al árbol de fpgrowth; hacia ~150 productos
+# frecuentes fpgrowth ya es 2x más rápido (ver test/compare_engines.py).
+APRIORI_MAX_FREQUENT_ITEMS = 60
+# apriori materializa órdenes x pares candidatos en booleano denso: tope en celdas
+APRIORI_MAX_CANDIDATE_CELLS = 200_000_000
+
+# Si los productos buscados son más de esta fracción de las columnas, la restricción
+# casi no poda: conviene minar todo el basket y filtrar
+CONSTRAINED_MAX_QUERY_FRACTION = 0.5
+
+# Campos de AssociationRule (app/models/schemas.py), en el orden en que se emiten
+RULE_COLUMNS = [
+    "lhs", "rhs", "support", "confidence", "lift", "leverage", "conviction",
+    "antecedent_support", "consequent_support", "zhangs_metric",
+]
+
+# Métricas por las que se puede ordenar el top N (mayor es mejor)
+RANKING_METRICS = ("confidence", "lift", "conviction", "zhangs_metric")
+
+# Reglas por bloque al convertir bitmasks a nombres de producto
+_UNPACK_BLOCK = 8192
+
+
+def select_engine(encoded: sparse.csr_matrix, min_support: float, engine: str = "auto") -> str:
+    """
+    Resuelve el motor a usar para una matriz de basket.
+
+    "auto" elige apriori solo si hay pocos productos frecuentes y sus pares
+    candidatos caben en memoria; en otro caso fpgrowth, cuyo costo no explota con
+    soportes bajos.
+    """
+    if engine not in MINING_ENGINES:
+        raise ValueError(f"Motor de minado desconocido: {engine}. Opciones: {', '.join(MINING_ENGINES)}")
+    if engine != "auto":
+        return engine
+    n_rows = encoded.shape[0]
+    item_counts = np.asarray(encoded.sum(axis=0)).ravel()
+    frequent_items = int((item_counts >= min_support * n_rows).sum())
+    candidate_cells = n_rows * frequent_items * (frequent_items - 1) // 2
+    if frequent_items <= APRIORI_MAX_FREQUENT_ITEMS and candidate_cells <= APRIORI_MAX_CANDIDATE_CELLS:
+        return "apriori"
+    return "fpgrowth"
+
+
+def rule_metrics(support: np.ndarray, antecedent_support: np.ndarray, consequent_support: np.ndarray) -> dict:
+    """Métricas de reglas A -> C a partir de sAC, sA y sC (mismas fórmulas que mlxtend)."""
+    confidence = support / antecedent_support
+    lift = confidence / consequent_support
+    leverage = support - antecedent_support * consequent_support
+
+    conviction = np.full(confidence.shape, np.inf)
+    finite = confidence < 1.0
+    conviction[finite] = (1.0 - consequent_support[finite]) / (1.0 - confidence[finite])
+
+    denominator = np.maximum(
+        support * (1 - antecedent_support), antecedent_support * (consequent_support - support)
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zhangs_metric = np.where(denominator == 0, 0, leverage / denominator)
+
+    return {
+        "support": support,
+        "confidence": confidence,
+        "lift": lift,
+        "leverage": leverage,
+        "conviction": conviction,
+        "antecedent_support": antecedent_support,
+        "consequent_support": consequent_support,
+        "zhangs_metric": zhangs_metric,
+    }
+
+
+def item_mask(codes: Iterable[int], n_words: int) -> np.ndarray:
+    """Bitmask uint64 (n_words palabras) con los bits de las columnas `codes`."""
+    codes = np.asarray(list(codes), dtype=np.int64)
+    mask = np.zeros(n_words, dtype=np.uint64)
+    np.bitwise_or.at(mask, codes >> 6, np.left_shift(np.uint64(1), (codes & 63).astype(np.uint64)))
+    return mask
+
+
+def _itemset_masks(flat: np.ndarray, lengths: np.ndarray, n_words: int) -> np.ndarray:
+    """Bitmasks (itemsets x palabras) a partir de los códigos concatenados de cada itemset."""
+    masks = np.zeros((len(lengths), n_words), dtype=np.uint64)
+    owner = np.repeat(np.arange(len(lengths)), lengths)
+    np.bitwise_or.at(masks, (owner, flat >> 6), np.left_shift(np.uint64(1), (flat & 63).astype(np.uint64)))
+    return masks
+
+
+def _mask_codes(masks: np.ndarray, n_cols: int) -> list[np.ndarray]:
+    """Códigos de columna (ascendentes) de cada bitmask."""
+    codes: list[np.ndarray] = []
+    for start in range(0, len(masks), _UNPACK_BLOCK):
+        block = np.ascontiguousarray(masks[start:start + _UNPACK_BLOCK], dtype="<u8")
+        bits = np.unpackbits(block.view(np.uint8), axis=1, bitorder="little")[:, :n_cols]
+        rows, cols = np.nonzero(bits)
+        codes.extend(np.split(cols, np.cumsum(np.bincount(rows, minlength=len(bits)))[:-1]))
+    return codes
+
+
+def top_positions(values: np.ndarray, n: int) -> np.ndarray:
+    """
+    Posiciones (ascendentes) de los `n` valores más altos, incluyendo todos los
+    empates con el n-ésimo para que el orden final no dependa de argpartition.
+    Es O(len(values)): no ordena el array completo.
+    """
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if len(values) <= n:
+        return np.arange(len(values))
+    threshold = np.partition(values, len(values) - n)[len(values) - n]
+    return np.flatnonzero(values >= threshold)
+
+
+def _flatten_itemsets(itemsets: Iterable[frozenset]) -> tuple[np.ndarray, np.ndarray]:
+    """(códigos concatenados, largo de cada itemset) de itemsets de posiciones de columna."""
+    itemsets = list(itemsets)
+    lengths = np.fromiter(map(len, itemsets), dtype=np.int64, count=len(itemsets))
+    flat = np.fromiter(chain.from_iterable(itemsets), dtype=np.int64, count=int(lengths.sum()))
+    return flat, lengths
+
+
+@dataclass
+class MinedRules:
+    """
+    Reglas de un consecuente en forma columnar.
+
+    `antecedents` son bitmasks uint64 (reglas x palabras) sobre las columnas del
+    basket y `consequents` el código de columna del consecuente; `metrics` trae
+    support, confidence, etc. alineadas por fila. Filtrar y ordenar se hace sobre
+    estos arrays; los nombres de producto solo se materializan en to_frame.
+    `itemsets` es la cantidad de itemsets frecuentes de los que salieron.
+    """
+
+    antecedents: np.ndarray
+    consequents: np.ndarray
+    metrics: pd.DataFrame
+    columns: np.ndarray
+    itemsets: int = 0
+
+    @classmethod
+    def empty(cls, columns: list[str], itemsets: int = 0) -> "MinedRules":
+        n_words = max((len(columns) + 63) // 64, 1)
+        return cls(
+            antecedents=np.zeros((0, n_words), dtype=np.uint64),
+            consequents=np.zeros(0, dtype=np.int64),
+            metrics=pd.DataFrame({name: np.zeros(0) for name in RULE_COLUMNS[2:]}),
+            columns=np.asarray(columns, dtype=object),
+            itemsets=itemsets,
+        )
+
+    def __len__(self) -> int:
+        return len(self.consequents)
+
+    def take(self, positions: np.ndarray) -> "MinedRules":
+        return MinedRules(
+            antecedents=self.antecedents[positions],
+            consequents=self.consequents[positions],
+            metrics=self.metrics.iloc[positions].reset_index(drop=True),
+            columns=self.columns,
+            itemsets=self.itemsets,
+        )
+
+    def lhs_touches(self, codes: Iterable[int]) -> np.ndarray:
+        """Máscara de las reglas con alguno de los productos `codes` en el LHS."""
+        return (self.antecedents & item_mask(codes, self.antecedents.shape[1])).any(axis=1)
+
+    def rule_touches(self, codes: Iterable[int]) -> np.ndarray:
+        """Máscara de las reglas con alguno de los productos `codes` en el LHS o el RHS."""
+        codes = np.asarray(list(codes), dtype=np.int64)
+        return self.lhs_touches(codes) | np.isin(self.consequents, codes)
+
+    def sort_order(self, metric: str = "confidence") -> np.ndarray:
+        """
+        Posiciones por `metric` descendente y luego confianza y soporte; los empates
+        se rompen por consecuente y LHS, así que todos los motores exactos dan el
+        mismo orden.
+        """
+        keys = [self.consequents] + [self.antecedents[:, word] for word in range(self.antecedents.shape[1])]
+        keys += [-self.metrics["support"].to_numpy(), -self.metrics["confidence"].to_numpy()]
+        if metric != "confidence":
+            keys.append(-self.metrics[metric].to_numpy())
+        return np.lexsort(keys)
+
+    def top(self, n: int, metric: str = "confidence") -> "MinedRules":
+        """
+        Las `n` mejores reglas por `metric` (sin conviction infinita), ordenadas
+        como sort_order. Selección parcial: solo se ordenan las candidatas.
+        """
+        if metric not in RANKING_METRICS:
+            raise ValueError(f"Métrica de ranking desconocida: {metric}. Opciones: {', '.join(RANKING_METRICS)}")
+        candidates = np.flatnonzero(np.isfinite(self.metrics["conviction"].to_numpy()))
+        values = self.metrics[metric].to_numpy()[candidates]
+        selected = self.take(candidates[top_positions(values, n)])
+        return selected.take(selected.sort_order(metric)[:n])
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame con los campos de AssociationRule; lhs/rhs como frozensets de nombres."""
+        names = self.columns.tolist()
+        # Muchas reglas comparten antecedente: cada frozenset distinto se arma una sola vez
+        unique_antecedents, inverse = np.unique(self.antecedents, axis=0, return_inverse=True)
+        unique_lhs = [
+            frozenset(map(names.__getitem__, codes.tolist()))
+            for codes in _mask_codes(unique_antecedents, len(names))
+        ]
+        singletons = [frozenset((name,)) for name in names]
+        lhs = [unique_lhs[position] for position in inverse.ravel().tolist()]
+        rhs = [singletons[code] for code in self.consequents.tolist()]
+        frame = pd.DataFrame({"lhs": lhs, "rhs": rhs}, columns=RULE_COLUMNS[:2])
+        for name in RULE_COLUMNS[2:]:
+            frame[name] = self.metrics[name].to_numpy()
+        return frame
+
+
+def single_consequent_rules(
+    flat: np.ndarray,
+    lengths: np.ndarray,
+    supports: np.ndarray,
+    encoded: sparse.csr_matrix,
+    columns: list[str],
+    min_lift: float = 1.0,
+    lhs_required: Iterable[int] | None = None,
+) -> MinedRules:
+    """
+    Reglas (S - {c}) -> c para cada itemset S de 2+ productos y cada c en S.
+
+    Reemplaza a association_rules: solo genera consecuentes de un producto y todo
+    se calcula sobre bitmasks. El soporte del antecedente se busca entre los
+    mismos itemsets (apriori/fpgrowth reportan todos los subconjuntos frecuentes);
+    los que no están (fpmax, minado restringido) se cuentan en la matriz CSC.
+    Con `lhs_required` solo se generan reglas con alguno de esos productos en el LHS.
+    """
+    n_rows, n_cols = encoded.shape
+    if len(lengths) == 0:
+        return MinedRules.empty(columns)
+    n_words = max((n_cols + 63) // 64, 1)
+    masks = _itemset_masks(flat, lengths, n_words)
+
+    owner = np.repeat(np.arange(len(lengths)), lengths)
+    multi = lengths[owner] >= 2
+    rule_itemset, consequents = owner[multi], flat[multi]
+    antecedents = masks[rule_itemset]
+    antecedents[np.arange(len(consequents)), consequents >> 6] &= ~np.left_shift(
+        np.uint64(1), (consequents & 63).astype(np.uint64)
+    )
+    if lhs_required is not None:
+        keep = (antecedents & item_mask(lhs_required, n_words)).any(axis=1)
+        rule_itemset, consequents, antecedents = rule_itemset[keep], consequents[keep], antecedents[keep]
+    if len(consequents) == 0:
+        return MinedRules.empty(columns, len(lengths))
+
+    item_support = np.asarray(encoded.sum(axis=0)).ravel() / n_rows
+    metrics = pd.DataFrame(rule_metrics(
+        np.asarray(supports, dtype=float)[rule_itemset],
+        _antecedent_supports(antecedents, masks, np.asarray(supports, dtype=float), encoded),
+        item_support[consequents],
+    ))
+    keep = np.flatnonzero(metrics["lift"].to_numpy() >= min_lift)
+    return MinedRules(
+        antecedents=antecedents[keep],
+        consequents=consequents[keep],
+        metrics=metrics.iloc[keep].reset_index(drop=True),
+        columns=np.asarray(columns, dtype=object),
+        itemsets=len(lengths),
+    )
+
+
+def _antecedent_supports(
+    antecedents: np.ndarray, masks: np.ndarray, supports: np.ndarray, encoded: sparse.csr_matrix
+) -> np.ndarray:
+    """Soporte de cada antecedente: por búsqueda entre los itemsets o, si no está, contando órdenes."""
+    _, inverse = np.unique(np.concatenate([masks, antecedents]), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    lookup = np.full(inverse.max() + 1, -1, dtype=np.int64)
+    lookup[inverse[:len(masks)]] = np.arange(len(masks))
+    positions = lookup[inverse[len(masks):]]
+
+    result = np.empty(len(antecedents), dtype=float)
+    found = positions >= 0
+    result[found] = supports[positions[found]]
+    if not found.all():
+        missing_masks, missing_inverse = np.unique(antecedents[~found], axis=0, return_inverse=True)
+        csc = encoded.tocsc()
+        item_rows = [csc.indices[csc.indptr[i]:csc.indptr[i + 1]] for i in range(csc.shape[1])]
+        counts = np.array([
+            len(reduce(lambda a, b: np.intersect1d(a, b, assume_unique=True), (item_rows[i] for i in codes)))
+            for codes in _mask_codes(missing_masks, encoded.shape[1])
+        ])
+        result[~found] = counts[missing_inverse.ravel()] / encoded.shape[0]
+    return result
+
+
+def _to_frame(matrix: sparse.csr_matrix, is_sparse: bool) -> pd.DataFrame:
+    """DataFrame booleano con columnas 0..n-1, como lo esperan los motores de mlxtend."""
+    if is_sparse:
+        return pd.DataFrame.sparse.from_spmatrix(matrix)
+    return pd.DataFrame(matrix.toarray())
+
+
+def min_support_count(min_support: float, n_rows: int) -> int:
+    """Menor número de órdenes k con k / n_rows >= min_support (el criterio de mlxtend)."""
+    count = max(int(np.ceil(min_support * n_rows)), 1)
+    while count > 1 and (count - 1) / n_rows >= min_support:
+        count -= 1
+    while count / n_rows < min_support:
+        count += 1
+    return count
+
+
+def itemset_counts(
+    matrix: sparse.csr_matrix, min_count: int, engine: str, is_sparse: bool
+) -> list[tuple[tuple[int, ...], int]]:
+    """Itemsets (posiciones de columna) con al menos `min_count` órdenes en `matrix`."""
+    n_rows, n_cols = matrix.shape
+    if n_rows == 0 or n_cols == 0 or min_count > n_rows:
+        return []
+    # Se ajusta el soporte relativo a medio conteo por debajo para evitar redondeos en el borde
+    min_support = (min_count - 0.5) / n_rows
+    engine = select_engine(matrix, min_support, engine)
+    frame = _to_frame(matrix, is_sparse)
+    if engine == "apriori":
+        itemsets = apriori(frame, min_support=min_support, low_memory=is_sparse)
+    else:
+        itemsets = fpgrowth(frame, min_support=min_support)
+    return [
+        (tuple(sorted(itemset)), int(round(support * n_rows)))
+        for support, itemset in zip(itemsets["support"], itemsets["itemsets"])
+    ]
+
+
+def mine_constrained_rules(
+    encoded: sparse.csr_matrix,
+    columns: list[str],
+    min_support: float,
+    search_product_groups: list[list[str]],
+    engine: str = "auto",
+    is_sparse: bool = False,
+    client_logger=None,
+) -> MinedRules:
+    """
+    Minado restringido: solo itemsets con al menos un producto de cada grupo buscado.
+
+    Cada itemset S se descompone de forma única en A = S ∩ Q (Q = productos
+    buscados) y el resto Y. Primero se minan los anclas A frecuentes sobre las
+    columnas de Q y se conservan las que tocan todos los grupos; luego, por cada
+    ancla, se minan los Y frecuentes en la base condicional (órdenes que contienen
+    A, columnas fuera de Q). Así nunca se generan combinaciones que después se
+    descartarían. Las reglas X -> c exigen que el LHS contenga algún producto
+    buscado; el soporte de un LHS que no toca todos los grupos se cuenta en la
+    matriz CSC.
+    """
+    log = client_logger or logger
+    if engine == "fpmax":
+        engine = "fpgrowth"
+    n_rows = encoded.shape[0]
+    min_count = min_support_count(min_support, n_rows)
+    column_index = {name: i for i, name in enumerate(columns)}
+    groups = [{column_index[p] for p in group if p in column_index} for group in search_product_groups]
+    query_cols = np.array(sorted(set().union(*groups)), dtype=np.int64)
+    other_cols = np.setdiff1d(np.arange(encoded.shape[1]), query_cols)
+
+    if len(query_cols) > CONSTRAINED_MAX_QUERY_FRACTION * encoded.shape[1]:
+        log.info(
+            "Minado restringido: los productos buscados cubren %d de %d columnas, minado completo + filtro",
+            len(query_cols), encoded.shape[1],
+        )
+        frame = _to_frame(encoded, is_sparse)
+        frame.columns = columns
+        rules = mine_rules(frame, encoded, min_support, engine, is_sparse, client_logger)
+        keep = rules.lhs_touches(query_cols)
+        for group in groups:
+            keep &= rules.rule_touches(group)
+        return rules.take(np.flatnonzero(keep))
+
+    csc = encoded.tocsc()
+    item_rows = [csc.indices[csc.indptr[i]:csc.indptr[i + 1]] for i in range(csc.shape[1])]
+
+    anchors = [
+        (tuple(int(query_cols[i]) for i in itemset), count)
+        for itemset, count in itemset_counts(encoded[:, query_cols], min_count, engine, is_sparse)
+    ]
+    anchors = [(anchor, count) for anchor, count in anchors if all(group.intersection(anchor) for group in groups)]
+    log.info("Minado restringido: %d anclas frecuentes sobre %d productos buscados", len(anchors), len(query_cols))
+
+    counts: dict[frozenset, int] = {}
+    for anchor, anchor_count in anchors:
+        counts[frozenset(anchor)] = anchor_count
+        rows = reduce(lambda a, b: np.intersect1d(a, b, assume_unique=True), (item_rows[i] for i in anchor))
+        conditional = encoded[rows][:, other_cols]
+        for itemset, count in itemset_counts(conditional, min_count, engine, is_sparse):
+            counts[frozenset(anchor).union(int(other_cols[i]) for i in itemset)] = count
+    log.info("Itemsets restringidos: %d", len(counts))
+
+    flat, lengths = _flatten_itemsets(counts.keys())
+    supports = np.fromiter(counts.values(), dtype=float, count=len(counts)) / n_rows
+    return single_consequent_rules(flat, lengths, supports, encoded, columns, min_lift=1, lhs_required=query_cols)
+
+
+def mine_rules(
+    encoded_df: pd.DataFrame,
+    encoded: sparse.csr_matrix,
+    min_support: float,
+    engine: str = "auto",
+    is_sparse: bool = False,
+    client_logger=None,
+) -> MinedRules:
+    """
+    Mina itemsets frecuentes con el motor indicado y genera reglas de un
+    consecuente con lift >= 1 (ver single_consequent_rules).
+
+    `encoded_df` es el DataFrame booleano (denso o sparse) que consumen los motores
+    de mlxtend y `encoded` la misma matriz en CSR. Con fpmax solo se parte de los
+    itemsets maximales.
+    """
+    log = client_logger or logger
+    engine = select_engine(encoded, min_support, engine)
+    log.info("Aplicando reglas de asociacion con %s (%s)", engine, encoded_df.shape)
+
+    if engine == "fpmax":
+        frequent_itemsets = fpmax(encoded_df, min_support=min_support)
+    elif engine == "apriori":
+        # low_memory evita que apriori expanda a denso las columnas candidatas del CSR
+        frequent_itemsets = apriori(encoded_df, min_support=min_support, low_memory=is_sparse)
+    else:
+        frequent_itemsets = fpgrowth(encoded_df, min_support=min_support)
+
+    log.info("Generando reglas (%s)", frequent_itemsets.shape)
+    flat, lengths = _flatten_itemsets(frequent_itemsets["itemsets"])
+    return single_consequent_rules(
+        flat, lengths, frequent_itemsets["support"].to_numpy(), encoded, list(encoded_df.columns), min_lift=1
+    )
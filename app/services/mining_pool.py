@@ -0,0 +1,181 @@
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterator
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Peso de la última medición en los promedios móviles de espera y servicio
+_EWMA_ALPHA = 0.2
+# Límites del Retry-After sugerido (segundos)
+_RETRY_AFTER_MIN = 1
+_RETRY_AFTER_MAX = 60
+
+# Minado en el hilo de la solicitud para este contexto (ver MiningPool.inline)
+_inline: ContextVar[bool] = ContextVar("mining_inline", default=False)
+
+
+class MiningPoolBusy(Exception):
+    """La cola del pool de minado está llena; reintentar después de `retry_after` segundos."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Pool de minado saturado, reintentar en {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _init_worker() -> None:
+    """Logging de los procesos de minado con el mismo formato que el worker de la API."""
+    from app.logger import ClientFormatter
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(ClientFormatter())
+    logging.basicConfig(level=logging.INFO, handlers=[handler], force=True)
+
+
+def _timed_call(fn: Callable, args: tuple, kwargs: dict) -> tuple[float, Any]:
+    """Ejecuta `fn` en el proceso del pool devolviendo también cuándo empezó."""
+    return time.time(), fn(*args, **kwargs)
+
+
+class MiningPool:
+    """
+    Pool acotado de procesos para el minado, con control de admisión.
+
+    El minado es CPU puro: en el threadpool de FastAPI las solicitudes
+    concurrentes de un worker compiten por el GIL. Aquí corre en
+    `mining_processes` procesos (spawn) y a lo sumo `mining_queue_depth`
+    trabajos esperan en cola; si la cola está llena `run` falla de inmediato con
+    MiningPoolBusy en vez de acumular solicitudes hasta el timeout.
+
+    Con `mining_processes=0` el minado corre en el hilo de la solicitud, igual
+    que dentro de `inline()` (ej. al perfilar una solicitud).
+    """
+
+    def __init__(self):
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_avg = 0.0
+        self._wait_last = 0.0
+        self._wait_max = 0.0
+        self._service_avg = 0.0
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """Ejecuta `fn(*args, **kwargs)` en el pool y espera el resultado."""
+        settings = get_settings()
+        processes = settings.mining_processes
+        if processes <= 0 or _inline.get():
+            return fn(*args, **kwargs)
+
+        with self._lock:
+            self._reserve(processes)
+            executor = self._get_executor(processes)
+
+        submitted = time.time()
+        try:
+            started, result = executor.submit(_timed_call, fn, args, kwargs).result()
+        except BrokenProcessPool:
+            # Un proceso murió (ej. OOM): el próximo trabajo crea un pool nuevo
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+        finished = time.time()
+        self._record(max(started - submitted, 0.0), finished - started)
+        if started - submitted > 0.1:
+            logger.info("Minado esperó %.2fs en cola del pool", started - submitted)
+        return result
+
+    @contextmanager
+    def inline(self) -> Iterator[None]:
+        """
+        Dentro del bloque, `run` ejecuta en el hilo actual sin pasar por el pool.
+
+        El bloque ocupa un lugar del pool mientras dura, igual que un trabajo
+        encolado: el minado en el hilo compite por la misma CPU. Si el pool está
+        lleno lanza MiningPoolBusy antes de entrar.
+        """
+        processes = get_settings().mining_processes
+        if processes > 0:
+            with self._lock:
+                self._reserve(processes)
+        token = _inline.set(True)
+        try:
+            yield
+        finally:
+            _inline.reset(token)
+            if processes > 0:
+                with self._lock:
+                    self._pending -= 1
+
+    def stats(self) -> dict:
+        """Estado de la cola: trabajos en curso/en espera, rechazos y tiempos de espera."""
+        settings = get_settings()
+        with self._lock:
+            return {
+                "processes": settings.mining_processes,
+                "queue_limit": settings.mining_queue_depth,
+                "in_flight": min(self._pending, settings.mining_processes),
+                "queued": max(self._pending - settings.mining_processes, 0),
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "wait_seconds_avg": round(self._wait_avg, 3),
+                "wait_seconds_last": round(self._wait_last, 3),
+                "wait_seconds_max": round(self._wait_max, 3),
+                "service_seconds_avg": round(self._service_avg, 3),
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_executor(self, processes: int) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return self._executor
+
+    def _reserve(self, processes: int) -> None:
+        """Ocupa un lugar en el pool o lanza MiningPoolBusy si está lleno (con `_lock` tomado)."""
+        if self._pending >= processes + get_settings().mining_queue_depth:
+            self._rejected += 1
+            raise MiningPoolBusy(self._retry_after(processes))
+        self._pending += 1
+
+    def _record(self, wait: float, service: float) -> None:
+        with self._lock:
+            first = self._completed == 0
+            self._completed += 1
+            self._wait_last = wait
+            self._wait_max = max(self._wait_max, wait)
+            self._wait_avg = wait if first else (1 - _EWMA_ALPHA) * self._wait_avg + _EWMA_ALPHA * wait
+            self._service_avg = (
+                service if first else (1 - _EWMA_ALPHA) * self._service_avg + _EWMA_ALPHA * service
+            )
+
+    def _retry_after(self, processes: int) -> int:
+        """Segundos estimados hasta que se libere la cola actual."""
+        estimate = self._service_avg * self._pending / processes
+        return min(max(math.ceil(estimate), _RETRY_AFTER_MIN), _RETRY_AFTER_MAX)
+
+
+mining_pool = MiningPool()
@@ -0,0 +1,165 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+# Un producto en más de 1/32 de las órdenes ocupa menos como bitmap (1 bit por
+# orden) que como lista de int32: esos se guardan también como bitmap
+_DENSE_FRACTION = 1 / 32
+
+# Arrays del índice, en el orden de los campos (ver snapshot_files.save_snapshot)
+ARRAYS = ("product_indptr", "product_orders", "dense_slot", "bitmaps", "order_indptr", "line_positions")
+
+
+@dataclass
+class OrderIndex:
+    """
+    Índice de pertenencia producto -> órdenes sobre los códigos de un snapshot.
+
+    `product_orders[product_indptr[p]:product_indptr[p + 1]]` son los códigos de
+    orden (ascendentes, sin repetir) que contienen el producto p. Los productos
+    populares tienen además un bitmap empaquetado (`bitmaps[dense_slot[p]]`),
+    así que verificar si una orden los contiene es leer un bit. Las uniones por
+    grupo y las intersecciones entre grupos se hacen sobre estas estructuras, sin
+    sets ni DataFrames. `line_positions[order_indptr[o]:order_indptr[o + 1]]` son
+    las líneas del snapshot de la orden o: las filas de las órdenes elegidas
+    salen de los offsets sin recorrer la tabla.
+
+    Con `snapshot_dir` los arrays se guardan junto al snapshot y los workers los
+    mapean desde disco (solo lectura), igual que los códigos.
+    """
+
+    n_orders: int
+    product_indptr: np.ndarray
+    product_orders: np.ndarray
+    dense_slot: np.ndarray
+    bitmaps: np.ndarray
+    order_indptr: np.ndarray
+    line_positions: np.ndarray
+
+    @classmethod
+    def build(cls, order_codes: np.ndarray, product_codes: np.ndarray, n_orders: int, n_products: int) -> "OrderIndex":
+        keys = product_codes.astype(np.int64) * max(n_orders, 1) + order_codes
+        keys.sort()
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))] if len(keys) else keys
+        products, orders = np.divmod(keys, max(n_orders, 1))
+        product_indptr = _indptr(products, n_products)
+        product_orders = orders.astype(np.int32)
+
+        sizes = np.diff(product_indptr)
+        dense = np.flatnonzero(sizes > n_orders * _DENSE_FRACTION)
+        dense_slot = np.full(n_products, -1, dtype=np.int32)
+        dense_slot[dense] = np.arange(len(dense), dtype=np.int32)
+        bitmaps = np.zeros((len(dense), (n_orders + 7) // 8), dtype=np.uint8)
+        for slot, product in enumerate(dense):
+            member = np.zeros(n_orders, dtype=bool)
+            member[product_orders[product_indptr[product]:product_indptr[product + 1]]] = True
+            bitmaps[slot] = np.packbits(member, bitorder="little")
+
+        return cls(
+            n_orders=n_orders,
+            product_indptr=product_indptr,
+            product_orders=product_orders,
+            dense_slot=dense_slot,
+            bitmaps=bitmaps,
+            order_indptr=_indptr(order_codes, n_orders),
+            line_positions=np.argsort(order_codes, kind="stable").astype(np.int32),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+    @property
+    def shared_nbytes(self) -> int:
+        """Bytes de arrays mapeados desde disco (page cache compartido entre workers)."""
+        return sum(getattr(self, name).nbytes for name in ARRAYS if isinstance(getattr(self, name), np.memmap))
+
+    def orders_with(self, product: int) -> np.ndarray:
+        """Códigos de orden (ascendentes) que contienen el producto."""
+        return self.product_orders[self.product_indptr[product]:self.product_indptr[product + 1]]
+
+    def group_size(self, products: np.ndarray) -> int:
+        """Cota superior de las órdenes de un grupo (suma de sus listas)."""
+        products = np.asarray(products)
+        return int((self.product_indptr[products + 1] - self.product_indptr[products]).sum())
+
+    def orders_with_any(self, products: np.ndarray) -> np.ndarray:
+        """Códigos de orden (ascendentes) con al menos uno de los productos."""
+        if len(products) == 1:
+            return self.orders_with(products[0])
+        if self.group_size(products) <= self.n_orders * _DENSE_FRACTION:
+            return np.unique(np.concatenate([self.orders_with(product) for product in products]))
+        member = np.zeros(self.n_orders, dtype=bool)
+        for product in products:
+            member[self.orders_with(product)] = True
+        return np.flatnonzero(member).astype(np.int32)
+
+    def contains_any(self, orders: np.ndarray, products: np.ndarray) -> np.ndarray:
+        """Máscara de las `orders` que contienen alguno de los productos."""
+        hit = np.zeros(len(orders), dtype=bool)
+        byte, bit = orders >> 3, (orders & 7).astype(np.uint8)
+        for product in products:
+            slot = self.dense_slot[product]
+            if slot >= 0:
+                hit |= ((self.bitmaps[slot][byte] >> bit) & 1).astype(bool)
+                continue
+            posting = self.orders_with(product)
+            if len(posting) == 0:
+                continue
+            found = np.searchsorted(posting, orders)
+            hit |= posting[np.minimum(found, len(posting) - 1)] == orders
+        return hit
+
+    def group_bitmap(self, products: np.ndarray) -> np.ndarray:
+        """Bitmap empaquetado de las órdenes con alguno de los productos."""
+        packed = np.zeros((self.n_orders + 7) // 8, dtype=np.uint8)
+        sparse_products = []
+        for product in products:
+            slot = self.dense_slot[product]
+            if slot >= 0:
+                packed |= self.bitmaps[slot]
+            else:
+                sparse_products.append(product)
+        if sparse_products:
+            member = np.zeros(self.n_orders, dtype=bool)
+            for product in sparse_products:
+                member[self.orders_with(product)] = True
+            packed |= np.packbits(member, bitorder="little")
+        return packed
+
+    def orders_with_all(self, groups: list[np.ndarray]) -> np.ndarray:
+        """
+        Códigos de orden con al menos un producto de cada grupo.
+
+        Si hasta el grupo más chico es popular, se hace AND de los bitmaps de cada
+        grupo (n_orders / 8 bytes por grupo). Si no, se parte de las órdenes del
+        grupo más chico y se descartan candidatas grupo por grupo, así que el
+        costo depende de ese grupo, no de la tabla.
+        """
+        groups = sorted(groups, key=self.group_size)
+        if len(groups) > 1 and self.group_size(groups[0]) > self.n_orders * _DENSE_FRACTION:
+            packed = self.group_bitmap(groups[0])
+            for products in groups[1:]:
+                packed &= self.group_bitmap(products)
+            member = np.unpackbits(packed, count=self.n_orders, bitorder="little")
+            return np.flatnonzero(member).astype(np.int32)
+
+        candidates = self.orders_with_any(groups[0])
+        for products in groups[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = candidates[self.contains_any(candidates, products)]
+        return candidates
+
+    def lines_of(self, orders: np.ndarray) -> np.ndarray:
+        """Posiciones de las líneas del snapshot de esas órdenes, agrupadas por orden."""
+        starts = self.order_indptr[orders]
+        lengths = self.order_indptr[orders + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return self.line_positions[offsets + np.arange(int(lengths.sum()))]
+
+
+def _indptr(codes: np.ndarray, size: int) -> np.ndarray:
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=size), out=indptr[1:])
+    return indptr
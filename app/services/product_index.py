@@ -0,0 +1,70 @@
+import unicodedata
+from collections import defaultdict
+from typing import Iterable
+
+import numpy as np
+
+# Máximo de términos distintos memorizados por índice
+_SEARCH_CACHE_SIZE = 1024
+
+
+def fold(text: str) -> str:
+    """Normaliza para búsqueda: minúsculas y sin acentos ("Papás" -> "papas")."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def _trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ProductIndex:
+    """
+    Índice invertido de trigramas sobre los nombres de producto distintos de un cliente.
+
+    Un término de 3+ caracteres solo puede aparecer en los nombres que contienen
+    todos sus trigramas, así que la búsqueda intersecta esas listas y verifica el
+    substring únicamente en los candidatos. Términos más cortos recorren los
+    nombres plegados (unos miles), nunca las filas de transacciones.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        self.names = np.asarray(list(names), dtype=object)
+        self._folded = [fold(str(name)) for name in self.names]
+
+        postings: dict[str, set[int]] = defaultdict(set)
+        for code, folded in enumerate(self._folded):
+            for gram in _trigrams(folded):
+                postings[gram].add(code)
+        self._postings = {gram: frozenset(codes) for gram, codes in postings.items()}
+        self._cache: dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def search(self, term: str) -> np.ndarray:
+        """Códigos (posiciones en `names`, ascendentes) de los productos que contienen `term`."""
+        folded = fold(term)
+        codes = self._cache.get(folded)
+        if codes is not None:
+            return codes
+
+        if len(folded) < 3:
+            candidates = range(len(self._folded))
+        else:
+            postings = sorted(
+                (self._postings.get(gram, frozenset()) for gram in _trigrams(folded)), key=len
+            )
+            candidates = postings[0].intersection(*postings[1:])
+
+        codes = np.array(
+            sorted(code for code in candidates if folded in self._folded[code]), dtype=np.int32
+        )
+        if len(self._cache) >= _SEARCH_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[folded] = codes
+        return codes
+
+    def match(self, term: str) -> list[str]:
+        """Nombres de producto que contienen `term` (parcial, sin mayúsculas ni acentos)."""
+        return self.names[self.search(term)].tolist()
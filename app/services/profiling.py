@@ -0,0 +1,177 @@
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from app.config import get_settings
+from app.services.json_files import JsonFileStore
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-MBA-Profile"
+
+_PACKAGE_ROOT = str(Path(__file__).resolve().parents[2]) + os.sep
+# Funciones por lista en el resumen
+_SUMMARY_TOP = 25
+
+
+def profile_requested(header_value: str | None) -> bool:
+    """True si la solicitud pide perfil con el header (distinto de 0/false)."""
+    return header_value is not None and header_value.strip().lower() not in ("", "0", "false", "no")
+
+
+def profile_sampled() -> bool:
+    """True si la solicitud cae en la muestra de `profile_sample_rate`."""
+    rate = get_settings().profile_sample_rate
+    return rate > 0 and random.random() < rate
+
+
+class SamplingProfiler:
+    """
+    Profiler por muestreo del hilo que entra al bloque `with`. Las pilas parten
+    de la función que entra al bloque (sin los frames del servidor).
+
+    Un hilo aparte lee cada `interval` segundos el stack del hilo perfilado con
+    sys._current_frames y cuenta cuántas veces aparece cada pila, sin
+    instrumentar las llamadas: el costo no depende de cuántas funciones se
+    llamen. El código en C (numpy, pandas) no tiene frames propios; su tiempo
+    se atribuye a la función Python que lo llamó. El muestreo necesita el GIL,
+    así que las llamadas largas en C que lo retienen se ven como una sola
+    muestra tardía: `samples * interval` puede quedar por debajo de `duration`.
+    """
+
+    def __init__(self, interval: float | None = None):
+        self.interval = interval if interval is not None else get_settings().profile_interval
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._thread_id: int | None = None
+        self._stop = threading.Event()
+        self._sampler: threading.Thread | None = None
+        self._started = 0.0
+        self._base_depth = 0
+
+    def __enter__(self) -> "SamplingProfiler":
+        self._thread_id = threading.get_ident()
+        frame, self._base_depth = sys._getframe(1), 0
+        while frame is not None:
+            frame, self._base_depth = frame.f_back, self._base_depth + 1
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name="mba-profiler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self._started
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{_location(code.co_filename)}:{code.co_name}:{code.co_firstlineno}")
+                frame = frame.f_back
+            stack = stack[::-1][self._base_depth - 1:]
+            if stack:
+                self.stacks[tuple(stack)] += 1
+                self.samples += 1
+
+    def collapsed(self) -> list[str]:
+        """Pilas en formato "raíz;...;hoja muestras" (flamegraph.pl, speedscope), de más a menos muestras."""
+        return [f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()]
+
+    def summary(self, top: int = _SUMMARY_TOP) -> dict:
+        """Funciones con más muestras propias (hoja de la pila) e inclusivas (en cualquier nivel)."""
+        own: Counter[str] = Counter()
+        inclusive: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack):
+                inclusive[function] += count
+
+        def ranked(counter: Counter) -> list[dict]:
+            return [
+                {"function": function, "samples": count, "fraction": round(count / max(self.samples, 1), 4)}
+                for function, count in counter.most_common(top)
+            ]
+
+        return {
+            "duration_seconds": round(self.duration, 4),
+            "interval_seconds": self.interval,
+            "samples": self.samples,
+            "self": ranked(own),
+            "inclusive": ranked(inclusive),
+        }
+
+
+class ProfileStore(JsonFileStore):
+    """
+    Perfiles guardados como JSON en `profiles_dir`, compartido por los workers
+    (cualquiera responde la consulta); se borran `profile_ttl` segundos después
+    de creados.
+    """
+
+    def save(
+        self, customer: str, request: dict, profiler: SamplingProfiler, error: str | None = None, inline: bool = False
+    ) -> dict:
+        """`inline`: el minado corrió en el hilo perfilado (si no, en el pool y solo se ve la espera)."""
+        self.cleanup()
+        profile = {
+            "profile_id": uuid.uuid4().hex,
+            "customer": customer,
+            "request": request,
+            "inline": inline,
+            "created_at": time.time(),
+            "error": error,
+            "summary": profiler.summary(),
+            "collapsed": profiler.collapsed(),
+        }
+        self._write(profile["profile_id"], profile)
+        return profile
+
+    def get(self, profile_id: str) -> dict | None:
+        """Perfil completo, o None si no existe o expiró."""
+        return self._read(profile_id)
+
+    def recent(self, customer: str) -> list[dict]:
+        """Perfiles vigentes del cliente sin las pilas, del más reciente al más antiguo."""
+        profiles = []
+        for profile in self._records():
+            if profile.get("customer") != customer:
+                continue
+            profile.pop("collapsed", None)
+            profile["summary"] = {
+                key: value for key, value in profile["summary"].items() if key not in ("self", "inclusive")
+            }
+            profiles.append(profile)
+        return sorted(profiles, key=lambda profile: profile["created_at"], reverse=True)
+
+    def _directory(self) -> str:
+        return get_settings().profiles_dir
+
+    def _ttl(self) -> float:
+        return get_settings().profile_ttl
+
+    def _timestamp(self, profile: dict) -> float:
+        return profile.get("created_at", 0)
+
+
+def _location(filename: str) -> str:
+    """Ruta corta del archivo: relativa al paquete instalado o al repo."""
+    marker = f"site-packages{os.sep}"
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    if filename.startswith(_PACKAGE_ROOT):
+        return filename[len(_PACKAGE_ROOT):]
+    return filename
+
+
+profile_store = ProfileStore()
@@ -0,0 +1,286 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Protocol
+
+from app.config import get_settings
+from app.services.snapshot import snapshot_store
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_BACKENDS = ("memory", "sqlite", "redis")
+_KEY_PREFIX = "mba:result:"
+
+
+class CacheBackend(Protocol):
+    def get(self, key: str) -> bytes | None: ...
+
+    def set(self, key: str, client_name: str, version: str, value: bytes) -> None: ...
+
+    def invalidate(self, client_name: str, keep_version: str) -> None: ...
+
+    def size(self) -> dict: ...
+
+
+class MemoryBackend:
+    """LRU en memoria del worker, acotado por cantidad de entradas y bytes."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[str, str, bytes]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key: str, client_name: str, version: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[2])
+            self._entries[key] = (client_name, version, value)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, client_name: str, keep_version: str) -> None:
+        with self._lock:
+            stale = [
+                key for key, (client, version, _) in self._entries.items()
+                if client == client_name and version != keep_version
+            ]
+            for key in stale:
+                self._bytes -= len(self._entries.pop(key)[2])
+
+    def size(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "evictions": self.evictions}
+
+
+class SqliteBackend:
+    """
+    LRU en un archivo SQLite compartido por todos los workers del contenedor.
+
+    El acceso se registra en `last_used`; al superar los límites se borran las
+    entradas usadas hace más tiempo.
+    """
+
+    def __init__(self, path: str, max_entries: int, max_bytes: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, client TEXT, version TEXT, value BLOB, size INTEGER, last_used REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> bytes | None:
+        connection = self._connection()
+        row = connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def set(self, key: str, client_name: str, version: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (key, client_name, version, value, len(value), time.time()),
+            )
+            entries, total = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            for stale_key, size in connection.execute("SELECT key, size FROM results ORDER BY last_used").fetchall():
+                if entries <= self.max_entries and total <= self.max_bytes:
+                    break
+                connection.execute("DELETE FROM results WHERE key = ?", (stale_key,))
+                entries, total = entries - 1, total - size
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def invalidate(self, client_name: str, keep_version: str) -> None:
+        self._connection().execute(
+            "DELETE FROM results WHERE client = ? AND version != ?", (client_name, keep_version)
+        )
+
+    def size(self) -> dict:
+        entries, total = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        return {"entries": entries, "bytes": total}
+
+
+class RedisBackend:
+    """
+    Caché en Redis (o compatible) compartido entre workers y réplicas.
+
+    La evicción LRU la hace el servidor (`maxmemory-policy allkeys-lru`); las
+    entradas de versiones anteriores expiran por `result_cache_ttl`.
+    """
+
+    def __init__(self, url: str, ttl: float):
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError("RESULT_CACHE_BACKEND=redis requiere el paquete redis (pip install .[cache])") from exc
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = int(ttl)
+
+    def get(self, key: str) -> bytes | None:
+        return self._redis.get(key)
+
+    def set(self, key: str, client_name: str, version: str, value: bytes) -> None:
+        self._redis.set(key, value, ex=self.ttl or None)
+
+    def invalidate(self, client_name: str, keep_version: str) -> None:
+        # La versión es parte de la clave: las entradas viejas ya no se leen y expiran solas
+        pass
+
+    def size(self) -> dict:
+        return {"entries": self._redis.dbsize()}
+
+
+class ResultCache:
+    """
+    Caché de resultados de run_mba_pipeline por versión de datos.
+
+    La clave incluye la versión del snapshot, así que un cambio de datos nunca
+    sirve resultados viejos; además, al publicarse una versión nueva se borran
+    las entradas de las anteriores. Solo se cachean solicitudes con versión
+    (servidas desde snapshot). Los errores del backend no afectan la solicitud:
+    se registran y se calcula sin caché.
+    """
+
+    def __init__(self):
+        self._backend: CacheBackend | None = None
+        self._backend_ready = False
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _get_backend(self) -> CacheBackend | None:
+        if not self._backend_ready:
+            with self._lock:
+                if not self._backend_ready:
+                    self._backend = _create_backend()
+                    self._backend_ready = True
+        return self._backend
+
+    def get_or_compute(self, key: tuple, client_name: str, version: str | None, compute: Callable[[], list | None]):
+        hit, result = self.lookup(key, version)
+        if hit:
+            return result
+        result = compute()
+        self.store(key, client_name, version, result)
+        return result
+
+    def lookup(self, key: tuple, version: str | None) -> tuple[bool, list | None]:
+        """(True, resultado) si la clave está en caché; (False, None) si no o si no es cacheable."""
+        backend = self._get_backend()
+        if backend is None or version is None:
+            return False, None
+        try:
+            cached = backend.get(_KEY_PREFIX + json.dumps(key, default=str))
+        except Exception:
+            logger.warning("Error leyendo caché de resultados", exc_info=True)
+            cached = None
+        self._count(hit=cached is not None)
+        if cached is None:
+            return False, None
+        return True, json.loads(cached)
+
+    def store(self, key: tuple, client_name: str, version: str | None, result: list | None) -> None:
+        backend = self._get_backend()
+        if backend is None or version is None:
+            return
+        try:
+            backend.set(
+                _KEY_PREFIX + json.dumps(key, default=str), client_name, version, json.dumps(result).encode("utf-8")
+            )
+        except Exception:
+            logger.warning("Error guardando en caché de resultados", exc_info=True)
+
+    def on_snapshot(self, config, snapshot) -> None:
+        backend = self._get_backend()
+        if backend is None:
+            return
+        try:
+            backend.invalidate(config.name, snapshot.version)
+        except Exception:
+            logger.warning("Error invalidando caché de resultados de %s", config.name, exc_info=True)
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def stats(self) -> dict:
+        backend = self._get_backend()
+        with self._lock:
+            hits, misses = self._hits, self._misses
+        stats = {
+            "backend": get_settings().result_cache_backend or None,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+        if backend is not None:
+            try:
+                stats.update(backend.size())
+            except Exception:
+                logger.warning("Error consultando tamaño de caché de resultados", exc_info=True)
+        return stats
+
+
+def _create_backend() -> CacheBackend | None:
+    settings = get_settings()
+    backend = settings.result_cache_backend
+    if not backend:
+        return None
+    if backend == "memory":
+        return MemoryBackend(settings.result_cache_max_entries, settings.result_cache_max_bytes)
+    if backend == "sqlite":
+        path = settings.result_cache_url or str(Path(settings.snapshot_dir or ".") / "results.sqlite3")
+        return SqliteBackend(path, settings.result_cache_max_entries, settings.result_cache_max_bytes)
+    if backend == "redis":
+        return RedisBackend(settings.result_cache_url or "redis://localhost:6379/0", settings.result_cache_ttl)
+    raise ValueError(f"RESULT_CACHE_BACKEND desconocido: {backend}. Opciones: {', '.join(RESULT_CACHE_BACKENDS)}")
+
+
+result_cache = ResultCache()
+snapshot_store.subscribe(result_cache.on_snapshot)
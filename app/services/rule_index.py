@@ -0,0 +1,299 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from itertools import chain, combinations
+from typing import TYPE_CHECKING
+
+import numpy as np
+from scipy import sparse
+
+from app.config import get_settings
+from app.logger import get_client_logger
+from app.services.market_basket import process_data, use_sparse_encoding
+from app.services.mining import MinedRules, itemset_counts, min_support_count, single_consequent_rules
+from app.services.mining_pool import MiningPoolBusy, mining_pool
+from app.services.snapshot import TransactionSnapshot, snapshot_store
+from app.services.snapshot_files import load_rule_index, refresh_lock, save_rule_index
+
+if TYPE_CHECKING:
+    from app.clients.base import ClientConfig
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RuleIndex:
+    """
+    Itemsets frecuentes (con su conteo de órdenes) minados sobre todas las
+    órdenes de un cliente, para responder búsquedas sin minar.
+
+    Una búsqueda cuyos términos resuelven a un producto cada uno mina la base
+    condicional D = órdenes con todos los productos buscados P. Un itemset S es
+    frecuente en D si T = S ∪ P tiene al menos `min_support * |D|` órdenes, y
+    su soporte en D es conteo(T) / |D|: los itemsets del índice que contienen P
+    dan exactamente los itemsets que minaría compute_rules sobre D (si ese
+    umbral no baja del umbral del índice), y de ellos salen las mismas reglas,
+    incluidas las que tienen un producto buscado como consecuente.
+
+    `itemset_items[itemset_indptr[i]:itemset_indptr[i + 1]]` son los productos
+    (posiciones en `columns`, alfabético) del itemset i y `by_item` mapea cada
+    producto a las posiciones de los itemsets que lo contienen.
+
+    El minado corre en el pool de minado, no en el worker que atiende
+    solicitudes; si el pool está lleno espera su turno en vez de fallar.
+    """
+
+    client_name: str
+    version: str
+    min_support: float
+    n_orders: int
+    columns: np.ndarray
+    itemset_indptr: np.ndarray
+    itemset_items: np.ndarray
+    counts: np.ndarray
+    by_item: dict[str, np.ndarray]
+    built_at: float
+
+    @classmethod
+    def build(
+        cls, snapshot: TransactionSnapshot, min_support: float, engine: str = "auto", client_logger=None
+    ) -> "RuleIndex":
+        baskets = process_data(snapshot.to_frame(), client_logger)
+        n_orders = len(baskets)
+        # fpmax solo da itemsets maximales: el índice necesita todos los frecuentes
+        engine = "auto" if engine == "fpmax" else engine
+        while True:
+            try:
+                counted = mining_pool.run(
+                    itemset_counts, baskets.encoded, min_support_count(min_support, n_orders), engine,
+                    use_sparse_encoding(baskets.encoded),
+                )
+                break
+            except MiningPoolBusy as exc:
+                time.sleep(exc.retry_after)
+        itemsets = [itemset for itemset, _ in counted]
+        counts = np.array([count for _, count in counted], dtype=np.int64)
+        return cls.from_itemsets(snapshot, min_support, n_orders, baskets.columns, itemsets, counts)
+
+    @classmethod
+    def from_itemsets(
+        cls,
+        snapshot: TransactionSnapshot,
+        min_support: float,
+        n_orders: int,
+        columns: np.ndarray,
+        itemsets: list,
+        counts: np.ndarray,
+    ) -> "RuleIndex":
+        """Índice sobre itemsets ya minados (posiciones de `columns`) y sus conteos."""
+        lengths = np.fromiter(map(len, itemsets), dtype=np.int64, count=len(itemsets))
+        itemset_indptr = np.zeros(len(itemsets) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=itemset_indptr[1:])
+        itemset_items = np.fromiter(
+            (item for itemset in itemsets for item in itemset), dtype=np.int64, count=int(lengths.sum())
+        )
+        owner = np.repeat(np.arange(len(itemsets)), lengths)
+        order = np.argsort(itemset_items, kind="stable")
+        bounds = np.searchsorted(itemset_items[order], np.arange(len(columns) + 1))
+        columns = np.asarray(columns, dtype=object)
+        by_item = {
+            str(columns[item]): owner[order[bounds[item]:bounds[item + 1]]]
+            for item in range(len(columns))
+            if bounds[item + 1] > bounds[item]
+        }
+        return cls(
+            client_name=snapshot.client_name,
+            version=snapshot.version,
+            min_support=min_support,
+            n_orders=n_orders,
+            columns=columns,
+            itemset_indptr=itemset_indptr,
+            itemset_items=itemset_items,
+            counts=np.asarray(counts, dtype=np.int64),
+            by_item=by_item,
+            built_at=time.time(),
+        )
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def itemsets(self) -> list[list[int]]:
+        """Productos (posiciones en `columns`) de cada itemset."""
+        return [
+            self.itemset_items[start:end].tolist()
+            for start, end in zip(self.itemset_indptr[:-1], self.itemset_indptr[1:])
+        ]
+
+    def conditional_rules(
+        self,
+        encoded: sparse.csr_matrix,
+        columns: list[str],
+        product_groups: list[list[str]],
+        min_support: float,
+        constrained: bool = False,
+    ) -> MinedRules | None:
+        """
+        Las reglas que minaría mine_encoded sobre `encoded` (baskets de las
+        órdenes con un producto de cada grupo, columnas en orden alfabético),
+        armadas con los itemsets del índice sin minar.
+
+        None si el índice no cubre la búsqueda: algún término con más de un
+        producto (la base condicional no sale de conteos de itemsets), un
+        producto fuera del índice, o un umbral `min_support * |D|` menor que el
+        del índice.
+        """
+        if any(len(group) != 1 for group in product_groups):
+            return None
+        searched = sorted({group[0] for group in product_groups})
+        if any(product not in self.by_item for product in searched):
+            return None
+        n_rows = encoded.shape[0]
+        min_count = min_support_count(min_support, n_rows)
+        if n_rows == 0 or min_count < min_support_count(self.min_support, self.n_orders):
+            return None
+
+        positions = self.by_item[searched[0]]
+        for product in searched[1:]:
+            positions = np.intersect1d(positions, self.by_item[product], assume_unique=True)
+        positions = positions[self.counts[positions] >= min_count]
+        lengths = self.itemset_indptr[positions + 1] - self.itemset_indptr[positions]
+        # El itemset P cuenta las órdenes de D: si no coincide, `encoded` no es esa base condicional
+        exact = positions[lengths == len(searched)]
+        if len(exact) != 1 or self.counts[exact[0]] != n_rows:
+            return None
+
+        column_index = {name: i for i, name in enumerate(columns)}
+        searched_codes = [column_index[product] for product in searched]
+        searched_set = set(searched)
+        itemsets, supports = [], []
+        for position in positions:
+            items = self.itemset_items[self.itemset_indptr[position]:self.itemset_indptr[position + 1]]
+            rest = [column_index[name] for name in self.columns[items].tolist() if name not in searched_set]
+            support = self.counts[position] / n_rows
+            # Cada subconjunto de P agregado al resto tiene el mismo conteo en D
+            for anchor in chain.from_iterable(
+                combinations(searched_codes, size) for size in range(len(searched_codes) + 1)
+            ):
+                if rest or anchor:
+                    itemsets.append(rest + list(anchor))
+                    supports.append(support)
+
+        flat = np.fromiter(chain.from_iterable(itemsets), dtype=np.int64)
+        lengths = np.fromiter(map(len, itemsets), dtype=np.int64, count=len(itemsets))
+        rules = single_consequent_rules(flat, lengths, np.array(supports), encoded, columns, min_lift=1)
+        if constrained:
+            # Igual que mine_constrained_rules: itemset con un producto de cada grupo y alguno en el LHS
+            keep = rules.lhs_touches(searched_codes)
+            for code in searched_codes:
+                keep &= rules.rule_touches([code])
+            rules = rules.take(np.flatnonzero(keep))
+        return rules
+
+
+class RuleIndexStore:
+    """
+    Índices de reglas por cliente, reconstruidos en segundo plano tras cada
+    actualización del snapshot (solo clientes con `rule_index_min_support`).
+
+    Un índice solo se sirve si su versión coincide con la del snapshot vigente.
+    Los snapshots cargados desde disco no pasan por on_snapshot: el primer
+    request sin índice dispara la construcción con `ensure`.
+
+    Con `snapshot_dir` los itemsets se guardan junto al snapshot de la versión:
+    el primer worker los mina bajo un lock por cliente y los demás esperan y
+    los leen del disco en vez de minarlos otra vez.
+    """
+
+    def __init__(self):
+        self._indexes: dict[str, RuleIndex] = {}
+        self._building: set[tuple[str, str]] = set()
+        self._lock = threading.Lock()
+
+    def get(self, client_name: str, version: str) -> RuleIndex | None:
+        index = self._indexes.get(client_name)
+        if index is None or index.version != version:
+            return None
+        return index
+
+    def on_snapshot(self, config: "ClientConfig", snapshot: TransactionSnapshot) -> None:
+        self.ensure(config, snapshot)
+
+    def ensure(self, config: "ClientConfig", snapshot: TransactionSnapshot) -> None:
+        """Construye en segundo plano el índice de esta versión si falta y no se está construyendo."""
+        if config.rule_index_min_support is None or self.get(config.name, snapshot.version) is not None:
+            return
+        key = (config.name, snapshot.version)
+        with self._lock:
+            if key in self._building:
+                return
+            self._building.add(key)
+        thread = threading.Thread(
+            target=self._build,
+            args=(config, snapshot),
+            name=f"rule-index-{config.name}",
+            daemon=True,
+        )
+        thread.start()
+
+    def _build(self, config: "ClientConfig", snapshot: TransactionSnapshot) -> None:
+        try:
+            self._build_index(config, snapshot)
+        finally:
+            with self._lock:
+                self._building.discard((config.name, snapshot.version))
+
+    def _build_index(self, config: "ClientConfig", snapshot: TransactionSnapshot) -> None:
+        client_logger = get_client_logger(config.name)
+        started = time.perf_counter()
+        client_logger.info(
+            "Construyendo índice de reglas (versión %s, min_support=%.4f)",
+            snapshot.version, config.rule_index_min_support,
+        )
+        try:
+            directory = get_settings().snapshot_dir
+            if directory:
+                with refresh_lock(directory, config.name, ".rule_index.lock"):
+                    index = self._load_or_build(config, snapshot, directory, client_logger)
+            else:
+                index = RuleIndex.build(
+                    snapshot, config.rule_index_min_support, config.mining_engine, client_logger
+                )
+        except Exception:
+            client_logger.exception("Error construyendo índice de reglas")
+            return
+
+        current = snapshot_store.current(config.name)
+        if current is not None and current.version != index.version:
+            client_logger.info("Índice de reglas descartado: llegó la versión %s", current.version)
+            return
+        self._indexes[config.name] = index
+        client_logger.info(
+            "Índice de reglas listo: %d itemsets frecuentes, %d productos (%.1fs)",
+            len(index), len(index.by_item), time.perf_counter() - started,
+        )
+
+    @staticmethod
+    def _load_or_build(
+        config: "ClientConfig", snapshot: TransactionSnapshot, directory: str, client_logger
+    ) -> RuleIndex:
+        min_support = config.rule_index_min_support
+        stored = load_rule_index(directory, config.name, snapshot.version, min_support)
+        if stored is not None:
+            client_logger.info("Índice de reglas leído del disco (versión %s)", snapshot.version)
+            return RuleIndex.from_itemsets(
+                snapshot, min_support, stored["n_orders"], stored["columns"], stored["itemsets"], stored["counts"]
+            )
+        index = RuleIndex.build(snapshot, min_support, config.mining_engine, client_logger)
+        try:
+            save_rule_index(
+                directory, config.name, snapshot.version, min_support, index.n_orders, index.columns.tolist(),
+                index.itemsets(), index.counts.tolist(),
+            )
+        except OSError as exc:
+            client_logger.warning("No se pudo guardar el índice de reglas en disco: %s", exc)
+        return index
+
+
+rule_index_store = RuleIndexStore()
+snapshot_store.subscribe(rule_index_store.on_snapshot)
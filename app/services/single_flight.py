@@ -0,0 +1,84 @@
+import logging
+import threading
+from typing import Callable, Hashable, Iterable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Deduplicación de cómputos idénticos en curso.
+
+    La primera solicitud con una clave ejecuta el cómputo; las que llegan con la
+    misma clave mientras sigue en curso esperan y comparten su resultado (o su
+    excepción). Al terminar la clave se libera: no es un caché.
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self._executed = 0
+        self._coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._executed += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            logger.info("Solicitud idéntica en curso, esperando su resultado")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executed": self._executed,
+                "coalesced": self._coalesced,
+                "active_flights": len(self._flights),
+            }
+
+
+def mba_request_key(
+    client_name: str,
+    product_names: Iterable[str],
+    min_support: float,
+    top_n: int,
+    data_version: str | None,
+    *options: Hashable,
+) -> tuple:
+    """Clave normalizada de una solicitud MBA: términos sin espacios, en minúsculas y ordenados."""
+    terms = tuple(sorted(name.strip().lower() for name in product_names))
+    return (client_name, terms, min_support, top_n, data_version, *options)
+
+
+mba_flights = SingleFlight()
@@ -0,0 +1,538 @@
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from functools import cached_property
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from app.config import get_settings
+from app.services.database import get_engine
+from app.services.market_basket import clean_transactions, valid_product_rows
+from app.services.order_index import OrderIndex
+from app.services.product_index import ProductIndex
+from app.services.snapshot_files import (
+    current_version,
+    load_snapshot_arrays,
+    pointer_mtime,
+    refresh_lock,
+    save_snapshot,
+)
+
+if TYPE_CHECKING:
+    from app.clients.base import ClientConfig
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TransactionSnapshot:
+    """
+    Tabla de transacciones de un cliente, residente en memoria en forma compacta.
+
+    Cada línea de orden i es el par (order_codes[i], product_codes[i]); los códigos
+    son índices int32 sobre los diccionarios `orders` (order_id originales) y
+    `products` (product_name únicos).
+    """
+
+    client_name: str
+    order_codes: np.ndarray
+    product_codes: np.ndarray
+    orders: np.ndarray
+    products: np.ndarray
+    version: str
+    loaded_at: float
+    # Máximo de la columna watermark del cliente ya incorporado (None si no aplica)
+    watermark: object = None
+    # order_index leído de disco junto al snapshot (si no, se construye en la primera búsqueda)
+    stored_order_index: OrderIndex | None = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def from_frame(cls, client_name: str, df: pd.DataFrame, watermark_column: str | None = None) -> "TransactionSnapshot":
+        """Codifica un DataFrame limpio (order_id, product_name) en forma compacta."""
+        return cls.from_chunks(client_name, [df], watermark_column)
+
+    @classmethod
+    def from_chunks(
+        cls,
+        client_name: str,
+        chunks: Iterable[pd.DataFrame],
+        watermark_column: str | None = None,
+        client_logger=None,
+    ) -> "TransactionSnapshot":
+        """
+        Codifica las transacciones a medida que llegan, chunk por chunk.
+
+        Cada chunk se limpia y se reduce a sus order_id y a códigos int32 de
+        producto (el diccionario de productos crece incrementalmente) antes de
+        leer el siguiente, así que la memoria pico es un chunk más los arrays ya
+        codificados. Los order_id se factorizan una sola vez al final.
+        """
+        log = client_logger or logger
+        products = np.empty(0, dtype=object)
+        order_ids: list[np.ndarray] = []
+        product_codes: list[np.ndarray] = []
+        watermark = None
+        received = 0
+        for chunk in chunks:
+            received += len(chunk)
+            chunk = chunk[valid_product_rows(chunk)]
+            if chunk.empty:
+                continue
+            chunk_watermark = _max_watermark(chunk, watermark_column)
+            if chunk_watermark is not None:
+                watermark = chunk_watermark if watermark is None else max(watermark, chunk_watermark)
+            products, codes = _extend_dictionary(products, chunk["product_name"])
+            order_ids.append(chunk["order_id"].to_numpy())
+            product_codes.append(codes)
+
+        all_product_codes = np.concatenate(product_codes) if product_codes else np.empty(0, dtype=np.int32)
+        if order_ids:
+            order_codes, orders = pd.factorize(np.concatenate(order_ids))
+            orders = np.asarray(orders)
+        else:
+            order_codes, orders = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64)
+        del order_ids, product_codes
+        order_codes = order_codes.astype(np.int32)
+
+        cleaned = received - len(order_codes)
+        if cleaned > 0:
+            log.info("Eliminados %d registros con product_name None/vacío", cleaned)
+        return cls(
+            client_name=client_name,
+            order_codes=order_codes,
+            product_codes=all_product_codes,
+            orders=orders,
+            products=products,
+            version=_fingerprint(order_codes, all_product_codes, orders, products),
+            loaded_at=time.time(),
+            watermark=watermark,
+        )
+
+    @classmethod
+    def from_disk(cls, client_name: str, directory: str) -> "TransactionSnapshot | None":
+        """Snapshot persistido en disco (ver snapshot_files), con los arrays mapeados en memoria."""
+        stored = load_snapshot_arrays(directory, client_name)
+        if stored is None:
+            return None
+        meta = stored["meta"]
+        return cls(
+            client_name=client_name,
+            order_codes=stored["order_codes"],
+            product_codes=stored["product_codes"],
+            orders=stored["orders"],
+            products=stored["products"],
+            version=meta["version"],
+            loaded_at=meta["loaded_at"],
+            watermark=meta["watermark"],
+            stored_order_index=OrderIndex(n_orders=meta["orders"], **stored["order_index"]),
+        )
+
+    def _delta_is_known(self, delta: pd.DataFrame, watermark_column: str) -> bool:
+        """True si el delta solo re-entrega las líneas ya incorporadas de la última orden."""
+        if self.watermark is None or _max_watermark(delta, watermark_column) != self.watermark:
+            return False
+        order_codes = pd.Index(self.orders).get_indexer(delta["order_id"])
+        product_codes = pd.Index(self.products).get_indexer(delta["product_name"])
+        if (order_codes < 0).any() or (product_codes < 0).any():
+            return False
+        known = np.isin(self.order_codes, order_codes)
+        return sorted(zip(self.order_codes[known], self.product_codes[known])) == sorted(zip(order_codes, product_codes))
+
+    def merge_delta(self, delta: pd.DataFrame, watermark_column: str) -> "TransactionSnapshot":
+        """
+        Nuevo snapshot con las líneas de `delta` incorporadas.
+
+        `delta` trae las líneas con watermark >= al último incorporado, así que las
+        órdenes que aparecen en él se reemplazan completas (cubre la última orden
+        si se cargó a medias en el refresh anterior). Los códigos existentes se
+        conservan; productos y órdenes nuevos se agregan al final de los diccionarios.
+        """
+        if delta.empty or self._delta_is_known(delta, watermark_column):
+            # Mismos datos: conserva también el order_index mapeado desde disco
+            return replace(self, loaded_at=time.time())
+
+        orders, delta_orders = _extend_dictionary(self.orders, delta["order_id"])
+        products, delta_products = _extend_dictionary(self.products, delta["product_name"])
+
+        keep = ~np.isin(self.order_codes, np.unique(delta_orders))
+        order_codes = np.concatenate([self.order_codes[keep], delta_orders])
+        product_codes = np.concatenate([self.product_codes[keep], delta_products])
+
+        delta_watermark = _max_watermark(delta, watermark_column)
+        return TransactionSnapshot(
+            client_name=self.client_name,
+            order_codes=order_codes,
+            product_codes=product_codes,
+            orders=orders,
+            products=products,
+            # La versión encadena la anterior con el delta: costo proporcional al delta
+            version=_fingerprint(np.frombuffer(bytes.fromhex(self.version), dtype=np.uint8), delta_orders, delta_products),
+            loaded_at=time.time(),
+            watermark=max(self.watermark, delta_watermark) if self.watermark is not None else delta_watermark,
+        )
+
+    def __len__(self) -> int:
+        return len(self.order_codes)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes de los arrays de códigos (sin contar los diccionarios de strings)."""
+        return self.order_codes.nbytes + self.product_codes.nbytes + self.orders.nbytes
+
+    @property
+    def shared_nbytes(self) -> int:
+        """Bytes de arrays mapeados desde disco (page cache compartido entre workers)."""
+        arrays = (self.order_codes, self.product_codes, self.orders)
+        return sum(array.nbytes for array in arrays if isinstance(array, np.memmap))
+
+    @cached_property
+    def product_index(self) -> ProductIndex:
+        """Índice de trigramas sobre `products`; se construye en la primera búsqueda."""
+        return ProductIndex(self.products)
+
+    @cached_property
+    def order_index(self) -> OrderIndex:
+        """
+        Listas de órdenes por producto y líneas por orden: las mapeadas desde disco
+        o, si no hay, se construyen en la primera búsqueda.
+        """
+        if self.stored_order_index is not None:
+            return self.stored_order_index
+        return OrderIndex.build(self.order_codes, self.product_codes, len(self.orders), len(self.products))
+
+    @cached_property
+    def product_dtype(self) -> pd.CategoricalDtype:
+        return pd.CategoricalDtype(self.products)
+
+    def is_expired(self, ttl: float) -> bool:
+        return time.time() - self.loaded_at >= ttl
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame (order_id, product_name) con product_name categórico, sin copiar strings."""
+        return self._frame(self.order_codes, self.product_codes)
+
+    def orders_frame(self, order_codes: np.ndarray) -> pd.DataFrame:
+        """to_frame solo con las líneas de esas órdenes (códigos), tomadas del order_index."""
+        lines = self.order_index.lines_of(order_codes)
+        return self._frame(self.order_codes[lines], self.product_codes[lines])
+
+    def _frame(self, order_codes: np.ndarray, product_codes: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "order_id": self.orders.take(order_codes),
+                "product_name": pd.Categorical.from_codes(product_codes, dtype=self.product_dtype),
+            }
+        )
+
+
+def _extend_dictionary(dictionary: np.ndarray, values: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """Códigos int32 de `values` sobre `dictionary`, agregando los valores que no existían."""
+    codes = pd.Index(dictionary).get_indexer(values)
+    missing = codes < 0
+    if missing.any():
+        if dictionary.dtype.kind in "US":
+            # Un diccionario de texto de ancho fijo truncaría los valores nuevos más largos
+            dictionary = dictionary.astype(object)
+        new_codes, new_values = pd.factorize(values[missing])
+        codes[missing] = new_codes + len(dictionary)
+        dictionary = np.concatenate([dictionary, np.asarray(new_values, dtype=dictionary.dtype)])
+    return dictionary, codes.astype(np.int32)
+
+
+def read_sql_chunks(engine, query, chunk_size: int, params: dict | None = None) -> Iterator[pd.DataFrame]:
+    """
+    Lee `query` en chunks de `chunk_size` filas sin traer el resultado completo a memoria.
+
+    mysql-connector no tiene cursores del lado del servidor en SQLAlchemy
+    (`stream_results` se ignora) y el dialecto abre las conexiones con
+    `buffered=True`, que descarga todo el resultado al ejecutar. Para ese driver
+    se usa un cursor DBAPI con `buffered=False`, que lee las filas del socket a
+    medida que se piden con fetchmany. Los demás dialectos usan `stream_results`.
+    """
+    if engine.dialect.driver == "mysqlconnector":
+        yield from _read_unbuffered(engine, query, chunk_size, params)
+        return
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=chunk_size) as connection:
+        yield from pd.read_sql_query(query, connection, params=params, chunksize=chunk_size)
+
+
+def _read_unbuffered(engine, query, chunk_size: int, params: dict | None = None) -> Iterator[pd.DataFrame]:
+    compiled = query.compile(dialect=engine.dialect)
+    connection = engine.raw_connection()
+    exhausted = False
+    try:
+        cursor = connection.driver_connection.cursor(buffered=False)
+        cursor.execute(str(compiled), compiled.construct_params(params))
+        for chunk in fetch_chunks(cursor, chunk_size):
+            yield chunk
+        exhausted = True
+        cursor.close()
+    finally:
+        if exhausted:
+            connection.close()
+        else:
+            # Quedan filas sin leer en el socket: la conexión no puede volver al pool
+            connection.invalidate()
+
+
+def fetch_chunks(cursor, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """DataFrames de hasta `chunk_size` filas de un cursor DBAPI ya ejecutado (fetchmany)."""
+    columns = [column[0] for column in cursor.description]
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+
+def _max_watermark(df: pd.DataFrame, watermark_column: str | None):
+    if not watermark_column or df.empty:
+        return None
+    value = df[watermark_column].max()
+    return value.item() if hasattr(value, "item") else value
+
+
+def _fingerprint(*arrays: np.ndarray) -> str:
+    """Versión de datos derivada del contenido: igual en todos los workers que ven los mismos datos."""
+    digest = hashlib.blake2b(digest_size=8)
+    for array in arrays:
+        if array.dtype == object:
+            digest.update("\x00".join(map(str, array)).encode("utf-8"))
+        else:
+            digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+class SnapshotStore:
+    """
+    Registro de snapshots por cliente.
+
+    La primera solicitud de un cliente carga la tabla completa una sola vez; las
+    siguientes se sirven desde memoria hasta que vence `snapshot_ttl`. Al vencer,
+    una sola solicitud recarga mientras las concurrentes siguen usando el snapshot
+    anterior. Si el cliente declara `watermark_column`, la recarga solo trae las
+    líneas posteriores al último watermark y las fusiona con el snapshot.
+
+    Con `snapshot_dir` configurado cada versión nueva se persiste en disco y los
+    arrays se re-mapean desde ese archivo: todos los workers del contenedor
+    comparten las mismas páginas, así que la memoria residente no crece con el
+    número de workers. El refresh se serializa con un lock de archivo; el worker
+    que llega tarde adopta el snapshot que dejó el primero en vez de ir a la BD.
+    Cada get revisa además (un stat del puntero CURRENT) si otro worker publicó
+    una versión nueva, por ejemplo con POST /refresh, y la adopta sin esperar
+    al TTL.
+    """
+
+    def __init__(self):
+        self._snapshots: dict[str, TransactionSnapshot] = {}
+        # mtime del puntero CURRENT ya revisado por cliente (ver _follow_disk)
+        self._pointer_mtimes: dict[str, int] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self._subscribers: list[Callable[["ClientConfig", TransactionSnapshot], None]] = []
+
+    def _lock_for(self, client_name: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(client_name, threading.Lock())
+
+    def get(self, config: "ClientConfig", client_logger=None) -> TransactionSnapshot:
+        """Snapshot vigente del cliente, cargándolo si no existe o si venció el TTL."""
+        snapshot = self._snapshots.get(config.name)
+        if snapshot is not None and not snapshot.is_expired(config.snapshot_ttl):
+            return self._follow_disk(config, snapshot, client_logger)
+
+        lock = self._lock_for(config.name)
+        if snapshot is None:
+            snapshot = self.load_from_disk(config.name)
+            if snapshot is not None and not snapshot.is_expired(config.snapshot_ttl):
+                return snapshot
+
+        if snapshot is not None:
+            # Ya hay un snapshot (vencido): si otro hilo está recargando, servir el anterior
+            if not lock.acquire(blocking=False):
+                return snapshot
+        else:
+            lock.acquire()
+
+        try:
+            current = self._snapshots.get(config.name)
+            if current is not None and current is not snapshot:
+                return current
+            return self._refresh(config, client_logger)
+        finally:
+            lock.release()
+
+    def _follow_disk(
+        self, config: "ClientConfig", snapshot: TransactionSnapshot, client_logger=None
+    ) -> TransactionSnapshot:
+        """
+        `snapshot`, o el que otro worker publicó en disco después. Solo si cambió
+        el mtime de CURRENT se lee la versión, y solo si difiere se carga el
+        snapshot (mapeado, sin ir a la BD).
+        """
+        directory = get_settings().snapshot_dir
+        if not directory:
+            return snapshot
+        mtime = pointer_mtime(directory, config.name)
+        if mtime is None or self._pointer_mtimes.get(config.name) == mtime:
+            return snapshot
+        lock = self._lock_for(config.name)
+        # Si otro hilo está cargando o refrescando, él deja el snapshot al día
+        if not lock.acquire(blocking=False):
+            return snapshot
+        try:
+            self._pointer_mtimes[config.name] = mtime
+            current = self._snapshots.get(config.name, snapshot)
+            if current_version(directory, config.name) in (None, current.version):
+                return current
+            shared = TransactionSnapshot.from_disk(config.name, directory)
+            if shared is None or shared.loaded_at <= current.loaded_at:
+                return current
+            (client_logger or logger).info(
+                "Snapshot versión %s publicado por otro worker, adoptado desde disco", shared.version
+            )
+            return self._publish(config, shared, persist=False)
+        finally:
+            lock.release()
+
+    def refresh(self, config: "ClientConfig", client_logger=None, full: bool = False) -> TransactionSnapshot:
+        """Fuerza la actualización del snapshot del cliente (delta por watermark salvo `full`)."""
+        with self._lock_for(config.name):
+            return self._refresh(config, client_logger, full)
+
+    def invalidate(self, client_name: str) -> None:
+        self._snapshots.pop(client_name, None)
+
+    def load_from_disk(self, client_name: str) -> TransactionSnapshot | None:
+        """Carga en memoria el snapshot persistido del cliente, si existe y es válido."""
+        directory = get_settings().snapshot_dir
+        if not directory:
+            return None
+        with self._lock_for(client_name):
+            current = self._snapshots.get(client_name)
+            if current is not None:
+                return current
+            snapshot = TransactionSnapshot.from_disk(client_name, directory)
+            if snapshot is not None:
+                self._snapshots[client_name] = snapshot
+                logger.info(
+                    "Snapshot de %s cargado desde disco: %d líneas, versión %s",
+                    client_name, len(snapshot), snapshot.version,
+                )
+            return snapshot
+
+    def current(self, client_name: str) -> TransactionSnapshot | None:
+        """Snapshot en memoria del cliente, sin cargar ni validar TTL."""
+        return self._snapshots.get(client_name)
+
+    def snapshots(self) -> dict[str, TransactionSnapshot]:
+        """Snapshots en memoria de todos los clientes."""
+        return dict(self._snapshots)
+
+    def subscribe(self, callback: Callable[["ClientConfig", TransactionSnapshot], None]) -> None:
+        """Registra un callback que se invoca cada vez que cambia la versión de datos de un cliente."""
+        self._subscribers.append(callback)
+
+    def _publish(self, config: "ClientConfig", snapshot: TransactionSnapshot, persist: bool = True) -> TransactionSnapshot:
+        previous = self._snapshots.get(config.name)
+        directory = get_settings().snapshot_dir
+        changed = previous is None or previous.version != snapshot.version
+        if directory and persist:
+            try:
+                save_snapshot(snapshot, directory)
+                if changed:
+                    snapshot = self._attach_shared(snapshot, directory)
+            except OSError:
+                logger.warning("No se pudo persistir el snapshot de %s", config.name, exc_info=True)
+
+        self._snapshots[config.name] = snapshot
+        if not changed:
+            return snapshot
+        for callback in self._subscribers:
+            try:
+                callback(config, snapshot)
+            except Exception:
+                logger.exception("Error notificando nueva versión de datos de %s", config.name)
+        return snapshot
+
+    @staticmethod
+    def _attach_shared(snapshot: TransactionSnapshot, directory: str) -> TransactionSnapshot:
+        """Reemplaza los arrays recién cargados por su versión mapeada desde disco."""
+        shared = TransactionSnapshot.from_disk(snapshot.client_name, directory)
+        if shared is None or shared.version != snapshot.version:
+            return snapshot
+        return replace(shared, loaded_at=snapshot.loaded_at, watermark=snapshot.watermark)
+
+    def _refresh(self, config: "ClientConfig", client_logger=None, full: bool = False) -> TransactionSnapshot:
+        directory = get_settings().snapshot_dir
+        if not directory:
+            return self._refresh_from_db(config, client_logger, full)
+        with refresh_lock(directory, config.name):
+            if not full:
+                shared = self._adopt_shared(config, directory, client_logger)
+                if shared is not None:
+                    return shared
+            return self._refresh_from_db(config, client_logger, full)
+
+    def _adopt_shared(self, config: "ClientConfig", directory: str, client_logger=None) -> TransactionSnapshot | None:
+        """Snapshot en disco más reciente que el propio y dentro del TTL (lo refrescó otro worker)."""
+        current = self._snapshots.get(config.name)
+        shared = TransactionSnapshot.from_disk(config.name, directory)
+        if shared is None or shared.is_expired(config.snapshot_ttl):
+            return None
+        if current is not None and shared.loaded_at <= current.loaded_at:
+            return None
+        (client_logger or logger).info("Snapshot versión %s adoptado desde disco", shared.version)
+        return self._publish(config, shared, persist=False)
+
+    def _refresh_from_db(self, config: "ClientConfig", client_logger=None, full: bool = False) -> TransactionSnapshot:
+        current = self._snapshots.get(config.name)
+        if full or current is None or not config.watermark_column or current.watermark is None:
+            return self._load(config, client_logger)
+        return self._load_delta(config, current, client_logger)
+
+    def _load(self, config: "ClientConfig", client_logger=None) -> TransactionSnapshot:
+        log = client_logger or logger
+        started = time.perf_counter()
+        chunk_size = get_settings().ingest_chunk_size
+        log.info("Cargando snapshot de transacciones (chunks de %d filas)", chunk_size)
+        chunks = read_sql_chunks(get_engine(config.db_url, config.name), text(config.query), chunk_size)
+
+        snapshot = TransactionSnapshot.from_chunks(config.name, chunks, config.watermark_column, client_logger)
+        snapshot = self._publish(config, snapshot)
+        log.info(
+            "Snapshot cargado: %d líneas, %d órdenes, %d productos, %.1f MB, versión %s (%.1fs)",
+            len(snapshot), len(snapshot.orders), len(snapshot.products),
+            snapshot.nbytes / 1e6, snapshot.version, time.perf_counter() - started,
+        )
+        return snapshot
+
+    def _load_delta(
+        self, config: "ClientConfig", current: TransactionSnapshot, client_logger=None
+    ) -> TransactionSnapshot:
+        log = client_logger or logger
+        started = time.perf_counter()
+        log.info("Cargando delta de transacciones desde %s >= %s", config.watermark_column, current.watermark)
+        delta_query = text(
+            f"SELECT * FROM ({config.query}) AS base "
+            f"WHERE base.{config.watermark_column} >= :watermark"
+        )
+        engine = get_engine(config.db_url, config.name)
+        delta = pd.read_sql_query(delta_query, engine, params={"watermark": current.watermark})
+        delta = clean_transactions(delta, client_logger)
+
+        snapshot = current.merge_delta(delta, config.watermark_column)
+        snapshot = self._publish(config, snapshot)
+        log.info(
+            "Delta incorporado: %d líneas recibidas, snapshot con %d líneas, watermark %s, versión %s (%.1fs)",
+            len(delta), len(snapshot), snapshot.watermark, snapshot.version, time.perf_counter() - started,
+        )
+        return snapshot
+
+
+snapshot_store = SnapshotStore()
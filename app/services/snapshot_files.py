@@ -0,0 +1,296 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from app.services.order_index import ARRAYS as ORDER_INDEX_ARRAYS
+
+logger = logging.getLogger(__name__)
+
+# Cambia si cambia el layout de los archivos; snapshots de otro formato se ignoran
+FORMAT_VERSION = 4
+
+_ARRAYS = ("order_codes", "product_codes")
+
+
+def _client_dir(directory: str, client_name: str) -> Path:
+    return Path(directory) / client_name
+
+
+def _encode_watermark(watermark) -> dict | None:
+    """
+    Watermark para meta.json con su tipo, para recuperarlo igual al cargar: un
+    string en lugar de un datetime rompería la comparación con el máximo del
+    siguiente delta. Un tipo no soportado se guarda como None (el worker que
+    cargue ese snapshot hará un refresh completo).
+    """
+    if watermark is None:
+        return None
+    if isinstance(watermark, (bool, np.bool_)):
+        kind, value = "bool", bool(watermark)
+    elif isinstance(watermark, (int, np.integer)):
+        kind, value = "int", int(watermark)
+    elif isinstance(watermark, (float, np.floating)):
+        kind, value = "float", float(watermark)
+    elif isinstance(watermark, Decimal):
+        kind, value = "decimal", str(watermark)
+    elif isinstance(watermark, datetime):
+        kind, value = "datetime", pd.Timestamp(watermark).isoformat()
+    elif isinstance(watermark, date):
+        kind, value = "date", watermark.isoformat()
+    elif isinstance(watermark, str):
+        kind, value = "str", watermark
+    else:
+        logger.warning("Watermark de tipo %s no se persiste", type(watermark).__name__)
+        return None
+    return {"type": kind, "value": value}
+
+
+def _decode_watermark(stored: dict | None):
+    if stored is None:
+        return None
+    value = stored["value"]
+    return {
+        "bool": bool,
+        "int": int,
+        "float": float,
+        "decimal": Decimal,
+        "datetime": pd.Timestamp,
+        "date": date.fromisoformat,
+        "str": str,
+    }[stored["type"]](value)
+
+
+def save_snapshot(snapshot, directory: str) -> Path:
+    """
+    Persiste el snapshot en `{directory}/{cliente}/{versión}/` en formato columnar.
+
+    - order_codes.npy / product_codes.npy: int32 por línea de orden
+    - orders.npy: diccionario de order_id numérico, o orders.json si es texto
+      (nunca pickle; un array `<U{n}` de ancho fijo truncaría los ids nuevos
+      que agregue un delta)
+    - products.json: diccionario de product_name
+    - product_indptr.npy, product_orders.npy, dense_slot.npy, bitmaps.npy,
+      order_indptr.npy, line_positions.npy: el order_index del snapshot (se
+      construye aquí si aún no existe), para que cada worker no arme su copia
+    - meta.json: formato, versión de datos, watermark (con su tipo) y conteos
+
+    Se escribe en un directorio temporal y se publica con rename atómico; el
+    archivo CURRENT apunta a la versión vigente. Es seguro que varios workers
+    guarden la misma versión a la vez. Si la versión ya existe solo se
+    actualiza `loaded_at` en meta.json (refresh sin cambios).
+    """
+    client_dir = _client_dir(directory, snapshot.client_name)
+    client_dir.mkdir(parents=True, exist_ok=True)
+    target = client_dir / snapshot.version
+    meta = {
+        "format": FORMAT_VERSION,
+        "client_name": snapshot.client_name,
+        "version": snapshot.version,
+        "watermark": _encode_watermark(snapshot.watermark),
+        "loaded_at": snapshot.loaded_at,
+        "rows": len(snapshot.order_codes),
+        "orders": len(snapshot.orders),
+        "products": len(snapshot.products),
+    }
+
+    if target.exists():
+        staged_meta = target / f".meta-{os.getpid()}.json"
+        with open(staged_meta, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(staged_meta, target / "meta.json")
+    else:
+        staging = Path(tempfile.mkdtemp(prefix=f".{snapshot.version}-", dir=client_dir))
+        np.save(staging / "order_codes.npy", np.ascontiguousarray(snapshot.order_codes))
+        np.save(staging / "product_codes.npy", np.ascontiguousarray(snapshot.product_codes))
+        if snapshot.orders.dtype == object:
+            with open(staging / "orders.json", "w", encoding="utf-8") as f:
+                json.dump([str(o) for o in snapshot.orders], f, ensure_ascii=False)
+        else:
+            np.save(staging / "orders.npy", snapshot.orders)
+        order_index = snapshot.order_index
+        for name in ORDER_INDEX_ARRAYS:
+            np.save(staging / f"{name}.npy", np.ascontiguousarray(getattr(order_index, name)))
+        with open(staging / "products.json", "w", encoding="utf-8") as f:
+            json.dump([str(p) for p in snapshot.products], f, ensure_ascii=False)
+        with open(staging / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        try:
+            os.rename(staging, target)
+        except OSError:
+            # Otro worker publicó la misma versión primero
+            shutil.rmtree(staging, ignore_errors=True)
+
+    pointer = client_dir / f".CURRENT-{os.getpid()}"
+    pointer.write_text(snapshot.version)
+    os.replace(pointer, client_dir / "CURRENT")
+    _remove_stale_versions(client_dir, keep=snapshot.version)
+    return target
+
+
+def pointer_mtime(directory: str, client_name: str) -> int | None:
+    """mtime (ns) del archivo CURRENT del cliente: cambia cada vez que un worker publica."""
+    try:
+        return os.stat(_client_dir(directory, client_name) / "CURRENT").st_mtime_ns
+    except OSError:
+        return None
+
+
+def current_version(directory: str, client_name: str) -> str | None:
+    """Versión a la que apunta CURRENT, o None si no hay snapshot en disco."""
+    try:
+        return (_client_dir(directory, client_name) / "CURRENT").read_text().strip()
+    except OSError:
+        return None
+
+
+@contextmanager
+def refresh_lock(directory: str, client_name: str, lock_name: str = ".lock") -> Iterator[None]:
+    """
+    Lock exclusivo entre procesos (flock) para refrescar el snapshot de un cliente.
+
+    Con varios workers de gunicorn solo uno consulta la BD; los demás esperan y
+    adoptan el snapshot que ese worker dejó en disco. Con otro `lock_name` sirve
+    para lo mismo con otros datos derivados (ej. el índice de reglas) sin
+    bloquear el refresh.
+    """
+    client_dir = _client_dir(directory, client_name)
+    client_dir.mkdir(parents=True, exist_ok=True)
+    with open(client_dir / lock_name, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_snapshot_arrays(directory: str, client_name: str) -> dict | None:
+    """
+    Arrays y metadatos del snapshot vigente de un cliente, mapeados en memoria
+    (solo lectura). None si no hay snapshot en disco o no pasa la validación.
+    """
+    client_dir = _client_dir(directory, client_name)
+    try:
+        version = (client_dir / "CURRENT").read_text().strip()
+        target = client_dir / version
+        with open(target / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_VERSION or meta.get("client_name") != client_name or meta.get("version") != version:
+            logger.warning("Snapshot en disco de %s inválido (formato/versión), se ignora", client_name)
+            return None
+        meta["watermark"] = _decode_watermark(meta["watermark"])
+
+        arrays = {name: np.load(target / f"{name}.npy", mmap_mode="r") for name in _ARRAYS}
+        if (target / "orders.json").exists():
+            with open(target / "orders.json", encoding="utf-8") as f:
+                arrays["orders"] = np.asarray(json.load(f), dtype=object)
+        else:
+            arrays["orders"] = np.load(target / "orders.npy", mmap_mode="r")
+        order_index = {name: np.load(target / f"{name}.npy", mmap_mode="r") for name in ORDER_INDEX_ARRAYS}
+        with open(target / "products.json", encoding="utf-8") as f:
+            products = np.asarray(json.load(f), dtype=object)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as exc:
+        logger.warning("No se pudo leer el snapshot en disco de %s: %s", client_name, exc)
+        return None
+
+    if (
+        len(arrays["order_codes"]) != meta["rows"]
+        or len(arrays["product_codes"]) != meta["rows"]
+        or len(arrays["orders"]) != meta["orders"]
+        or len(products) != meta["products"]
+        or len(order_index["product_indptr"]) != meta["products"] + 1
+        or len(order_index["order_indptr"]) != meta["orders"] + 1
+        or len(order_index["line_positions"]) != meta["rows"]
+    ):
+        logger.warning("Snapshot en disco de %s incompleto, se ignora", client_name)
+        return None
+
+    return {**arrays, "products": products, "order_index": order_index, "meta": meta}
+
+
+def save_rule_index(
+    directory: str,
+    client_name: str,
+    version: str,
+    min_support: float,
+    n_orders: int,
+    columns: list[str],
+    itemsets: list[list[int]],
+    counts: list[int],
+) -> Path | None:
+    """
+    Persiste los itemsets frecuentes del índice de reglas junto al snapshot de
+    la versión (`itemsets-{min_support}.json`: productos, itemsets como
+    posiciones de producto y conteos de órdenes), para que los demás workers no
+    los minen de nuevo. None si esa versión del snapshot no está en disco.
+    """
+    target = _client_dir(directory, client_name) / version
+    if not (target / "meta.json").exists():
+        return None
+    path = target / f"itemsets-{min_support:g}.json"
+    stored = {
+        "format": FORMAT_VERSION,
+        "min_support": min_support,
+        "n_orders": n_orders,
+        "columns": list(columns),
+        "itemsets": itemsets,
+        "counts": [int(count) for count in counts],
+    }
+    staged = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(staged, "w", encoding="utf-8") as f:
+        json.dump(stored, f, ensure_ascii=False)
+    os.replace(staged, path)
+    return path
+
+
+def load_rule_index(directory: str, client_name: str, version: str, min_support: float) -> dict | None:
+    """
+    Itemsets guardados con save_rule_index (claves n_orders, columns, itemsets y
+    counts), o None si no hay o no son válidos.
+    """
+    path = _client_dir(directory, client_name) / version / f"itemsets-{min_support:g}.json"
+    try:
+        with open(path, encoding="utf-8") as f:
+            stored = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        logger.warning("No se pudo leer el índice de reglas en disco de %s: %s", client_name, exc)
+        return None
+    if (
+        stored.get("format") != FORMAT_VERSION
+        or stored.get("min_support") != min_support
+        or len(stored["itemsets"]) != len(stored["counts"])
+    ):
+        return None
+    return {
+        "n_orders": stored["n_orders"],
+        "columns": np.asarray(stored["columns"], dtype=object),
+        "itemsets": stored["itemsets"],
+        "counts": np.asarray(stored["counts"], dtype=np.int64),
+    }
+
+
+def _remove_stale_versions(client_dir: Path, keep: str, min_age: float = 60.0) -> None:
+    """Borra versiones anteriores (los workers que aún las tengan mapeadas no se ven afectados)."""
+    now = time.time()
+    for path in client_dir.iterdir():
+        if not path.is_dir() or path.name == keep:
+            continue
+        # Directorios temporales de otros workers que todavía pueden estar escribiendo
+        if path.name.startswith(".") and now - path.stat().st_mtime < min_age:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
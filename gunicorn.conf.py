@@ -5,3 +5,11 @@ worker_class = "uvicorn.workers.UvicornWorker"
 accesslog = "access.log"
 errorlog = "error.log"
 loglevel = "info"
+
+
+def on_starting(server):
+    # Las métricas de /metrics se suman entre workers desde archivos (ver app/services/metrics.py):
+    # los de la ejecución anterior no deben sumarse a la nueva
+    from app.services.metrics import clear_worker_files
+
+    clear_worker_files()
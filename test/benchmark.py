@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Benchmark reproducible del pipeline de MBA sobre datos sintéticos.
+
+Genera órdenes con popularidad de productos tipo power-law (Zipf) y tamaños de
+basket geométricos, las guarda en un SQLite local (el mismo esquema que la
+query de los clientes) y ejecuta run_mba_pipeline por escala, búsqueda y
+min_support, con las etapas que mide su PipelineStats (las mismas de /metrics):
+
+    consulta        consulta filtrada a la BD (solo modo db)
+    filtro          limpieza y selección de órdenes (filter_transactions / filter_snapshot)
+    transformacion  transform_data de ejemplo (solo con --transform)
+    baskets         process_data: baskets y matriz CSR (incluye la codificación)
+    cola            espera y traslado de la matriz y las reglas al pool de minado
+    minado          itemsets frecuentes y reglas de un consecuente (en el pool)
+    reglas          filtro de LHS y top N (en el pool)
+    formato         format_top_rules
+
+El minado pasa por el pool de procesos como en la API (MINING_PROCESSES; con 0
+corre en el proceso del benchmark y `cola` queda en cero).
+
+El resultado se escribe en JSON (--output) para comparar commits; con
+--baseline se compara contra otra corrida y el script termina con código 1 si
+alguna etapa empeora más que --tolerance.
+
+Uso:
+    python3 test/benchmark.py
+    python3 test/benchmark.py --orders 10000 100000 --supports 0.02 0.01 --output bench.json
+    python3 test/benchmark.py --output bench_new.json --baseline bench.json
+"""
+import argparse
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import mlxtend
+import numpy as np
+import pandas as pd
+import scipy
+import sqlalchemy
+from sqlalchemy import create_engine
+
+from app.config import get_settings
+from app.services.database import get_engine
+from app.services.market_basket import DEFAULT_TOP_N, clean_transactions, run_mba_pipeline
+from app.services.metrics import PipelineStats
+from app.services.mining_pool import mining_pool
+from app.services.snapshot import TransactionSnapshot
+
+STAGES = ["consulta", "filtro", "transformacion", "baskets", "cola", "minado", "reglas", "formato"]
+QUERY = "SELECT customer_id, order_id, product_name FROM orders"
+
+CATEGORIES = [
+    "Burger", "Papas", "Malteada", "Combo", "Refresco", "Ensalada",
+    "Helado", "Pollo", "Café", "Postre", "Taco", "Nuggets",
+]
+VARIANTS = ["Chica", "Mediana", "Grande", "Doble", "Picante", "Clásica", "Especial", "Light"]
+
+DEFAULT_QUERIES = ["papas", "burger, papas", "combo, refresco, papas", "malteada grande"]
+
+
+def product_names(n_products: int, rng: np.random.Generator) -> np.ndarray:
+    """Nombres tipo "Burger Doble 017", en orden aleatorio de popularidad."""
+    names = [
+        f"{CATEGORIES[i % len(CATEGORIES)]} {VARIANTS[(i // len(CATEGORIES)) % len(VARIANTS)]} {i:03d}"
+        for i in range(n_products)
+    ]
+    return np.array(names, dtype=object)[rng.permutation(n_products)]
+
+
+def generate_orders(
+    n_orders: int, n_products: int, avg_basket: float, max_basket: int, zipf_exponent: float, seed: int
+) -> pd.DataFrame:
+    """
+    Líneas de orden sintéticas (customer_id, order_id, product_name).
+
+    La probabilidad del producto de rango k es proporcional a 1 / k^zipf_exponent
+    y el tamaño de cada orden es geométrico con media `avg_basket` (entre 1 y
+    `max_basket`: sin tope, las pocas órdenes enormes dominan el minado con
+    soportes bajos en búsquedas de pocas órdenes).
+    Un mismo producto puede repetirse en una orden, como en los datos reales.
+    """
+    rng = np.random.default_rng(seed)
+    names = product_names(n_products, rng)
+    weights = 1.0 / np.arange(1, n_products + 1) ** zipf_exponent
+    sizes = np.minimum(rng.geometric(1.0 / avg_basket, size=n_orders), max_basket)
+    products = rng.choice(n_products, size=int(sizes.sum()), p=weights / weights.sum())
+    order_ids = np.repeat(np.arange(1, n_orders + 1), sizes)
+    customers = rng.integers(1, max(n_orders // 4, 2), size=n_orders)
+    return pd.DataFrame({
+        "customer_id": np.repeat(customers, sizes),
+        "order_id": order_ids,
+        "product_name": names[products],
+    })
+
+
+def ensure_database(workdir: Path, args, n_orders: int) -> str:
+    """SQLite con las órdenes de esta escala; se reutiliza si ya existe con los mismos parámetros."""
+    params = f"o{n_orders}_p{args.products}_b{args.avg_basket}-{args.max_basket}_z{args.zipf}_s{args.seed}"
+    path = workdir / f"orders_{params}.db"
+    if not path.exists():
+        started = time.perf_counter()
+        df = generate_orders(n_orders, args.products, args.avg_basket, args.max_basket, args.zipf, args.seed)
+        staged = path.with_suffix(".tmp")
+        staged.unlink(missing_ok=True)
+        engine = create_engine(f"sqlite:///{staged}")
+        df.to_sql("orders", engine, index=False, chunksize=50_000)
+        with engine.begin() as connection:
+            connection.exec_driver_sql("CREATE INDEX orders_order_id ON orders (order_id)")
+        engine.dispose()
+        staged.rename(path)
+        print(f"🏗️  {n_orders:,} órdenes / {len(df):,} líneas generadas en {time.perf_counter() - started:.1f}s -> {path}")
+    return f"sqlite:///{path}"
+
+
+def sample_transform(df: pd.DataFrame) -> pd.DataFrame:
+    """transform_data típico de un cliente: normaliza espacios en los nombres."""
+    return df.assign(product_name=df["product_name"].str.strip())
+
+
+def run_once(mode: str, db_url: str, snapshot, terms: list[str], min_support: float, args) -> dict:
+    """Una ejecución de run_mba_pipeline, con los tiempos por etapa de su PipelineStats."""
+    stats = PipelineStats()
+    started = time.perf_counter()
+    top_rules = run_mba_pipeline(
+        terms, QUERY, db_url, min_support,
+        transform_fn=sample_transform if args.transform else None,
+        top_n=args.top_n,
+        snapshot=snapshot if mode == "snapshot" else None,
+        engine=args.engine,
+        constrained=args.constrained,
+        metric=args.metric,
+        stats=stats,
+        client_name="benchmark",
+    )
+    total = time.perf_counter() - started
+    counts = {
+        "lines": stats.rows,
+        "orders": stats.orders,
+        "itemsets": stats.itemsets,
+        "rules_mined": stats.rules,
+        "rules_returned": len(top_rules or []),
+    }
+    return {"timings": dict(stats.stages), "total": total, "counts": counts}
+
+
+def summarize(runs: list[dict]) -> dict:
+    """Mediana y mínimo por etapa de varias repeticiones."""
+    stages = {}
+    for stage in STAGES:
+        values = [run["timings"][stage] for run in runs if stage in run["timings"]]
+        if values:
+            stages[stage] = {"median": statistics.median(values), "min": min(values)}
+    totals = [run["total"] for run in runs]
+    return {
+        "stages": stages,
+        "total": {"median": statistics.median(totals), "min": min(totals)},
+        "counts": runs[-1]["counts"],
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent.parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result: dict) -> tuple:
+    return result["mode"], result["n_orders"], result["query"], result["min_support"]
+
+
+def compare(results: list[dict], baseline_path: str, tolerance: float) -> bool:
+    """Imprime la razón contra la corrida base (mediana); True si alguna etapa empeora más de `tolerance`."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {result_key(result): result for result in json.load(f)["results"]}
+
+    print(f"\n📊 Comparación contra {baseline_path} (razón nueva / base, mediana)")
+    print(f"{'modo':>8} {'órdenes':>9} {'soporte':>8} {'búsqueda':<26} {'total':>7}  etapas > {tolerance:.2f}x")
+    print("─" * 90)
+    regressed = False
+    for result in results:
+        base = baseline.get(result_key(result))
+        if base is None:
+            continue
+        ratio = result["total"]["median"] / max(base["total"]["median"], 1e-9)
+        worse = []
+        for stage, timing in result["stages"].items():
+            base_timing = base["stages"].get(stage)
+            # Etapas de pocos milisegundos son ruido de medición
+            if base_timing is None or max(timing["median"], base_timing["median"]) < 5e-3:
+                continue
+            stage_ratio = timing["median"] / max(base_timing["median"], 1e-9)
+            if stage_ratio > tolerance:
+                worse.append(f"{stage} {stage_ratio:.2f}x")
+        regressed |= bool(worse)
+        print(
+            f"{result['mode']:>8} {result['n_orders']:>9,} {result['min_support']:>8} "
+            f"{result['query']:<26} {ratio:>6.2f}x  {', '.join(worse) or 'ok'}"
+        )
+    return regressed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de MBA sobre datos sintéticos")
+    parser.add_argument("--orders", type=int, nargs="+", default=[10_000, 100_000], help="Escalas (órdenes)")
+    parser.add_argument("--products", type=int, default=800, help="Productos distintos")
+    parser.add_argument("--avg-basket", type=float, default=3.5, help="Productos promedio por orden")
+    parser.add_argument("--max-basket", type=int, default=12, help="Productos máximos por orden")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Exponente de popularidad de productos")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--supports", type=float, nargs="+", default=[0.02, 0.01])
+    parser.add_argument("--queries", nargs="+", default=DEFAULT_QUERIES, help="Búsquedas (términos separados por coma)")
+    parser.add_argument("--modes", nargs="+", choices=["db", "snapshot"], default=["db", "snapshot"])
+    parser.add_argument("--engine", default="auto")
+    parser.add_argument("--constrained", action="store_true")
+    parser.add_argument("--transform", action="store_true", help="Incluir un transform_data de ejemplo")
+    parser.add_argument("--top-n", type=int, default=DEFAULT_TOP_N)
+    parser.add_argument("--metric", default="confidence")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", default=str(Path(tempfile.gettempdir()) / "mba_benchmark"))
+    parser.add_argument("--output", help="Archivo JSON de resultados")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Razón máxima aceptada por etapa")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    workdir = Path(args.workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    # El primer trabajo del pool paga el arranque del proceso (spawn + imports): no es parte de `cola`
+    mining_pool.run(int)
+
+    results = []
+    for n_orders in args.orders:
+        db_url = ensure_database(workdir, args, n_orders)
+        snapshot = None
+        snapshot_seconds = None
+        if "snapshot" in args.modes:
+            started = time.perf_counter()
+            full = pd.read_sql_query(QUERY, get_engine(db_url))
+            snapshot = TransactionSnapshot.from_frame("benchmark", clean_transactions(full))
+            snapshot.product_index, snapshot.order_index
+            snapshot_seconds = time.perf_counter() - started
+            del full
+            print(f"📸 Snapshot de {len(snapshot):,} líneas e índices en {snapshot_seconds:.2f}s")
+
+        print(f"\n{'modo':>8} {'soporte':>8} {'búsqueda':<26} {'órdenes':>8} {'reglas':>7} {'total':>8}  etapas (mediana, ms)")
+        print("─" * 110)
+        for mode in args.modes:
+            for query in args.queries:
+                terms = [term.strip() for term in query.split(",")]
+                for min_support in args.supports:
+                    runs = [
+                        run_once(mode, db_url, snapshot, terms, min_support, args) for _ in range(args.repeat)
+                    ]
+                    result = {
+                        "mode": mode,
+                        "n_orders": n_orders,
+                        "query": query,
+                        "min_support": min_support,
+                        **summarize(runs),
+                    }
+                    if mode == "snapshot":
+                        result["snapshot_load_seconds"] = snapshot_seconds
+                    results.append(result)
+                    stages = " ".join(
+                        f"{stage}={timing['median'] * 1e3:.1f}" for stage, timing in result["stages"].items()
+                    )
+                    print(
+                        f"{mode:>8} {min_support:>8} {query:<26} {result['counts']['orders']:>8,} "
+                        f"{result['counts']['rules_mined']:>7,} {result['total']['median']:>7.3f}s  {stages}"
+                    )
+
+    output = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "versions": {
+                "numpy": np.__version__,
+                "pandas": pd.__version__,
+                "scipy": scipy.__version__,
+                "mlxtend": mlxtend.__version__,
+                "sqlalchemy": sqlalchemy.__version__,
+            },
+            "mining_processes": get_settings().mining_processes,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    mining_pool.shutdown()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2)
+        print(f"\n💾 Resultados en {args.output}")
+
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        print("\n❌ Hay etapas más lentas que la corrida base")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Compara los motores de minado (apriori, fpgrowth, fpmax) sobre baskets reales de un cliente.
+
+Carga una sola vez las órdenes que contienen los términos buscados y mide cada
+motor con distintos min_support, verificando que los motores exactos devuelvan
+exactamente las mismas reglas.
+
+Uso:
+    python3 test/compare_engines.py carlsjr "papas, burger" 0.01 0.005
+"""
+import logging
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.clients import ALL_CLIENTS
+from app.services.market_basket import compute_rules, load_data, process_data
+from app.services.mining import select_engine
+
+ENGINES = ["apriori", "fpgrowth", "fpmax"]
+RULE_FIELDS = ["support", "confidence", "lift", "leverage", "conviction", "zhangs_metric"]
+
+
+def rules_signature(rules):
+    """Reglas normalizadas para comparar resultados entre motores."""
+    metrics = [rules[field].round(12).tolist() for field in RULE_FIELDS]
+    return [
+        (tuple(sorted(lhs)), tuple(sorted(rhs)), *values)
+        for lhs, rhs, *values in zip(rules["lhs"], rules["rhs"], *metrics)
+    ]
+
+
+def compare_engines(customer: str, terms: list[str], supports: list[float]):
+    clients = {c.CUSTOMER_NAME: c for c in ALL_CLIENTS}
+    if customer not in clients:
+        print(f"❌ Cliente desconocido: {customer}. Disponibles: {', '.join(clients)}")
+        return
+
+    config = clients[customer].get_config()
+    supports = supports or [config.min_support]
+
+    print(f"\n{'='*70}")
+    print(f"COMPARACIÓN DE MOTORES - {customer.upper()}: {terms}")
+    print(f"{'='*70}\n")
+
+    started = time.perf_counter()
+    df, product_groups = load_data(terms, config.query, config.db_url, client_name=config.name)
+    if df is None:
+        print("❌ No se encontraron órdenes para los términos buscados")
+        return
+    basket = process_data(df)
+    print(f"📦 {len(basket):,} órdenes, {basket.encoded.shape[1]:,} productos "
+          f"(carga {time.perf_counter() - started:.1f}s)\n")
+
+    print(f"{'min_support':>12} {'motor':>10} {'reglas':>8} {'tiempo':>9}  resultado")
+    print(f"{'─'*70}")
+    for min_support in supports:
+        reference = None
+        for engine in ENGINES:
+            started = time.perf_counter()
+            rules = compute_rules(basket, min_support, search_product_groups=product_groups, engine=engine)
+            elapsed = time.perf_counter() - started
+
+            if engine == "fpmax":
+                status = "maximales"
+            elif reference is None:
+                reference = rules_signature(rules)
+                status = "referencia"
+            else:
+                status = "idéntico" if rules_signature(rules) == reference else "❌ DIFERENTE"
+            print(f"{min_support:>12} {engine:>10} {len(rules):>8,} {elapsed:>8.3f}s  {status}")
+        print()
+
+    # Motor que elegiría "auto" con el soporte configurado del cliente
+    print(f"🤖 auto elegiría: {select_engine(basket.encoded, config.min_support)} (min_support={config.min_support})\n")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    if len(sys.argv) < 3:
+        print("\n💡 Uso: python3 test/compare_engines.py <cliente> \"<term1>, <term2>\" [min_support ...]")
+        print("   Ejemplo: python3 test/compare_engines.py carlsjr \"papas, burger\" 0.01 0.005\n")
+        sys.exit(1)
+
+    customer = sys.argv[1]
+    terms = [t.strip() for t in sys.argv[2].split(",")]
+    supports = [float(s) for s in sys.argv[3:]]
+    compare_engines(customer, terms, supports)
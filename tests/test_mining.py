@@ -0,0 +1,89 @@
+"""
+Regresión de las reglas: single_consequent_rules contra association_rules de
+mlxtend, y el minado restringido contra las reglas completas filtradas.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+from mlxtend.frequent_patterns import apriori, association_rules
+
+from app.services.market_basket import process_data
+from app.services.mining import RULE_COLUMNS, mine_constrained_rules, mine_rules
+
+MIN_SUPPORT = 0.01
+METRICS = RULE_COLUMNS[2:]
+
+
+@pytest.fixture(scope="module")
+def baskets():
+    """2000 órdenes sintéticas sobre 40 productos con popularidad tipo Zipf (semilla fija)."""
+    rng = np.random.default_rng(7)
+    popularity = rng.zipf(1.6, size=160) % 40
+    items = [f"Producto {i:02d}" for i in range(40)]
+    rows = [
+        sorted({items[j] for j in rng.choice(popularity, size=max(1, rng.poisson(4)))})
+        for _ in range(2000)
+    ]
+    df = pd.DataFrame({"order_id": range(len(rows)), "product_name": rows}).explode("product_name")
+    return process_data(df)
+
+
+def _encoded_frame(baskets) -> pd.DataFrame:
+    return pd.DataFrame(baskets.encoded.toarray().astype(bool), columns=baskets.columns.tolist())
+
+
+def _by_rule(rules: pd.DataFrame) -> dict:
+    return {
+        (frozenset(lhs), frozenset(rhs)): [float(rules[name].iloc[i]) for name in METRICS]
+        for i, (lhs, rhs) in enumerate(zip(rules["lhs"], rules["rhs"]))
+    }
+
+
+def _assert_same_rules(actual: dict, expected: dict) -> None:
+    assert actual.keys() == expected.keys()
+    for rule, values in expected.items():
+        for name, got, want in zip(METRICS, actual[rule], values):
+            assert (math.isinf(got) and math.isinf(want)) or math.isclose(got, want, rel_tol=1e-9, abs_tol=1e-12), (
+                rule, name, got, want,
+            )
+
+
+@pytest.mark.parametrize("engine", ["apriori", "fpgrowth"])
+def test_single_consequent_rules_match_association_rules(baskets, engine):
+    encoded_df = _encoded_frame(baskets)
+    mined = mine_rules(encoded_df, baskets.encoded, MIN_SUPPORT, engine).to_frame()
+
+    itemsets = apriori(encoded_df, min_support=MIN_SUPPORT, use_colnames=True)
+    reference = association_rules(itemsets, len(encoded_df), metric="lift", min_threshold=1.0)
+    reference = reference[reference["consequents"].map(len) == 1]
+    reference = reference.rename(columns={
+        "antecedents": "lhs", "consequents": "rhs",
+        "antecedent support": "antecedent_support", "consequent support": "consequent_support",
+    })
+
+    assert len(mined) > 0
+    _assert_same_rules(_by_rule(mined), _by_rule(reference))
+
+
+@pytest.mark.parametrize("groups", [
+    [["Producto 01", "Producto 04"]],
+    [["Producto 01"], ["Producto 02", "Producto 03"]],
+])
+def test_constrained_rules_match_filtered_rules(baskets, groups):
+    columns = baskets.columns.tolist()
+    constrained = mine_constrained_rules(baskets.encoded, columns, MIN_SUPPORT, groups).to_frame()
+    rules = mine_rules(_encoded_frame(baskets), baskets.encoded, MIN_SUPPORT, "apriori").to_frame()
+
+    # Itemset con algún producto de cada grupo y algún producto buscado en el LHS
+    searched = {product for group in groups for product in group}
+    keep = [
+        all((lhs | rhs) & set(group) for group in groups) and bool(lhs & searched)
+        for lhs, rhs in zip(rules["lhs"], rules["rhs"])
+    ]
+    expected = rules[keep]
+
+    assert len(expected) > 0
+    _assert_same_rules(_by_rule(constrained), _by_rule(expected))
@@ -0,0 +1,26 @@
+"""Control de admisión del pool de minado con bloques inline (perfiles con header)."""
+
+import pytest
+
+from app.config import get_settings
+from app.services.mining_pool import MiningPool, MiningPoolBusy
+
+
+@pytest.fixture(autouse=True)
+def small_pool(monkeypatch):
+    monkeypatch.setattr(get_settings(), "mining_processes", 1)
+    monkeypatch.setattr(get_settings(), "mining_queue_depth", 1)
+
+
+def test_inline_blocks_take_pool_slots():
+    pool = MiningPool()
+    with pool.inline(), pool.inline():
+        assert pool.stats()["in_flight"] == 1 and pool.stats()["queued"] == 1
+        with pytest.raises(MiningPoolBusy):
+            with pool.inline():
+                pass
+
+    with pool.inline():
+        # Dentro del bloque `run` no vuelve a ocupar lugar
+        assert pool.run(sum, [1, 2]) == 3
+    assert pool.stats()["in_flight"] == 0 and pool.stats()["rejected"] == 1
@@ -0,0 +1,73 @@
+"""
+El índice de reglas responde lo mismo que el minado bajo demanda: mismas
+reglas (incluidas las que tienen un producto buscado como consecuente), mismo
+orden y mismas métricas.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.config import get_settings
+from app.services.market_basket import run_mba_pipeline
+from app.services.metrics import PipelineStats
+from app.services.rule_index import RuleIndex
+from app.services.snapshot import TransactionSnapshot
+
+INDEX_MIN_SUPPORT = 0.002
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    """3000 órdenes sintéticas sobre 30 productos con popularidad tipo Zipf (semilla fija)."""
+    rng = np.random.default_rng(11)
+    popularity = rng.zipf(1.5, size=120) % 30
+    items = [f"Producto {i:02d}" for i in range(30)]
+    rows = [
+        sorted({items[j] for j in rng.choice(popularity, size=max(1, rng.poisson(4)))})
+        for _ in range(3000)
+    ]
+    df = pd.DataFrame({"order_id": range(len(rows)), "product_name": rows}).explode("product_name")
+    return TransactionSnapshot.from_frame("prueba", df)
+
+
+@pytest.fixture(scope="module")
+def rule_index(snapshot):
+    return RuleIndex.build(snapshot, INDEX_MIN_SUPPORT, "apriori")
+
+
+@pytest.fixture(autouse=True)
+def inline_mining(monkeypatch):
+    monkeypatch.setattr(get_settings(), "mining_processes", 0)
+
+
+@pytest.mark.parametrize("terms, min_support, constrained, metric", [
+    (["Producto 01"], 0.02, False, "confidence"),
+    (["Producto 05"], 0.05, False, "lift"),
+    (["Producto 01", "Producto 02"], 0.05, False, "confidence"),
+    (["Producto 01", "Producto 03"], 0.05, True, "zhangs_metric"),
+])
+def test_index_matches_on_demand_mining(snapshot, rule_index, terms, min_support, constrained, metric):
+    stats = PipelineStats()
+    indexed = run_mba_pipeline(
+        terms, "", "", min_support, top_n=5, snapshot=snapshot, engine="apriori",
+        rule_index=rule_index, constrained=constrained, metric=metric, stats=stats,
+    )
+    mined = run_mba_pipeline(
+        terms, "", "", min_support, top_n=5, snapshot=snapshot, engine="apriori",
+        constrained=constrained, metric=metric,
+    )
+
+    assert stats.source == "indice"
+    assert indexed == mined
+
+
+def test_index_falls_back_below_top_n(snapshot, rule_index):
+    stats = PipelineStats()
+    rules = run_mba_pipeline(
+        ["Producto 01", "Producto 02"], "", "", 0.05, top_n=10_000, snapshot=snapshot,
+        engine="apriori", rule_index=rule_index, stats=stats,
+    )
+
+    assert stats.source == "snapshot"
+    assert rules is not None
@@ -0,0 +1,113 @@
+"""
+Snapshots compartidos en disco: el order_index persistido responde lo mismo
+que filter_transactions, sobrevive a un refresh sin cambios, y un worker adopta
+la versión que publicó otro sin esperar al TTL.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.clients.base import ClientConfig
+from app.config import get_settings
+from app.services.market_basket import filter_snapshot, filter_transactions
+from app.services.snapshot import SnapshotStore, TransactionSnapshot
+from app.services.snapshot_files import save_snapshot
+
+CONFIG = ClientConfig(name="prueba", db_url="sqlite://", min_support=0.01, query="SELECT 1")
+
+
+def _snapshot(n_orders: int) -> TransactionSnapshot:
+    df = pd.DataFrame({
+        "order_id": [order for order in range(n_orders) for _ in range(2)],
+        "product_name": ["Papas", "Burger"] * n_orders,
+    })
+    return TransactionSnapshot.from_frame(CONFIG.name, df)
+
+
+@pytest.fixture(autouse=True)
+def snapshot_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(get_settings(), "snapshot_dir", str(tmp_path))
+    return tmp_path
+
+
+def _zipf_snapshot() -> TransactionSnapshot:
+    """3000 órdenes sintéticas sobre 30 productos con popularidad tipo Zipf (semilla fija)."""
+    rng = np.random.default_rng(3)
+    popularity = rng.zipf(1.5, size=120) % 30
+    items = [f"Producto {i:02d}" for i in range(30)]
+    rows = [
+        sorted({items[j] for j in rng.choice(popularity, size=max(1, rng.poisson(4)))})
+        for _ in range(3000)
+    ]
+    df = pd.DataFrame({"order_id": range(len(rows)), "product_name": rows}).explode("product_name")
+    return TransactionSnapshot.from_frame(CONFIG.name, df, watermark_column="order_id")
+
+
+def _lines(df: pd.DataFrame) -> list[tuple]:
+    return sorted(zip(df["order_id"].tolist(), df["product_name"].astype(str).tolist()))
+
+
+@pytest.mark.parametrize("stored", [False, True])
+@pytest.mark.parametrize("terms", [
+    ["Producto 01"],
+    ["Producto 1"],
+    ["Producto 01", "Producto 02"],
+    ["Producto 0", "Producto 2", "Producto 12"],
+])
+def test_order_index_matches_filter_transactions(snapshot_dir, stored, terms):
+    snapshot = _zipf_snapshot()
+    if stored:
+        save_snapshot(snapshot, str(snapshot_dir))
+        snapshot = TransactionSnapshot.from_disk(CONFIG.name, str(snapshot_dir))
+        assert snapshot.stored_order_index is not None
+
+    indexed, indexed_groups = filter_snapshot(snapshot, terms)
+    filtered, groups = filter_transactions(snapshot.to_frame(), terms)
+
+    assert indexed_groups == groups
+    assert _lines(indexed) == _lines(filtered)
+
+
+def test_refresh_without_changes_keeps_stored_order_index(snapshot_dir):
+    snapshot = _zipf_snapshot()
+    save_snapshot(snapshot, str(snapshot_dir))
+    stored = TransactionSnapshot.from_disk(CONFIG.name, str(snapshot_dir))
+    last_order = stored.to_frame().query("order_id == @stored.watermark")
+
+    for delta in (last_order.iloc[0:0], last_order):
+        merged = stored.merge_delta(delta, "order_id")
+        assert merged.version == stored.version
+        assert merged.stored_order_index is stored.stored_order_index
+        assert merged.loaded_at >= stored.loaded_at
+
+
+def test_datetime_watermark_survives_reload(snapshot_dir):
+    created = pd.Timestamp("2026-03-01 12:00:00")
+    df = pd.DataFrame({
+        "order_id": [1, 1, 2],
+        "product_name": ["Papas", "Burger", "Papas"],
+        "created_at": [created, created, created + pd.Timedelta(minutes=5)],
+    })
+    save_snapshot(TransactionSnapshot.from_frame(CONFIG.name, df, watermark_column="created_at"), str(snapshot_dir))
+    stored = TransactionSnapshot.from_disk(CONFIG.name, str(snapshot_dir))
+    assert stored.watermark == created + pd.Timedelta(minutes=5)
+
+    delta = pd.DataFrame({
+        "order_id": [3], "product_name": ["Burger"], "created_at": [created + pd.Timedelta(hours=1)],
+    })
+    merged = stored.merge_delta(delta, "created_at")
+
+    assert merged.watermark == created + pd.Timedelta(hours=1)
+    assert len(merged) == 4
+
+
+def test_get_adopts_version_published_by_another_worker():
+    publisher, reader = SnapshotStore(), SnapshotStore()
+    publisher._publish(CONFIG, _snapshot(10))
+    assert len(reader.get(CONFIG)) == 20
+
+    refreshed = publisher._publish(CONFIG, _snapshot(15))
+
+    assert reader.get(CONFIG).version == refreshed.version
+    assert len(reader.get(CONFIG)) == 30